@@ -17,6 +17,25 @@ def is_admin() -> bool:
     return user.email == ADMIN_EMAIL
 
 
+def _render_ocr_metrics():
+    from ocr_engine import cache_stats
+    stats = cache_stats()
+    st.markdown("### ⚡ OCR Cache")
+    c1,c2,c3,c4 = st.columns(4)
+    c1.metric("Hit Rate", f"{stats['hit_rate']*100:.1f}%")
+    c2.metric("Hits (mem / disk)", f"{stats['hits']} / {stats['disk_hits']}")
+    c3.metric("Misses", stats["misses"])
+    c4.metric("Memory", f"{stats['bytes']/1_048_576:.1f} / {stats['max_bytes']/1_048_576:.0f} MB")
+    st.caption(f"Coalesced duplicate requests: {stats['coalesced']} · in flight now: {stats['in_flight']}")
+    from vision_client import get_transport
+    lat = get_transport().stats()
+    if lat["p95"] is not None:
+        st.caption(f"Vision latency p50 {lat['p50']:.2f}s · p95 {lat['p95']:.2f}s · "
+                   f"hedging {'on' if lat['hedge'] else 'off'} "
+                   f"({lat['hedges']} sent, {lat['hedge_wins']} won)")
+    st.markdown("---")
+
+
 def render_admin_dashboard():
     if not is_admin():
         st.error("Access denied.")
@@ -24,6 +43,7 @@ def render_admin_dashboard():
 
     sb = get_supabase()
     st.markdown("## 🛠 Admin Dashboard")
+    _render_ocr_metrics()
 
     try:
         # Try to get users from auth
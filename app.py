@@ -13,6 +13,7 @@ Run:  streamlit run app.py
 """
 from __future__ import annotations
 import io, logging, sys
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
 
 import streamlit as st
@@ -22,18 +23,21 @@ logging.basicConfig(stream=sys.stdout, level=logging.INFO,
     format="%(asctime)s [%(levelname)s] %(name)s — %(message)s")
 logger = logging.getLogger("pic2docs.app")
 
-from ocr_engine   import run_ocr, LANGUAGE_MAP, OCRResult
-from exporter     import export_txt, export_pdf, export_docx, export_xlsx, export_notebook_png
+from ocr_engine   import run_ocr, LANGUAGE_MAP, FEATURE_MAP, OCRResult, quota_status
+from exporter     import EXPORT_FORMATS, export_pdf_sections
+from export_cache import ExportCache
 from translator   import translate_text, TRANSLATE_LANGUAGES
 from ui_strings   import UI_STRINGS, get_strings, is_rtl, DEFAULT_UI_LANG
 from smart_cleaner import clean_ocr_text, extract_keywords, summarize_text
 from history      import save_to_history, get_history, delete_entry, clear_history, export_history_txt, export_history_json
 from image_tools  import apply_all, pil_to_bytes
-from batch_ocr    import run_batch_ocr, combine_results_txt, batch_stats
+from batch_ocr    import run_batch_ocr, combine_results_txt, pdf_sections, batch_stats, CancelToken
 
 APP_NAME    = "Pic2Docs"
 APP_VERSION = "3.0.0"
 MAX_MB      = 10
+OCR_TIMEOUT = 40                 # seconds the page waits for one image (quota wait + retries)
+BATCH_CALL_TIMEOUT = 60          # seconds per grouped batch call
 ALLOWED_EXT = ["png", "jpg", "jpeg", "webp", "bmp", "tiff"]
 
 st.set_page_config(
@@ -117,6 +121,20 @@ def _init():
             st.session_state[k] = v
 
 
+def _quota_identity() -> tuple[str | None, str]:
+    """(user id, plan) used for the shared Vision quota queue."""
+    return st.session_state.get("quota_user"), st.session_state.get("quota_plan", "free")
+
+
+def _quota_eta_note(images: int = 1) -> None:
+    """Show an ETA instead of failing when the shared Vision quota is busy."""
+    _, plan = _quota_identity()
+    q = quota_status(plan)
+    wait = q["expected_wait"] + max(0, images - 1) * 60 / max(q["per_minute"], 1)
+    if q["queue_depth"] or wait >= 2:
+        st.info(f"⏳ High demand — {q['queue_depth']} images queued. Estimated wait ~{wait:.0f}s.")
+
+
 def _conf_bar(conf: float, s: dict) -> str:
     pct = int(conf * 100)
     color = "#22C87A" if pct >= 80 else ("#F5A623" if pct >= 55 else "#FF5C5C")
@@ -142,26 +160,69 @@ def _stats_html(result: OCRResult, s: dict) -> str:
             f'</div>')
 
 
+@st.cache_resource
+def _export_pool() -> ThreadPoolExecutor:
+    """
+    Long exports run here so the script thread only polls and draws progress.
+    One pool per server process: a module-level pool would be re-created
+    (and its threads leaked) on every rerun.
+    """
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="pic2docs-export")
+
+
+@st.cache_resource
+def _batch_pool() -> ThreadPoolExecutor:
+    """Batch OCR runs here; the script thread polls it (see tab_batch)."""
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="pic2docs-batch")
+
+
+def _export_cache() -> ExportCache:
+    """This browser session's memoized exports."""
+    if "export_cache" not in st.session_state:
+        st.session_state["export_cache"] = ExportCache()
+    return st.session_state["export_cache"]
+
+
+def _export_button(fmt: str, text: str, source: str, label: str,
+                   download_name: str, key: str) -> None:
+    """
+    Download button for one format, built only on request.
+    Until the export exists a same-labelled button stands in; clicking it
+    runs the exporter and swaps in the download in the same run. Plain
+    text costs nothing to build, so it is offered straight away.
+    """
+    cache = _export_cache()
+    ext, mime = EXPORT_FORMATS[fmt]
+    slot = st.empty()
+    data = cache.get(text, source, fmt)
+    if data is None:
+        if fmt != "txt" and not slot.button(label, key=f"prep_{key}", help=f"Prepare {ext.upper()}",
+                                            use_container_width=True):
+            return
+        with st.spinner(f"Preparing {ext.upper()}…"):
+            data, error = cache.build(text, source, fmt)
+        if error:
+            slot.error(error)
+            return
+    slot.download_button(label, data, f"{download_name}.{ext}", mime, key=key,
+                         use_container_width=True)
+
+
 def _export_row(text: str, stem: str, s: dict, key_suffix: str = "") -> None:
     if not text.strip():
         st.warning(s["nothing_to_export"])
         return
     c1,c2,c3,c4,c5 = st.columns(5)
     with c1:
-        d,e = export_txt(text, stem)
-        if not e: st.download_button(s["dl_txt"],  d, f"{stem}.txt",   "text/plain", key=f"dl_txt{key_suffix}",  use_container_width=True)
+        _export_button("txt",  text, stem, s["dl_txt"],      stem, f"dl_txt{key_suffix}")
     with c2:
-        d,e = export_pdf(text, stem)
-        if not e: st.download_button(s["dl_pdf"],  d, f"{stem}.pdf",   "application/pdf", key=f"dl_pdf{key_suffix}", use_container_width=True)
+        _export_button("pdf",  text, stem, s["dl_pdf"],      stem, f"dl_pdf{key_suffix}")
     with c3:
-        d,e = export_docx(text, stem)
-        if not e: st.download_button(s["dl_word"], d, f"{stem}.docx",  "application/vnd.openxmlformats-officedocument.wordprocessingml.document", key=f"dl_docx{key_suffix}", use_container_width=True)
+        _export_button("docx", text, stem, s["dl_word"],     stem, f"dl_docx{key_suffix}")
     with c4:
-        d,e = export_xlsx(text, stem)
-        if not e: st.download_button(s["dl_excel"],d, f"{stem}.xlsx",  "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", key=f"dl_xlsx{key_suffix}", use_container_width=True)
+        _export_button("xlsx", text, stem, s["dl_excel"],    stem, f"dl_xlsx{key_suffix}")
     with c5:
-        d,e = export_notebook_png(text)
-        if not e: st.download_button(s["dl_notebook"],d, f"{stem}.png","image/png", key=f"dl_png{key_suffix}", use_container_width=True)
+        _export_button("png",  text, stem, s["dl_notebook"], stem, f"dl_png{key_suffix}")
 
 
 # ── TAB 1: Main OCR ───────────────────────────────────────────────────────────
@@ -191,6 +252,8 @@ def tab_ocr(s: dict) -> None:
             st.markdown(f'<div class="p2d-section">{s["settings_section"]}</div>', unsafe_allow_html=True)
             lang_name = st.selectbox(s["ocr_lang_label"], list(LANGUAGE_MAP.keys()), key="ocr_lang")
             lang_code = LANGUAGE_MAP[lang_name]
+            feature = FEATURE_MAP[st.selectbox("Text layout", list(FEATURE_MAP), key="ocr_feature",
+                                               help="Auto picks sparse-text mode for signs and labels")]
             preprocess = st.toggle(s["preprocess_label"], value=True, key="ocr_pre")
 
             # Smart cleaner options
@@ -205,8 +268,12 @@ def tab_ocr(s: dict) -> None:
                 if len(display_bytes) > MAX_MB * 1024 * 1024:
                     st.error(s["file_too_large"].format(max_mb=MAX_MB))
                 else:
+                    _quota_eta_note()
+                    user_id, plan = _quota_identity()
                     with st.spinner(s["extracting"]):
-                        result = run_ocr(display_bytes, uploaded.name, lang_code)
+                        result = run_ocr(display_bytes, uploaded.name, lang_code,
+                                         user=user_id, plan=plan, timeout=OCR_TIMEOUT,
+                                         feature=feature)
                     if result.error:
                         st.error(f"❌ {result.error}")
                     else:
@@ -228,6 +295,8 @@ def tab_ocr(s: dict) -> None:
         result: OCRResult | None = st.session_state.get("ocr_result")
         if result and not result.error:
             st.markdown(_stats_html(result, s) + _conf_bar(result.confidence, s), unsafe_allow_html=True)
+            if result.preprocess:
+                st.caption(f"Preprocessing: {result.preprocess.summary()}")
             st.markdown(f'<div class="p2d-section">{s["extracted_section"]}</div>', unsafe_allow_html=True)
             edited = st.text_area("", value=st.session_state["edited_text"],
                                   height=300, key="text_editor", label_visibility="collapsed")
@@ -265,13 +334,11 @@ def tab_ocr(s: dict) -> None:
                                  height=200, key="trans_display")
                     tc1, tc2 = st.columns(2)
                     with tc1:
-                        d,e = export_txt(trans, f"translated_{target}")
-                        if not e: st.download_button(s["dl_trans_txt"], d, f"translated_{target}.txt",
-                                                     "text/plain", key="dl_tt", use_container_width=True)
+                        _export_button("txt", trans, f"translated_{target}", s["dl_trans_txt"],
+                                       f"translated_{target}", "dl_tt")
                     with tc2:
-                        d,e = export_pdf(trans, f"translated_{target}")
-                        if not e: st.download_button(s["dl_trans_pdf"], d, f"translated_{target}.pdf",
-                                                     "application/pdf", key="dl_tp", use_container_width=True)
+                        _export_button("pdf", trans, f"translated_{target}", s["dl_trans_pdf"],
+                                       f"translated_{target}", "dl_tp")
         else:
             st.markdown(f"""
             <div class="p2d-card" style="text-align:center;padding:3rem 1.5rem;margin-top:1rem;">
@@ -340,6 +407,33 @@ def tab_image_tools(s: dict) -> None:
             st.success("✅ Edited image saved! Go to the **OCR** tab and upload the same file.")
 
 
+def _batch_pdf_button(results: list) -> None:
+    """Combined PDF of a batch, streamed on a worker thread with a progress bar."""
+    done = st.session_state.get("batch_pdf")
+    if done is None or done[0] is not results:
+        if not st.button("📄 Prepare combined PDF", key="prep_batch_pdf", use_container_width=True):
+            return
+        progress = st.progress(0.0, text="Laying out PDF…")
+        state = {"done": 0, "title": ""}
+
+        def on_progress(cur, tot, title):       # worker thread: no st.* calls here
+            state.update(done=cur, title=title)
+
+        future = _export_pool().submit(export_pdf_sections, pdf_sections(results),
+                                     "batch_results", len(results), on_progress)
+        while not wait([future], timeout=0.2).done:
+            progress.progress(state["done"] / len(results),
+                              text=f"Laying out PDF… {state['title']} ({state['done']}/{len(results)})")
+        progress.empty()
+        data, error = future.result()
+        if error:
+            st.error(error)
+            return
+        done = st.session_state["batch_pdf"] = (results, data)
+    st.download_button("📄 Download combined PDF", done[1], "batch_results.pdf", "application/pdf",
+                       key="dl_batch_pdf", use_container_width=True)
+
+
 # ── TAB 3: Batch OCR ─────────────────────────────────────────────────────────
 
 def tab_batch(s: dict) -> None:
@@ -351,37 +445,89 @@ def tab_batch(s: dict) -> None:
 
     lang_name = st.selectbox(s["ocr_lang_label"], list(LANGUAGE_MAP.keys()), key="batch_lang")
     lang_code = LANGUAGE_MAP[lang_name]
+    feature = FEATURE_MAP[st.selectbox("Text layout", list(FEATURE_MAP), key="batch_feature",
+                                       help="Auto picks sparse-text mode for signs and labels")]
 
-    if st.button(f"🚀 Process all {len(files)} images", type="primary", key="btn_batch"):
-        progress = st.progress(0)
-        status   = st.empty()
+    def _cancel_batch():
+        job = st.session_state.get("batch_job")
+        if job:
+            job[1].cancel()
+
+    bc1, bc2 = st.columns([3, 1])
+    with bc1:
+        start = st.button(f"🚀 Process all {len(files)} images", type="primary", key="btn_batch",
+                          disabled="batch_job" in st.session_state)
+    with bc2:
+        st.button("⏹ Stop", key="btn_batch_stop", on_click=_cancel_batch, use_container_width=True)
+
+    if start:
+        token = CancelToken()
         file_data = []
         for f in files:
             f.seek(0)
             file_data.append((f.name, f.read()))
 
-        def on_progress(cur, tot, fname):
-            progress.progress(cur / tot)
-            status.markdown(f"Processing **{fname}** ({cur}/{tot})…")
-
-        results = run_batch_ocr(file_data, lang_code, on_progress)
-        progress.progress(1.0)
+        _quota_eta_note(len(file_data))
+        user_id, plan = _quota_identity()
+        state = {"done": 0, "total": len(file_data), "file": ""}
+
+        def on_progress(cur, tot, fname):       # worker thread: no st.* calls here
+            state.update(done=cur, total=tot, file=fname)
+
+        # On a worker so Stop (which reruns the script) cancels the batch instead
+        # of killing it; the items finished before the stop are kept.
+        future = _batch_pool().submit(
+            run_batch_ocr, file_data, lang_code, on_progress, cancel=token,
+            user=user_id, plan=plan, timeout=BATCH_CALL_TIMEOUT, feature=feature)
+        st.session_state["batch_job"] = (future, token, state)
+        st.session_state.pop("batch_results", None)
+
+    # Polled on every run until it finishes, whichever run started it.
+    job = st.session_state.get("batch_job")
+    if job:
+        future, token, state = job
+        progress = st.progress(0.0)
+        status   = st.empty()
+        while not wait([future], timeout=0.2).done:
+            progress.progress(state["done"] / max(1, state["total"]))
+            if token.cancelled:
+                status.markdown("Stopping — waiting for the calls already sent…")
+            else:
+                status.markdown(f"Processing **{state['file']}** ({state['done']}/{state['total']})…")
+        progress.empty()
         status.empty()
-
+        del st.session_state["batch_job"]
+        try:
+            st.session_state["batch_results"] = future.result()
+        except Exception as exc:
+            logger.exception("Batch OCR failed: %s", exc)
+            st.error(f"Batch failed: {exc}")
+        if token.cancelled:
+            st.info(f"Stopped after {state['done']} of {state['total']} images; "
+                    "the rest were not sent.")
+
+    # Kept in the session so export buttons (which rerun the script) do not hide them.
+    results = st.session_state.get("batch_results")
+    if results:
         stats = batch_stats(results)
         st.markdown(f"""
         <div class="stat-row">
             <div class="stat-chip"><span>Total</span>{stats['total']}</div>
             <div class="stat-chip"><span>✅ Success</span>{stats['success']}</div>
             <div class="stat-chip"><span>❌ Failed</span>{stats['failed']}</div>
+            <div class="stat-chip"><span>⏭ Skipped</span>{stats['skipped']}</div>
             <div class="stat-chip"><span>Avg Conf</span>{stats['avg_conf']}%</div>
             <div class="stat-chip"><span>Words</span>{stats['total_words']:,}</div>
         </div>""", unsafe_allow_html=True)
 
         for item in results:
-            icon = "✅" if item.success else "❌"
+            icon = "⏭" if item.skipped else "✅" if item.success else "❌"
             conf = f"{int(item.result.confidence*100)}%" if item.success else "—"
             with st.expander(f"{icon} {item.filename}  —  Confidence: {conf}"):
+                if item.skipped:
+                    st.caption(item.skipped)
+                elif item.result.preprocess:
+                    st.caption(f"Preprocessing: {item.result.preprocess.summary()}")
                 if item.success:
                     st.text_area("", value=item.result.text, height=180,
                                  key=f"batch_text_{item.filename}", label_visibility="collapsed")
@@ -390,18 +536,16 @@ def tab_batch(s: dict) -> None:
 
         combined = combine_results_txt(results)
         st.markdown('<div class="p2d-section">Export Combined Results</div>', unsafe_allow_html=True)
-        c1, c2 = st.columns(2)
+        c1, c2, c3 = st.columns(3)
         with c1:
             st.download_button("📃 Download combined TXT", combined,
                                "batch_results.txt", "text/plain", use_container_width=True)
         with c2:
             all_text = "\n\n".join(i.result.text for i in results if i.success)
-            d, e = export_docx(all_text, "batch_results")
-            if not e:
-                st.download_button("📝 Download combined Word", d,
-                                   "batch_results.docx",
-                                   "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                                   use_container_width=True)
+            _export_button("docx", all_text, "batch_results", "📝 Download combined Word",
+                           "batch_results", "dl_batch_docx")
+        with c3:
+            _batch_pdf_button(results)
 
 
 # ── TAB 4: History ────────────────────────────────────────────────────────────
@@ -432,13 +576,11 @@ def tab_history(s: dict) -> None:
                          key=f"hist_{entry.id}", label_visibility="collapsed")
             hb1, hb2, hb3, hb4 = st.columns(4)
             with hb1:
-                d,e = export_txt(entry.text, entry.filename)
-                if not e: st.download_button("📃 TXT", d, f"{entry.filename}_hist.txt",
-                                             "text/plain", key=f"h_txt_{entry.id}", use_container_width=True)
+                _export_button("txt", entry.text, entry.filename, "📃 TXT",
+                               f"{entry.filename}_hist", f"h_txt_{entry.id}")
             with hb2:
-                d,e = export_pdf(entry.text, entry.filename)
-                if not e: st.download_button("📄 PDF", d, f"{entry.filename}_hist.pdf",
-                                             "application/pdf", key=f"h_pdf_{entry.id}", use_container_width=True)
+                _export_button("pdf", entry.text, entry.filename, "📄 PDF",
+                               f"{entry.filename}_hist", f"h_pdf_{entry.id}")
             with hb3:
                 if st.button("↩ Restore to OCR", key=f"h_restore_{entry.id}", use_container_width=True):
                     st.session_state.update({"edited_text": entry.text})
@@ -484,13 +626,9 @@ def tab_summarize(s: dict) -> None:
         st.text_area("Summary (editable)", value=summary, height=180, key="summary_box")
         sc1, sc2 = st.columns(2)
         with sc1:
-            d,e = export_txt(summary, "summary")
-            if not e: st.download_button("📃 Summary TXT", d, "summary.txt", "text/plain",
-                                         key="dl_sum_txt", use_container_width=True)
+            _export_button("txt", summary, "summary", "📃 Summary TXT", "summary", "dl_sum_txt")
         with sc2:
-            d,e = export_pdf(summary, "summary")
-            if not e: st.download_button("📄 Summary PDF", d, "summary.pdf", "application/pdf",
-                                         key="dl_sum_pdf", use_container_width=True)
+            _export_button("pdf", summary, "summary", "📄 Summary PDF", "summary", "dl_sum_pdf")
 
     # Reading stats
     st.markdown('<div class="p2d-section">📊 Reading Stats</div>', unsafe_allow_html=True)
@@ -529,6 +667,8 @@ def main():
     plan    = profile.get("plan", "free") if profile else "free"
     used    = profile.get("images_used", 0) if profile else 0
     limit   = profile.get("images_limit", 10) if profile else 10
+    st.session_state["quota_user"] = profile.get("id") if profile else None
+    st.session_state["quota_plan"] = plan
 
     with st.sidebar:
         st.markdown(f'<div class="p2d-logo">📄 {APP_NAME} <span class="p2d-badge">v{APP_VERSION}</span></div>',
@@ -1,7 +1,7 @@
 """
 batch_ocr.py — Multi-Image Batch OCR
 ──────────────────────────────────────
-Processes multiple uploaded images in sequence.
+Processes multiple uploaded images in grouped Vision calls.
 - Returns combined text with per-file headers
 - Tracks per-file success/failure
 - Exports combined TXT, PDF, Word
@@ -10,13 +10,43 @@ Processes multiple uploaded images in sequence.
 from __future__ import annotations
 import io
 import logging
-from dataclasses import dataclass
-from typing import Callable
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, replace
+from typing import Callable, Iterator
 
-from ocr_engine import run_ocr, OCRResult
+from ocr_engine import (
+    OCRResult, PreprocessReport, backend_unavailable_result, validate_upload, job_cache_key,
+    build_ocr_request, parse_annotate_response, transport_error_result, http_status,
+    annotate_entries, annotate_tiled, request_payload_bytes, TiledImage, _run_ocr_uncached, OCR_DEADLINE,
+    OCR_FEATURE,
+)
+from ocr_backends import get_backend
+from ocr_cache import Flight, get_cache, get_flights
+from page_filter import PageFilter, Skip
+from vision_client import deadline_after
 
 logger = logging.getLogger("pic2docs.batch")
 
+# Vision accepts up to 16 images per images:annotate call and ~10 MB of JSON.
+MAX_IMAGES_PER_REQUEST = 16
+MAX_REQUEST_PAYLOAD    = 8 * 1024 * 1024     # base64 bytes per grouped call
+BATCH_WORKERS          = 4                   # grouped calls in flight at once
+
+
+class CancelToken:
+    """Shared flag the UI sets to stop a running batch."""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self) -> None:
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
 
 @dataclass
 class BatchItem:
@@ -24,49 +54,278 @@ class BatchItem:
     result:     OCRResult
     success:    bool
     error:      str | None = None
+    skipped:    str | None = None        # why no Vision call was made (blank / duplicate)
+
+
+@dataclass
+class _Pending:
+    index:    int
+    filename: str
+    entry:    dict | TiledImage    # TiledImage: oversized upload, sent as its own group
+    size:     int              # base64 payload bytes
+    key:      str | None
+    report:   PreprocessReport | None = None
+
+
+def _item(filename: str, result: OCRResult) -> BatchItem:
+    if result.error:
+        return BatchItem(filename=filename, result=result,
+                         success=False, error=result.error)
+    return BatchItem(filename=filename, result=result, success=True)
+
+
+def _blank_item(filename: str, skip: Skip, lang_code: str) -> BatchItem:
+    return BatchItem(filename=filename, result=OCRResult("", 0.0, 0, lang_code),
+                     success=True, skipped=skip.reason)
+
+
+def _reused_item(source: BatchItem, filename: str, skip: Skip) -> BatchItem:
+    """A near-duplicate page carries the earlier page's result (or its error)."""
+    return replace(source, filename=filename, skipped=skip.reason)
+
+
+def _group_full(group: list[_Pending], group_bytes: int, nxt: _Pending) -> bool:
+    """True if ``nxt`` must start a new annotate call."""
+    return bool(group) and (len(group) >= MAX_IMAGES_PER_REQUEST
+                            or group_bytes + nxt.size > MAX_REQUEST_PAYLOAD
+                            or _tiled(group[0]) or _tiled(nxt))
+
+
+def _tiled(p: _Pending) -> bool:
+    return isinstance(p.entry, TiledImage)
+
+
+def _should_split(group: list[_Pending], exc: Exception) -> bool:
+    """A 4xx on a multi-image call usually means one malformed entry — isolate it."""
+    status = http_status(exc)
+    if len(group) > 1 and status is not None and 400 <= status < 500 and status != 429:
+        logger.warning("Grouped annotate rejected (HTTP %s) — retrying %d items singly",
+                       status, len(group))
+        return True
+    return False
+
+
+def _with_reports(group: list[_Pending], results: list[OCRResult]) -> list[OCRResult]:
+    return [r._replace(preprocess=p.report) for p, r in zip(group, results)]
+
+
+def _annotate_group(group: list[_Pending], lang_code: str,
+                    user: str | None = None, plan: str | None = None,
+                    deadline: float | None = None) -> list[OCRResult]:
+    """One backend call for the whole group, fanned back out per entry."""
+    return _with_reports(group, _annotate_group_results(group, lang_code, user, plan, deadline))
+
+
+def _annotate_group_results(group: list[_Pending], lang_code: str,
+                            user: str | None, plan: str | None,
+                            deadline: float | None) -> list[OCRResult]:
+    if _tiled(group[0]):
+        return [annotate_tiled(group[0].entry, lang_code, user, plan, deadline)]
+    try:
+        responses = annotate_entries([p.entry for p in group], user, plan, deadline)
+    except Exception as exc:
+        if _should_split(group, exc):
+            return [r for p in group
+                    for r in _annotate_group([p], lang_code, user, plan, deadline)]
+        return [transport_error_result(exc, lang_code)] * len(group)
+
+    if len(responses) != len(group):
+        msg = f"Response error: expected {len(group)} responses, got {len(responses)}"
+        return [OCRResult("", 0.0, 0, lang_code, msg)] * len(group)
+    return [parse_annotate_response(r, lang_code) for r in responses]
 
 
 def run_batch_ocr(
     files: list[tuple[str, bytes]],      # list of (filename, bytes)
     lang_code: str = "en",
     on_progress: Callable[[int, int, str], None] | None = None,
+    workers: int = BATCH_WORKERS,
+    cancel: CancelToken | None = None,
+    cpu_workers: int = 0,
+    user: str | None = None,
+    plan: str | None = None,
+    timeout: float | None = OCR_DEADLINE,
+    skip_pages: bool = True,
+    feature: str = OCR_FEATURE,
 ) -> list[BatchItem]:
     """
     Process multiple images with OCR.
-    
+
+    Images are packed, in input order, into multi-image annotate calls
+    bounded by MAX_IMAGES_PER_REQUEST and MAX_REQUEST_PAYLOAD. Up to
+    ``workers`` calls run concurrently while the calling thread keeps
+    preprocessing; at most ``workers`` groups of payload are held at once.
+    Cached results skip the API, and images already in flight elsewhere
+    (another session, or a duplicate in this batch) wait for that call.
+
     Args:
         files:       List of (filename, file_bytes)
         lang_code:   OCR language code
-        on_progress: Optional callback(current, total, filename)
-    
+        on_progress: Optional callback(done, total, filename), called from the
+                     calling thread as items finish
+        workers:     Concurrent annotate calls (1 = sequential)
+        cancel:      Optional CancelToken; once set, unsent items are
+                     returned as failed with "Cancelled."
+        cpu_workers: >0 moves preprocessing to a process pool pipelined with
+                     the I/O stage (see ocr_pipeline.run_pipeline)
+        user, plan:  Identity for the Vision quota governor's fair queue
+        timeout:     Budget per grouped call, from when it is sent (quota
+                     wait, retries and hedging included)
+        skip_pages:  Short-circuit blank pages and reuse results for
+                     near-duplicates (see page_filter); reported in
+                     BatchItem.skipped
+        feature:     Vision feature per image: "auto" (by text density),
+                     DOCUMENT_TEXT_DETECTION or TEXT_DETECTION
+
     Returns:
-        List of BatchItem results
+        List of BatchItem results, in input order
     """
-    results: list[BatchItem] = []
+    if cpu_workers > 0:
+        from ocr_pipeline import run_pipeline
+        return run_pipeline(files, lang_code, on_progress, cpu_workers=cpu_workers,
+                            io_workers=workers, cancel=cancel, user=user, plan=plan,
+                            timeout=timeout, skip_pages=skip_pages, feature=feature)
+
     total = len(files)
+    results: list[BatchItem | None] = [None] * total
+    done = 0
+    workers = max(1, workers)
 
-    for i, (filename, file_bytes) in enumerate(files):
+    def finish(index: int, item: BatchItem) -> None:
+        nonlocal done
+        results[index] = item
+        done += 1
         if on_progress:
-            on_progress(i + 1, total, filename)
-
-        logger.info("Batch OCR [%d/%d]: %s", i + 1, total, filename)
-        try:
-            result = run_ocr(file_bytes, filename, lang_code)
-            if result.error:
-                results.append(BatchItem(
-                    filename=filename, result=result,
-                    success=False, error=result.error))
-            else:
-                results.append(BatchItem(
-                    filename=filename, result=result, success=True))
-        except Exception as exc:
-            logger.exception("Batch item failed: %s — %s", filename, exc)
-            empty = OCRResult("", 0.0, 0, lang_code, str(exc))
-            results.append(BatchItem(
-                filename=filename, result=empty,
-                success=False, error=str(exc)))
-
-    return results
+            on_progress(done, total, item.filename)
+
+    unavailable = backend_unavailable_result(lang_code)
+    cache = get_cache()
+    get_backend().set_concurrency(workers)
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch-ocr")
+    inflight: dict[Future, list[_Pending]] = {}
+    group: list[_Pending] = []
+    group_bytes = 0
+    calls = 0
+    flights = get_flights()
+    pages = PageFilter() if skip_pages else None
+    duplicates: list[tuple[int, Skip]] = []
+    led: dict[int, tuple[str, Flight]] = {}         # items this batch is fetching for others too
+    following: list[tuple[int, Flight]] = []        # items another caller is already fetching
+
+    def land(index: int, result: OCRResult | None) -> None:
+        if index in led:
+            key, flight = led.pop(index)
+            flights.land(key, flight, result)
+
+    def collect(block: bool) -> None:
+        if not inflight:
+            return
+        finished, _ = wait(list(inflight), timeout=None if block else 0,
+                           return_when=FIRST_COMPLETED)
+        for fut in finished:
+            sent = inflight.pop(fut)
+            try:
+                group_results = fut.result()
+            except Exception as exc:
+                logger.exception("Batch group failed: %s", exc)
+                group_results = [transport_error_result(exc, lang_code)] * len(sent)
+            for p, result in zip(sent, group_results):
+                if result.error is None and p.key:
+                    cache.put(p.key, result)
+                land(p.index, result)
+                finish(p.index, _item(p.filename, result))
+
+    def flush() -> None:
+        nonlocal group, group_bytes, calls
+        if not group:
+            return
+        while len(inflight) >= workers:
+            collect(block=True)
+        calls += 1
+        logger.info("Batch OCR call %d: %d images, %d KB",
+                    calls, len(group), group_bytes // 1024)
+        inflight[pool.submit(_annotate_group, group, lang_code, user, plan,
+                             deadline_after(timeout))] = group
+        group, group_bytes = [], 0
+
+    try:
+        for i, (filename, file_bytes) in enumerate(files):
+            if cancel and cancel.cancelled:
+                break
+            collect(block=False)
+            if unavailable:
+                finish(i, _item(filename, unavailable))
+                continue
+            invalid = validate_upload(file_bytes, lang_code)
+            if invalid:
+                finish(i, _item(filename, invalid))
+                continue
+            skip = pages.check(i, filename, file_bytes) if pages else None
+            if skip is not None:
+                if skip.same_as is None:
+                    finish(i, _blank_item(filename, skip, lang_code))
+                else:
+                    duplicates.append((i, skip))
+                continue
+            key = job_cache_key(file_bytes, lang_code, feature)
+            cached = cache.get(key)
+            if cached is not None:
+                logger.info("Batch OCR cache hit: %s", filename)
+                finish(i, _item(filename, cached))
+                continue
+            flight, leader = flights.join(key)
+            if not leader:
+                following.append((i, flight))
+                continue
+            led[i] = (key, flight)
+            try:
+                entry, report = build_ocr_request(file_bytes, lang_code, feature)
+            except Exception as exc:
+                result = OCRResult("", 0.0, 0, lang_code, f"Image error: {exc}")
+                land(i, result)
+                finish(i, _item(filename, result))
+                continue
+            pending = _Pending(i, filename, entry, request_payload_bytes(entry), key, report)
+            if _group_full(group, group_bytes, pending):
+                flush()
+            group.append(pending)
+            group_bytes += pending.size
+        if not (cancel and cancel.cancelled):
+            flush()
+        while inflight:
+            collect(block=True)
+        # Own groups are done, so waiting here cannot deadlock against another batch.
+        for i, flight in following:
+            if cancel and cancel.cancelled:
+                break
+            result = flight.wait()
+            if result is None:                      # the leader was cancelled; go alone
+                result = _run_ocr_uncached(files[i][1], lang_code, user, plan,
+                                           deadline_after(timeout), feature)
+                if result.error is None:
+                    cache.put(job_cache_key(files[i][1], lang_code, feature), result)
+            finish(i, _item(files[i][0], result))
+        for i, skip in duplicates:
+            source = results[skip.same_as]
+            if source is not None:
+                finish(i, _reused_item(source, files[i][0], skip))
+    finally:
+        # Also reached when on_progress raises (e.g. Streamlit stopping the script).
+        pool.shutdown(wait=False, cancel_futures=True)
+        for i in list(led):
+            land(i, None)                           # release followers; they retry themselves
+
+    for i, (filename, _) in enumerate(files):
+        if results[i] is None:
+            results[i] = BatchItem(filename=filename,
+                                   result=OCRResult("", 0.0, 0, lang_code, "Cancelled."),
+                                   success=False, error="Cancelled.")
+    if pages and (pages.blank or pages.duplicates):
+        logger.info("Batch OCR skipped %d blank and %d duplicate pages",
+                    pages.blank, pages.duplicates)
+    if cancel and cancel.cancelled:
+        logger.info("Batch OCR cancelled after %d/%d items", done, total)
+    return results  # type: ignore[return-value]
 
 
 def combine_results_txt(items: list[BatchItem]) -> bytes:
@@ -77,6 +336,8 @@ def combine_results_txt(items: list[BatchItem]) -> bytes:
             f"{'='*60}\n"
             f"File {i}/{len(items)}: {item.filename}\n"
         )
+        if item.skipped:
+            header += f"Skipped: {item.skipped}\n"
         if item.success:
             conf = int(item.result.confidence * 100)
             header += f"Confidence: {conf}% | Blocks: {item.result.block_count}\n"
@@ -88,13 +349,26 @@ def combine_results_txt(items: list[BatchItem]) -> bytes:
     return "\n\n".join(parts).encode("utf-8")
 
 
+def pdf_sections(items: list[BatchItem]) -> Iterator[tuple[str, str]]:
+    """(title, text) per item for exporter.export_pdf_sections, built lazily."""
+    for i, item in enumerate(items, 1):
+        meta = f"Skipped: {item.skipped}\n" if item.skipped else ""
+        if item.success:
+            conf = int(item.result.confidence * 100)
+            meta += f"Confidence: {conf}% | Blocks: {item.result.block_count}\n\n"
+            yield f"{i}. {item.filename}", meta + item.result.text
+        else:
+            yield f"{i}. {item.filename}", meta + f"ERROR: {item.error}"
+
+
 def batch_stats(items: list[BatchItem]) -> dict:
     """Return summary statistics for a batch run."""
     success = [i for i in items if i.success]
     failed  = [i for i in items if not i.success]
+    scored  = [i for i in success if i.result.block_count]   # blank pages have no score
     avg_conf = (
-        sum(i.result.confidence for i in success) / len(success)
-        if success else 0.0
+        sum(i.result.confidence for i in scored) / len(scored)
+        if scored else 0.0
     )
     total_words = sum(
         len(i.result.text.split()) for i in success
@@ -103,6 +377,7 @@ def batch_stats(items: list[BatchItem]) -> dict:
         "total":       len(items),
         "success":     len(success),
         "failed":      len(failed),
+        "skipped":     sum(1 for i in items if i.skipped),
         "avg_conf":    round(avg_conf * 100, 1),
         "total_words": total_words,
     }
@@ -0,0 +1,413 @@
+"""
+benchmarks.py — Performance Benchmarks
+────────────────────────────────────────
+Ad-hoc measurements for the OCR and export pipelines. Not run in production.
+
+  python benchmarks.py encoders photo.jpg scan.png [--lang en]
+  python benchmarks.py grayscale photo.jpg scan.png [--lang en] [--repeat 3]
+  python benchmarks.py exports [--format docx|xlsx] [--lines 10000] [--repeat 3]
+  python benchmarks.py smoke
+
+OCR confidence is only measured when the active backend is available
+(with Vision, each strategy costs one call per image). ``smoke`` runs every
+OCR entry point against vision_standin under each OCR_GRAYSCALE setting and
+exits non-zero if any image fails.
+"""
+from __future__ import annotations
+import io
+import os
+import sys
+import time
+import asyncio
+import base64
+import random
+import argparse
+import multiprocessing
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageEnhance, ImageOps
+
+import ocr_engine
+from image_codec import (
+    EncodedImage, encode_png, encode_jpeg, encode_webp, encode_for_ocr, decode_for_ocr, _timed_save,
+)
+from ocr_backends import get_backend
+
+
+def _vision_confidence(data: bytes, lang_code: str) -> float | None:
+    if get_backend().unavailable_reason():
+        return None
+    entry = {
+        "image": {"content": base64.b64encode(data).decode("utf-8")},
+        "features": [{"type": "DOCUMENT_TEXT_DETECTION"}],
+        "imageContext": {"languageHints": [lang_code]},
+    }
+    resp = get_backend().annotate([entry])[0]
+    result = ocr_engine.parse_annotate_response(resp, lang_code)
+    return None if result.error else result.confidence
+
+
+def _print_table(headers: list[str], rows: list[list]) -> None:
+    widths = [max(len(str(x)) for x in col) for col in zip(headers, *rows)]
+    for row in [headers, ["-" * w for w in widths], *rows]:
+        print("  ".join(str(x).ljust(w) for x, w in zip(row, widths)))
+
+
+# ── Payload encoders ─────────────────────────────────────────────────────────
+
+ENCODERS = {
+    "png-optimize (legacy)": lambda img: _timed_save(img, "PNG", optimize=True),
+    "png-6":                 encode_png,
+    "png-1":                 lambda img: encode_png(img, compress_level=1),
+    "jpeg-92":               encode_jpeg,
+    "webp-90":               encode_webp,
+    "auto":                  encode_for_ocr,
+}
+
+
+def bench_encoders(paths: list[str], lang_code: str = "en") -> None:
+    """Encode time, bytes on the wire and Vision confidence per strategy."""
+    rows = []
+    for path in paths:
+        img, _ = ocr_engine._enhance(Image.open(path))
+        for name, encoder in ENCODERS.items():
+            try:
+                encoded: EncodedImage = encoder(img)
+            except Exception as exc:
+                rows.append([Path(path).name, name, "-", "-", "-", f"error: {exc}"])
+                continue
+            conf = _vision_confidence(encoded.data, lang_code)
+            rows.append([
+                Path(path).name, name, encoded.fmt,
+                f"{encoded.encode_ms:.1f}", f"{encoded.wire_bytes / 1024:.0f}",
+                "n/a" if conf is None else f"{conf * 100:.1f}%",
+            ])
+    _print_table(["image", "strategy", "format", "encode ms", "wire KB", "confidence"], rows)
+
+
+# ── Grayscale vs RGB preprocessing ───────────────────────────────────────────
+
+def _rgb_payload(file_bytes: bytes) -> tuple[Image.Image, EncodedImage]:
+    """The pre-grayscale path: RGB decode, L↔RGB round trip, 3-channel sharpen, RGB PNG."""
+    img = ocr_engine._auto_align(decode_for_ocr(file_bytes, ocr_engine.MAX_DIMENSION))
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    w, h = img.size
+    if max(w, h) > ocr_engine.MAX_DIMENSION:
+        scale = ocr_engine.MAX_DIMENSION / max(w, h)
+        img = img.resize((int(w * scale), int(h * scale)), Image.LANCZOS)
+    img = ImageOps.autocontrast(img.convert("L"), cutoff=ocr_engine.AUTOCONTRAST_CUTOFF).convert("RGB")
+    img = ImageEnhance.Sharpness(img).enhance(ocr_engine.SHARPNESS_FACTOR)
+    return img, encode_for_ocr(img, ocr_engine.ENCODING_STRATEGY, one_bit=False)
+
+
+def _gray_payload(file_bytes: bytes) -> tuple[Image.Image, EncodedImage]:
+    """The current path (build_annotate_request without the base64 wrapping)."""
+    img = ocr_engine._auto_align(decode_for_ocr(file_bytes, ocr_engine.MAX_DIMENSION, "L"))
+    img, _ = ocr_engine._enhance(img)
+    return img, encode_for_ocr(img, ocr_engine.ENCODING_STRATEGY, one_bit=True)
+
+
+GRAYSCALE_PATHS = {"rgb (legacy)": _rgb_payload, "grayscale": _gray_payload}
+
+
+def bench_grayscale(paths: list[str], lang_code: str = "en", repeat: int = 3) -> None:
+    """CPU time, pixel memory, bytes on the wire and Vision confidence per path."""
+    rows = []
+    for path in paths:
+        file_bytes = Path(path).read_bytes()
+        for name, prepare in GRAYSCALE_PATHS.items():
+            cpu = []
+            for _ in range(max(1, repeat)):
+                start = time.process_time()
+                img, encoded = prepare(file_bytes)
+                cpu.append(time.process_time() - start)
+            pixel_mb = img.width * img.height * len(img.getbands()) / 1_048_576
+            conf = _vision_confidence(encoded.data, lang_code)
+            rows.append([
+                Path(path).name, name, f"{encoded.fmt}/{Image.open(io.BytesIO(encoded.data)).mode}",
+                f"{min(cpu) * 1000:.0f}", f"{pixel_mb:.1f}", f"{encoded.wire_bytes / 1024:.0f}",
+                "n/a" if conf is None else f"{conf * 100:.1f}%",
+            ])
+    _print_table(["image", "path", "payload", "cpu ms", "pixels MB", "wire KB", "confidence"], rows)
+
+
+# ── Export engines ───────────────────────────────────────────────────────────
+
+EXPORT_ENGINES = {                      # format → {label: exporter function name}; first is the reference
+    "docx": {"python-docx (legacy)": "export_docx_python_docx", "bulk XML": "export_docx"},
+    "xlsx": {"openpyxl (legacy)": "export_xlsx_openpyxl", "xlsxwriter": "export_xlsx"},
+}
+EQUIVALENCE_LINES = 2000
+
+_SAMPLE_WORDS = ("invoice total amount due date the of and to in for on with payment "
+                 "reference customer account number page section item qty price tax "
+                 "Straße café naïve 2024-03-01 #4471 €12.50 (see note) — signed").split()
+
+
+def _sample_text(lines: int, seed: int = 7) -> str:
+    """OCR-like batch output: short and long lines, some blank."""
+    rng = random.Random(seed)
+    out = []
+    for _ in range(lines):
+        n = rng.choice((0, 3, 6, 9, 12, 18))
+        out.append(" ".join(rng.choice(_SAMPLE_WORDS) for _ in range(n)))
+    return "\n".join(out)
+
+
+def _rss_kib() -> tuple[int, int]:
+    """(current, peak) resident set in KiB."""
+    try:
+        status = Path("/proc/self/status").read_text()
+        fields = dict(line.split(":", 1) for line in status.splitlines() if ":" in line)
+        return int(fields["VmRSS"].split()[0]), int(fields["VmHWM"].split()[0])
+    except (OSError, KeyError, ValueError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss      # KiB on Linux
+        return peak, peak
+
+
+def _export_child(func: str, lines: int, results) -> None:
+    """One export in a fresh process, with the peak RSS reset just before it."""
+    import exporter
+    text = _sample_text(lines)
+    try:
+        # A child inherits its parent's high-water mark across fork/exec; "5" resets it (Linux).
+        Path("/proc/self/clear_refs").write_text("5")
+    except OSError:
+        pass
+    baseline, _ = _rss_kib()
+    start = time.perf_counter()
+    data, error = getattr(exporter, func)(text, "benchmark")
+    elapsed = time.perf_counter() - start
+    _, peak = _rss_kib()
+    results.put((elapsed, baseline, peak, len(data or b""), error))
+
+
+def _docx_signature(data: bytes) -> list[tuple]:
+    """What a reader sees per paragraph: text, spacing and effective run font."""
+    from docx import Document
+
+    def resolved(style, get):
+        while style is not None:
+            value = get(style)
+            if value is not None:
+                return value
+            style = style.base_style
+        return None
+
+    doc = Document(io.BytesIO(data))
+    core = doc.core_properties
+    rows: list[tuple] = [(core.title, core.subject, core.author, core.comments)]
+    for para in doc.paragraphs:
+        fmt = para.paragraph_format
+        before = fmt.space_before if fmt.space_before is not None else \
+            resolved(para.style, lambda s: s.paragraph_format.space_before)
+        after = fmt.space_after if fmt.space_after is not None else \
+            resolved(para.style, lambda s: s.paragraph_format.space_after)
+        runs = tuple(
+            (run.text,
+             run.font.name or resolved(para.style, lambda s: s.font.name),
+             run.font.size or resolved(para.style, lambda s: s.font.size),
+             run.italic, str(run.font.color.rgb) if run.font.color.type else None)
+            for run in para.runs)
+        rows.append((para.text, before, after, runs))
+    return rows
+
+
+def _xlsx_signature(data: bytes) -> list[tuple]:
+    """Per-cell value and visible style, plus sheet layout."""
+    from openpyxl import load_workbook
+
+    def rgb(color):
+        return str(color.rgb)[-6:].upper() if color is not None and color.type == "rgb" else None
+
+    wb = load_workbook(io.BytesIO(data))
+    rows: list[tuple] = [tuple(wb.sheetnames)]
+    for ws in wb.worksheets:
+        rows.append((ws.title, ws.freeze_panes, sorted(map(str, ws.merged_cells.ranges)),
+                     ws.row_dimensions[1].height, ws.row_dimensions[2].height))
+        for row in ws.iter_rows():
+            for c in row:
+                f, fill, al, bd = c.font, c.fill, c.alignment, c.border
+                rows.append((c.coordinate, c.value, f.name, f.b, f.i, float(f.sz or 0), rgb(f.color),
+                             fill.fill_type, rgb(fill.fgColor) if fill.fill_type else None,
+                             al.horizontal, al.vertical, bool(al.wrap_text),
+                             bd.left.style, rgb(bd.left.color) if bd.left.style else None))
+    return rows
+
+
+_SIGNATURES = {"docx": _docx_signature, "xlsx": _xlsx_signature}
+
+
+def _matches_reference(fmt: str, lines: int) -> dict[str, str]:
+    """Same content and visible formatting as the first (reference) engine?"""
+    import exporter
+    text = _sample_text(lines) + "\n\ttabbed\tline & <markup>\n"
+    stamp, exporter._timestamp = exporter._timestamp, lambda: "2000-01-01 00:00:00"
+    try:
+        outputs = {label: getattr(exporter, func)(text, "benchmark")[0]
+                   for label, func in EXPORT_ENGINES[fmt].items()}
+    finally:
+        exporter._timestamp = stamp
+    signature = _SIGNATURES[fmt]
+    reference = None
+    verdicts = {}
+    for label, data in outputs.items():
+        if data is None:
+            verdicts[label] = "error"
+            continue
+        sig = signature(data)
+        if reference is None:
+            reference = sig
+            verdicts[label] = "reference"
+        else:
+            verdicts[label] = "yes" if sig == reference else "NO"
+    return verdicts
+
+
+def bench_exports(formats: list[str], lines: int = 10_000, repeat: int = 3) -> None:
+    """
+    Wall time, peak RSS and output size per export engine, one process per
+    run, and whether each engine's output matches the reference engine.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    rows = []
+    for fmt in formats:
+        same = _matches_reference(fmt, min(lines, EQUIVALENCE_LINES))
+        for label, func in EXPORT_ENGINES[fmt].items():
+            runs = []
+            for _ in range(max(1, repeat)):
+                results = ctx.Queue()
+                proc = ctx.Process(target=_export_child, args=(func, lines, results))
+                proc.start()
+                runs.append(results.get())
+                proc.join()
+            errors = [r[4] for r in runs if r[4]]
+            if errors:
+                rows.append([fmt, label, "-", "-", "-", f"error: {errors[0]}", "-"])
+                continue
+            rows.append([
+                fmt, label, f"{min(r[0] for r in runs) * 1000:.0f}",
+                f"{max(r[2] for r in runs) / 1024:.0f}",
+                f"{max(r[2] - r[1] for r in runs) / 1024:.0f}",
+                f"{runs[0][3] / 1024:.0f}", same[label],
+            ])
+    print(f"{lines:,} lines, best of {max(1, repeat)} runs")
+    _print_table(["format", "engine", "wall ms", "peak RSS MB", "RSS growth MB", "output KB", "same output"], rows)
+
+
+# ── Smoke check: OCR entry points × preprocessing settings ────────────────────
+
+SMOKE_SETTINGS = {"grayscale": {"OCR_GRAYSCALE": "1"}, "rgb (OCR_GRAYSCALE=0)": {"OCR_GRAYSCALE": "0"}}
+
+
+def _smoke_images() -> list[tuple[str, bytes]]:
+    """A colour text page (JPEG), a sparse label (PNG) and a flat screenshot (PNG)."""
+    from font_registry import get_font_registry
+    font = get_font_registry().pil_font(28)
+    page = Image.new("RGB", (1400, 1800), (236, 230, 214))
+    draw = ImageDraw.Draw(page)
+    for row in range(40):
+        draw.text((80, 80 + row * 42), " ".join(random.Random(row).choices(_SAMPLE_WORDS, k=9)),
+                  fill=(40, 40, 90), font=font)
+    label = Image.new("RGB", (900, 500), (250, 250, 250))
+    ImageDraw.Draw(label).text((200, 220), "EXIT  →  Gate 12", fill=(200, 30, 30), font=font)
+    shot = Image.new("RGBA", (1200, 800), (255, 255, 255, 255))
+    ImageDraw.Draw(shot).text((40, 40), "Settings\nAccount\nPrivacy", fill=(20, 20, 20, 255), font=font)
+    files = []
+    for name, img, fmt in (("page.jpg", page, "JPEG"), ("label.png", label, "PNG"), ("shot.png", shot, "PNG")):
+        buf = io.BytesIO()
+        img.save(buf, fmt)
+        files.append((name, buf.getvalue()))
+    return files
+
+
+def _smoke_child(results) -> None:
+    """Runs in a fresh process so OCR_GRAYSCALE is read by ocr_engine at import."""
+    import batch_ocr, ocr_async, ocr_cache, vision_client
+    from vision_standin import VisionStandin
+
+    rows = []
+    with VisionStandin() as server:
+        vision_client.set_transport(vision_client.VisionTransport(base_url=server.url))
+        files = _smoke_images()
+        paths = {
+            "run_ocr": lambda: [ocr_engine.run_ocr(b, n, "en", use_cache=False) for n, b in files],
+            "run_batch_ocr": lambda: [i.result for i in batch_ocr.run_batch_ocr(files, "en")],
+            "pipeline": lambda: [i.result for i in batch_ocr.run_batch_ocr(files, "en", cpu_workers=1)],
+            "async batch": lambda: [i.result for i in
+                                    asyncio.run(ocr_async.run_batch_ocr_async(files, "en"))],
+        }
+        for path, run in paths.items():
+            ocr_cache.set_cache(ocr_cache.OCRCache())
+            try:
+                outcome = run()
+            except Exception as exc:
+                outcome = [exc] * len(files)
+            for (name, _), result in zip(files, outcome):
+                error = str(result) if isinstance(result, Exception) else result.error
+                feature = getattr(getattr(result, "preprocess", None), "feature", None)
+                rows.append([path, name, feature or "-", error or "ok"])
+    results.put(rows)
+
+
+def smoke() -> int:
+    """Every OCR entry point on sample images under each preprocessing setting."""
+    ctx = multiprocessing.get_context("spawn")
+    rows, failed = [], 0
+    for label, env in SMOKE_SETTINGS.items():
+        saved = {k: os.environ.get(k) for k in (*env, "GOOGLE_VISION_API_KEY")}
+        os.environ.update(env)
+        os.environ.setdefault("GOOGLE_VISION_API_KEY", "smoke")   # the stand-in ignores it
+        try:
+            results = ctx.Queue()
+            proc = ctx.Process(target=_smoke_child, args=(results,))
+            proc.start()
+            child_rows = results.get()
+            proc.join()
+        finally:
+            for k, v in saved.items():
+                if v is None:
+                    os.environ.pop(k, None)
+                else:
+                    os.environ[k] = v
+        for row in child_rows:
+            failed += row[-1] != "ok"
+            rows.append([label, *row])
+    _print_table(["setting", "entry point", "image", "feature", "result"], rows)
+    print(f"{failed} failure(s)")
+    return 1 if failed else 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Pic2Docs performance benchmarks")
+    sub = parser.add_subparsers(dest="bench", required=True)
+    enc = sub.add_parser("encoders", help="compare payload encoders")
+    enc.add_argument("images", nargs="+")
+    enc.add_argument("--lang", default="en")
+    gray = sub.add_parser("grayscale", help="compare grayscale and legacy RGB preprocessing")
+    gray.add_argument("images", nargs="+")
+    gray.add_argument("--lang", default="en")
+    gray.add_argument("--repeat", type=int, default=3)
+    exp = sub.add_parser("exports", help="compare export engines (time, peak RSS)")
+    exp.add_argument("--format", action="append", choices=sorted(EXPORT_ENGINES),
+                     help="repeatable; default: all")
+    exp.add_argument("--lines", type=int, default=10_000)
+    exp.add_argument("--repeat", type=int, default=3)
+    sub.add_parser("smoke", help="run every OCR entry point against the stand-in (grayscale and RGB)")
+
+    args = parser.parse_args(argv)
+    if args.bench == "encoders":
+        bench_encoders(args.images, args.lang)
+    elif args.bench == "grayscale":
+        bench_grayscale(args.images, args.lang, args.repeat)
+    elif args.bench == "exports":
+        bench_exports(args.format or sorted(EXPORT_ENGINES), args.lines, args.repeat)
+    elif args.bench == "smoke":
+        return smoke()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
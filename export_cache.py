@@ -0,0 +1,98 @@
+"""
+export_cache.py — Memoized On-Demand Exports
+──────────────────────────────────────────────
+Streamlit reruns the whole script on every widget change (each keystroke
+in the text editor), so app.py no longer builds every export up front.
+A format is built when the user asks for it and kept here.
+- Key: SHA-256 of text + filename + format; editing the text misses
+- One ExportCache per browser session (st.session_state), LRU-evicted
+  by total bytes under EXPORT_CACHE_MAX_MB
+- Failed exports are not stored, so a retry runs the exporter again
+- Hit / miss counters for sizing
+"""
+from __future__ import annotations
+import os
+import hashlib
+import logging
+from collections import OrderedDict
+
+from exporter import export, ExportResult
+
+logger = logging.getLogger("pic2docs.export_cache")
+
+DEFAULT_MAX_BYTES = int(float(os.environ.get("EXPORT_CACHE_MAX_MB", 24)) * 1_048_576)
+
+
+def export_key(text: str, filename: str, fmt: str) -> str:
+    """Stable hex digest identifying one export."""
+    h = hashlib.sha256()
+    h.update(fmt.encode("utf-8"))
+    h.update(b"\0")
+    h.update(filename.encode("utf-8"))
+    h.update(b"\0")
+    h.update(text.encode("utf-8", "surrogatepass"))
+    return h.hexdigest()
+
+
+class ExportCache:
+    """Per-session LRU of export bytes, bounded by total size."""
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, text: str, filename: str, fmt: str) -> bytes | None:
+        """Bytes of an export built earlier, or None (no export is run)."""
+        key = export_key(text, filename, fmt)
+        data = self._entries.get(key)
+        if data is None:
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return data
+
+    def build(self, text: str, filename: str, fmt: str) -> ExportResult:
+        """Cached bytes, or run the exporter now and remember its output."""
+        data = self.get(text, filename, fmt)
+        if data is not None:
+            return data, None
+        self.misses += 1
+        data, error = export(fmt, text, filename)
+        if error is None:
+            self._remember(export_key(text, filename, fmt), data)
+        return data, error
+
+    def _remember(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            logger.info("Export of %d bytes exceeds the session budget — not cached.", len(data))
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= len(old)
+        self._entries[key] = data
+        self._size += len(data)
+        while self._size > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._size = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries":   len(self._entries),
+            "bytes":     self._size,
+            "max_bytes": self.max_bytes,
+            "hits":      self.hits,
+            "misses":    self.misses,
+            "evictions": self.evictions,
+            "hit_rate":  round(self.hits / lookups, 3) if lookups else 0.0,
+        }
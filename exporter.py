@@ -1,7 +1,8 @@
 """
 exporter.py — Production Export Pipeline
 ─────────────────────────────────────────
-All exports return raw bytes (via BytesIO) — NO disk writes.
+All exports return raw bytes — nothing is saved. Large exports spool
+through anonymous temp files (streamed PDF, constant-memory XLSX).
 Handles:  TXT · PDF · DOCX · XLSX · Notebook-style PNG
 Each function returns (bytes | None, error_message | None).
 """
@@ -9,28 +10,38 @@ Each function returns (bytes | None, error_message | None).
 from __future__ import annotations
 
 import io
+import re
 import logging
+import tempfile
 import textwrap
+from collections import Counter
 from datetime import datetime
-from pathlib import Path
-from typing import Optional
+from typing import Callable, Iterable, Optional
+from xml.sax.saxutils import escape
 
 import pandas as pd
 from docx import Document
 from docx.shared import Inches, Pt, RGBColor
+from docx.enum.style import WD_STYLE_TYPE
 from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.oxml import OxmlElement, parse_xml
+from docx.oxml.ns import nsdecls, qn
 from fpdf import FPDF
+from fpdf.enums import XPos, YPos
 from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+import xlsxwriter
 from PIL import Image, ImageDraw, ImageFont
 
-logger = logging.getLogger("pic2docs.exporter")
+from font_registry import get_font_registry
+from pdf_stream import write_sections
 
-# Path to the bundled Unicode font (DejaVuSans.ttf must be in project root)
-_FONT_PATH = Path(__file__).parent / "DejaVuSans.ttf"
+logger = logging.getLogger("pic2docs.exporter")
 
 ExportResult = tuple[Optional[bytes], Optional[str]]   # (data, error)
 
+PDF_SPOOL_BYTES = 8 * 1024 * 1024      # streamed PDFs spill to a temp file past this
+
 
 # ── Helpers ───────────────────────────────────────────────────────────────────
 
@@ -38,13 +49,6 @@ def _timestamp() -> str:
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
 
-def _font_path_str() -> str:
-    """Return font path as string; log warning if missing."""
-    if not _FONT_PATH.exists():
-        logger.warning("DejaVuSans.ttf not found at %s — PDF may use fallback font.", _FONT_PATH)
-    return str(_FONT_PATH)
-
-
 # ── TXT export ────────────────────────────────────────────────────────────────
 
 def export_txt(text: str, filename: str = "extracted_text") -> ExportResult:
@@ -96,9 +100,8 @@ def export_pdf(text: str, filename: str = "extracted_text") -> ExportResult:
         pdf.set_auto_page_break(auto=True, margin=20)
         pdf.set_margins(left=20, top=20, right=20)
 
-        # Register the bundled Unicode font
-        font_path = _font_path_str()
-        pdf.add_font("DejaVu", style="", fname=font_path, uni=True)
+        # Register the bundled Unicode font (parsed once per process)
+        get_font_registry().add_to_pdf(pdf, "DejaVu")
 
         pdf.add_page()
         pdf.set_font("DejaVu", size=12)
@@ -124,7 +127,7 @@ def export_pdf(text: str, filename: str = "extracted_text") -> ExportResult:
             if line.strip() == "":
                 pdf.ln(4)
             else:
-                pdf.multi_cell(0, 7, txt=line, align="L")
+                pdf.multi_cell(0, 7, txt=line, align="L", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
 
         # Return bytes directly (fpdf2 >= 2.7 returns bytes from output())
         raw = pdf.output()
@@ -137,12 +140,118 @@ def export_pdf(text: str, filename: str = "extracted_text") -> ExportResult:
         return None, f"PDF export failed: {exc}"
 
 
+def export_pdf_sections(sections: Iterable[tuple[str, str]], filename: str = "batch_results",
+                        total: int | None = None,
+                        on_progress: Callable[[int, int, str], None] | None = None) -> ExportResult:
+    """
+    Streaming PDF of many sections — one bookmarked (title, text) pair each,
+    e.g. batch_ocr.pdf_sections(items). Pages are written to a spooled
+    buffer as they fill, so memory stays flat for hundreds of pages.
+    Blocking; the app runs it on a worker thread.
+    """
+    try:
+        with tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_BYTES) as spool:
+            write_sections(spool, sections, filename, total, on_progress)
+            spool.seek(0)
+            return spool.read(), None
+    except Exception as exc:
+        logger.exception("Streaming PDF export failed: %s", exc)
+        return None, f"PDF export failed: {exc}"
+
+
 # ── DOCX export ───────────────────────────────────────────────────────────────
 
+DOCX_BODY_STYLE  = "OCR Text"
+DOCX_CHUNK_LINES = 2000                 # body paragraphs parsed per XML fragment
+
+# Characters XML 1.0 cannot carry (python-docx would raise on them).
+_XML_INVALID = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+
+def _docx_header(doc, filename: str) -> None:
+    """Properties, heading, metadata line and divider (as the original layout)."""
+    core = doc.core_properties
+    core.title = "Pic2Docs — Extracted Text"
+    core.subject = f"OCR output from {filename}"
+    core.author = "Pic2Docs"
+    core.comments = f"Generated at {_timestamp()}"
+
+    h = doc.add_heading("Extracted Text", level=1)
+    h.runs[0].font.color.rgb = RGBColor(80, 70, 200)
+    h.runs[0].font.size = Pt(22)
+
+    meta = doc.add_paragraph()
+    meta.paragraph_format.space_after = Pt(12)
+    run = meta.add_run(f"Source: {filename}  |  Generated: {_timestamp()}")
+    run.font.size = Pt(9)
+    run.font.color.rgb = RGBColor(120, 120, 140)
+    run.italic = True
+
+    p_rule = doc.add_paragraph()
+    pBdr = OxmlElement("w:pBdr")
+    bottom = OxmlElement("w:bottom")
+    bottom.set(qn("w:val"), "single")
+    bottom.set(qn("w:sz"), "6")
+    bottom.set(qn("w:space"), "1")
+    bottom.set(qn("w:color"), "B0A8E8")
+    pBdr.append(bottom)
+    p_rule._p.get_or_add_pPr().append(pBdr)
+
+
+def _docx_paragraph(line: str, style_id: str) -> str:
+    """One body line as WordprocessingML; tabs and stray CRs as python-docx maps them."""
+    text = escape(_XML_INVALID.sub("", line))
+    ppr = f'<w:pPr><w:pStyle w:val="{style_id}"/></w:pPr>'
+    if not text:
+        return f"<w:p>{ppr}</w:p>"
+    text = (text.replace("\t", '</w:t><w:tab/><w:t xml:space="preserve">')
+                .replace("\r", '</w:t><w:br/><w:t xml:space="preserve">'))
+    return f'<w:p>{ppr}<w:r><w:t xml:space="preserve">{text}</w:t></w:r></w:p>'
+
+
 def export_docx(text: str, filename: str = "extracted_text") -> ExportResult:
     """
     Professional Word document with metadata, styled heading, and editable body.
-    Fully in-memory — no disk writes.
+    Body formatting lives once on the "OCR Text" paragraph style; the lines
+    are written as XML in chunks instead of one python-docx object per line.
+    Fully in-memory.
+    """
+    try:
+        doc = Document()
+        _docx_header(doc, filename)
+
+        normal = doc.styles["Normal"]
+        normal.font.name = "Calibri"
+        normal.font.size = Pt(11)
+        body_style = doc.styles.add_style(DOCX_BODY_STYLE, WD_STYLE_TYPE.PARAGRAPH)
+        body_style.base_style = normal
+        body_style.font.name = "Calibri"
+        body_style.font.size = Pt(11)
+        body_style.paragraph_format.space_before = Pt(2)
+        body_style.paragraph_format.space_after = Pt(2)
+
+        # Body text — each OCR line as its own paragraph, before the section properties
+        sect_pr = doc.element.body.sectPr
+        lines = text.split("\n")
+        for i in range(0, len(lines), DOCX_CHUNK_LINES):
+            xml = "".join(_docx_paragraph(line, body_style.style_id)
+                          for line in lines[i:i + DOCX_CHUNK_LINES])
+            for p in parse_xml(f"<w:body {nsdecls('w')}>{xml}</w:body>"):
+                sect_pr.addprevious(p)
+
+        buf = io.BytesIO()
+        doc.save(buf)
+        return buf.getvalue(), None
+
+    except Exception as exc:
+        logger.exception("DOCX export failed: %s", exc)
+        return None, f"DOCX export failed: {exc}"
+
+
+def export_docx_python_docx(text: str, filename: str = "extracted_text") -> ExportResult:
+    """
+    The previous export_docx: one python-docx paragraph per line, fonts set
+    on every run. Kept as the output reference for benchmarks.py.
     """
     try:
         doc = Document()
@@ -207,12 +316,86 @@ def export_docx(text: str, filename: str = "extracted_text") -> ExportResult:
 
 # ── XLSX export ───────────────────────────────────────────────────────────────
 
+def _word_key(word: str) -> str:
+    return word.lower().strip(".,!?;:\"'()[]")
+
+
 def export_xlsx(text: str, filename: str = "extracted_text") -> ExportResult:
     """
     Formatted Excel workbook with:
       - Sheet 1: Line-by-line extracted text with styled header
       - Sheet 2: Word frequency analysis
-    Fully in-memory — no disk writes.
+    Written row by row (xlsxwriter constant_memory) with each cell format
+    declared once, so 10k-line batch outputs stay fast and small.
+    Text is always written as text, never as a formula or hyperlink.
+    """
+    try:
+        buf = io.BytesIO()
+        wb = xlsxwriter.Workbook(buf, {"constant_memory": True})
+        font = {"font_name": "Calibri"}
+        border = {"border": 1, "border_color": "#D0CEEE"}
+        title_fmt   = wb.add_format({**font, "bold": True, "font_color": "#FFFFFF", "font_size": 12,
+                                     "bg_color": "#5046E4", "align": "center", "valign": "vcenter"})
+        meta_fmt    = wb.add_format({**font, "italic": True, "font_color": "#5046E4", "font_size": 9,
+                                     "bg_color": "#EEEDFF", "align": "left", "valign": "vcenter"})
+        col_fmt     = wb.add_format({**font, "bold": True, "font_color": "#5046E4", "font_size": 10,
+                                     "bg_color": "#F0EFFF", "align": "center", **border})
+        body_fmt    = wb.add_format({**font, "font_size": 11, "valign": "vcenter", "text_wrap": True, **border})
+        alt_fmt     = wb.add_format({**font, "font_size": 11, "valign": "vcenter", "text_wrap": True, **border,
+                                     "bg_color": "#F8F8FF"})
+        header_fmt  = wb.add_format({**font, "bold": True, "font_color": "#FFFFFF", "font_size": 12,
+                                     "bg_color": "#5046E4", "align": "center"})
+        word_fmt    = wb.add_format({**font, "font_size": 11})
+
+        # ── Sheet 1: Extracted Text ──
+        ws1 = wb.add_worksheet("Extracted Text")
+        ws1.set_column(0, 0, 6)
+        ws1.set_column(1, 1, 80)
+        ws1.set_column(2, 2, 12)
+        ws1.freeze_panes(3, 0)
+        ws1.set_row(0, 24)
+        ws1.merge_range(0, 0, 0, 2, "Pic2Docs — Extracted Text", title_fmt)
+        ws1.set_row(1, 18)
+        ws1.merge_range(1, 0, 1, 2, f"Source: {filename}  |  Generated: {_timestamp()}", meta_fmt)
+        for col, header in enumerate(["#", "Text Line", "Word Count"]):
+            ws1.write_string(2, col, header, col_fmt)
+
+        # Rows go out in order; word frequencies are counted on the same pass.
+        freq: Counter[str] = Counter()
+        for n, line in enumerate(text.split("\n"), start=1):
+            row = n + 2
+            fmt = alt_fmt if row % 2 else body_fmt          # 1-based row number even → shaded
+            words = line.split()
+            ws1.write_number(row, 0, n, fmt)
+            if line:
+                ws1.write_string(row, 1, line, fmt)
+            else:
+                ws1.write_blank(row, 1, None, fmt)
+            ws1.write_number(row, 2, len(words), fmt)
+            freq.update(_word_key(w) for w in words)
+
+        # ── Sheet 2: Word Frequency ──
+        ws2 = wb.add_worksheet("Word Frequency")
+        ws2.set_column(0, 0, 30)
+        ws2.set_column(1, 1, 12)
+        ws2.write_string(0, 0, "Word", header_fmt)
+        ws2.write_string(0, 1, "Count", header_fmt)
+        for row, (word, count) in enumerate(freq.most_common(50), start=1):
+            ws2.write_string(row, 0, word, word_fmt)
+            ws2.write_number(row, 1, count, word_fmt)
+
+        wb.close()
+        return buf.getvalue(), None
+
+    except Exception as exc:
+        logger.exception("XLSX export failed: %s", exc)
+        return None, f"XLSX export failed: {exc}"
+
+
+def export_xlsx_openpyxl(text: str, filename: str = "extracted_text") -> ExportResult:
+    """
+    The previous openpyxl implementation of export_xlsx, kept as the
+    reference for benchmarks.py (same sheets, per-cell style objects).
     """
     try:
         wb = Workbook()
@@ -318,7 +501,6 @@ def export_notebook_png(text: str) -> ExportResult:
     Returns PNG bytes.
     """
     try:
-        font_path = _font_path_str()
         margin     = 60
         line_height = 28
         font_size   = 16
@@ -330,8 +512,9 @@ def export_notebook_png(text: str) -> ExportResult:
         rule_color  = (200, 200, 220)
 
         try:
-            body_font  = ImageFont.truetype(font_path, font_size)
-            title_font = ImageFont.truetype(font_path, title_size)
+            fonts      = get_font_registry()
+            body_font  = fonts.pil_font(font_size)
+            title_font = fonts.pil_font(title_size)
         except Exception:
             body_font  = ImageFont.load_default()
             title_font = ImageFont.load_default()
@@ -387,3 +570,29 @@ def export_notebook_png(text: str) -> ExportResult:
     except Exception as exc:
         logger.exception("PNG export failed: %s", exc)
         return None, f"Notebook PNG export failed: {exc}"
+
+
+# ── Format dispatch ───────────────────────────────────────────────────────────
+
+EXPORT_FORMATS: dict[str, tuple[str, str]] = {          # format → (extension, MIME type)
+    "txt":  ("txt",  "text/plain"),
+    "pdf":  ("pdf",  "application/pdf"),
+    "docx": ("docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"),
+    "xlsx": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "png":  ("png",  "image/png"),
+}
+
+
+def export(fmt: str, text: str, filename: str = "extracted_text") -> ExportResult:
+    """Run the exporter for ``fmt`` (a key of EXPORT_FORMATS)."""
+    if fmt == "txt":
+        return export_txt(text, filename)
+    if fmt == "pdf":
+        return export_pdf(text, filename)
+    if fmt == "docx":
+        return export_docx(text, filename)
+    if fmt == "xlsx":
+        return export_xlsx(text, filename)
+    if fmt == "png":
+        return export_notebook_png(text)
+    return None, f"Unknown export format: {fmt}"
@@ -0,0 +1,186 @@
+"""
+font_registry.py — Shared Font Registry for Exports
+────────────────────────────────────────────────────
+exporter.py used to re-read and re-parse DejaVuSans.ttf (~760 KB) for every
+PDF and every Notebook PNG. The registry does that once per process.
+- Font bytes read once; fpdf2 metrics (cmap, glyph ids, advance widths,
+  descriptor) parsed once and shared read-only by every document
+- add_to_pdf: registers the font on one FPDF from the shared metrics —
+  only the per-document parts (glyph subset, font descriptor object,
+  a lazy fontTools handle over the cached bytes) are created per call,
+  because fpdf2 subsets that handle in place when the PDF is written
+- pil_font: FreeType faces per (thread, size); FreeType faces are not
+  safe to render from two threads at once
+Thread-safe: the one-time parse is guarded by a lock.
+"""
+from __future__ import annotations
+import io
+import re
+import logging
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+
+from fontTools import ttLib
+from fpdf.enums import FontDescriptorFlags, TextEmphasis
+from fpdf.fonts import PDFFontDescriptor, SubsetMap, TTFFont
+from PIL import ImageFont
+
+logger = logging.getLogger("pic2docs.fonts")
+
+# Bundled Unicode font (DejaVuSans.ttf must be in project root)
+FONT_PATH = Path(__file__).parent / "DejaVuSans.ttf"
+
+
+class _Widths(dict):
+    """Advance widths by code point; unknown characters get the default without being inserted."""
+
+    def __init__(self, default: int):
+        super().__init__()
+        self.default = default
+
+    def __missing__(self, key: int) -> int:
+        return self.default
+
+
+@dataclass(frozen=True)
+class PDFMetrics:
+    """Everything fpdf2's TTFFont derives from the file, computed once."""
+    name:      str
+    scale:     float
+    desc:      dict                 # PDFFontDescriptor keyword arguments
+    cw:        _Widths
+    cmap:      dict[int, str]
+    glyph_ids: dict[int, int]
+    up:        int
+    ut:        int
+
+
+def _parse_pdf_metrics(data: bytes) -> PDFMetrics:
+    """Same figures as fpdf.fonts.TTFFont.__init__ (fpdf2 2.7)."""
+    font = ttLib.TTFont(io.BytesIO(data), recalcTimestamp=False, fontNumber=0, lazy=True)
+    head, hhea, post, os2 = font["head"], font["hhea"], font["post"], font["OS/2"]
+    hmtx = font["hmtx"].metrics
+    scale = 1000 / head.unitsPerEm
+    default_width = round(scale * hmtx[".notdef"][0])
+    cap_height = getattr(os2, "sCapHeight", hhea.ascent)
+
+    flags = FontDescriptorFlags.SYMBOLIC
+    if post.isFixedPitch:
+        flags |= FontDescriptorFlags.FIXED_PITCH
+    if post.italicAngle != 0:
+        flags |= FontDescriptorFlags.ITALIC
+    if os2.usWeightClass >= 600:
+        flags |= FontDescriptorFlags.FORCE_BOLD
+    desc = dict(
+        ascent=round(hhea.ascent * scale),
+        descent=round(hhea.descent * scale),
+        cap_height=round(cap_height * scale),
+        flags=flags,
+        font_b_box=(f"[{head.xMin * scale:.0f} {head.yMin * scale:.0f}"
+                    f" {head.xMax * scale:.0f} {head.yMax * scale:.0f}]"),
+        italic_angle=int(post.italicAngle),
+        stem_v=round(50 + int(pow((os2.usWeightClass / 65), 2))),
+        missing_width=default_width,
+    )
+
+    cmap = font.getBestCmap()
+    cw = _Widths(default_width)
+    glyph_ids = {}
+    for char, glyph in cmap.items():
+        w = hmtx[glyph][0]
+        cw[char] = round(scale * (0 if w == 65535 else w) + 0.001)   # ROUND_HALF_UP
+        glyph_ids[char] = font.getGlyphID(glyph)
+
+    metrics = PDFMetrics(
+        name=re.sub("[ ()]", "", font["name"].getBestFullName()),
+        scale=scale, desc=desc, cw=cw, cmap=cmap, glyph_ids=glyph_ids,
+        up=round(post.underlinePosition * scale),
+        ut=round(post.underlineThickness * scale),
+    )
+    font.close()
+    return metrics
+
+
+class FontRegistry:
+    """One font file, loaded once and shared by the PDF and PNG exporters."""
+
+    def __init__(self, path: str | Path = FONT_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._data: bytes | None = None
+        self._pdf: PDFMetrics | None = None
+        self._local = threading.local()
+
+    def data(self) -> bytes:
+        """Raw font file bytes (read on first use)."""
+        if self._data is None:
+            with self._lock:
+                if self._data is None:
+                    if not self.path.exists():
+                        logger.warning("%s not found — PDF and PNG exports need it.", self.path)
+                    self._data = self.path.read_bytes()
+        return self._data
+
+    def pdf_metrics(self) -> PDFMetrics:
+        """Metrics fpdf2 needs, parsed on first use (also used by pdf_stream)."""
+        if self._pdf is None:
+            data = self.data()
+            with self._lock:
+                if self._pdf is None:
+                    self._pdf = _parse_pdf_metrics(data)
+                    logger.info("Parsed %s for PDF export (%d glyphs).",
+                                self.path.name, len(self._pdf.glyph_ids))
+        return self._pdf
+
+    def add_to_pdf(self, pdf, family: str = "DejaVu", style: str = "") -> None:
+        """Equivalent of ``pdf.add_font(family, style, fname=path)`` without re-parsing."""
+        fontkey = f"{family.lower()}{style}"
+        if fontkey in pdf.fonts:
+            return
+        m = self.pdf_metrics()
+        font = TTFFont.__new__(TTFFont)
+        font.i = len(pdf.fonts) + 1
+        font.type = "TTF"
+        font.ttffile = str(self.path)
+        font.fontkey = fontkey
+        font.ttfont = ttLib.TTFont(io.BytesIO(self.data()), recalcTimestamp=False,
+                                   fontNumber=0, lazy=True)
+        font.scale = m.scale
+        font.desc = PDFFontDescriptor(**m.desc)        # output() attaches the font stream to it
+        font.cw = m.cw
+        font.cmap = m.cmap
+        font.glyph_ids = m.glyph_ids
+        font.missing_glyphs = []
+        font.name = m.name
+        font.up = m.up
+        font.ut = m.ut
+        font.emphasis = TextEmphasis.coerce(style)
+        reserved = "\x00 \r\n"
+        if pdf.str_alias_nb_pages:
+            reserved += "0123456789" + pdf.str_alias_nb_pages
+        font.subset = SubsetMap(font, [ord(char) for char in reserved])
+        pdf.fonts[fontkey] = font
+
+    def pil_font(self, size: int) -> ImageFont.FreeTypeFont:
+        """FreeType face at ``size`` px for the calling thread."""
+        faces = getattr(self._local, "faces", None)
+        if faces is None:
+            faces = self._local.faces = {}
+        face = faces.get(size)
+        if face is None:
+            face = faces[size] = ImageFont.truetype(io.BytesIO(self.data()), size)
+        return face
+
+
+_registry = FontRegistry()
+
+
+def get_font_registry() -> FontRegistry:
+    return _registry
+
+
+def set_font_registry(registry: FontRegistry) -> None:
+    """Swap the process-wide registry (tests, another font)."""
+    global _registry
+    _registry = registry
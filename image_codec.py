@@ -0,0 +1,168 @@
+"""
+image_codec.py — Decoding & Payload Encoding for OCR Uploads
+──────────────────────────────────────────────────────────────
+Decodes uploads at the smallest resolution OCR needs:
+- JPEG draft mode (DCT scaling 1/2, 1/4, 1/8) straight from the file
+- Image.reduce() integer pre-shrink before the final LANCZOS resize
+- Optional single-channel decode (JPEG luma only) for grayscale pipelines
+Picks the wire format for preprocessed images sent to Vision.
+- PNG  (tunable zlib level) for bilevel scans — 1 bit per pixel, lossless
+- JPEG (high quality) for photos — fast to encode, far smaller than PNG
+- WebP when the Pillow build supports it and JPEG misses the target size
+- "auto" chooses by content and a target payload size
+"""
+from __future__ import annotations
+import io
+import math
+import time
+import logging
+from dataclasses import dataclass
+
+from PIL import Image, features
+
+logger = logging.getLogger("pic2docs.codec")
+
+ENCODE_STRATEGIES    = ("auto", "png", "jpeg", "webp")
+PNG_COMPRESS_LEVEL   = 6
+JPEG_QUALITY         = 92
+WEBP_QUALITY         = 90
+TARGET_PAYLOAD_BYTES = 1_500_000     # raw bytes; base64 adds a third on the wire
+_FALLBACK_QUALITIES  = (85, 75)
+
+_BILEVEL_THUMB       = 256
+_BILEVEL_TOLERANCE   = 40            # grey levels from pure black / white
+_BILEVEL_FRACTION    = 0.92          # share of pixels that must be near-extreme
+
+
+@dataclass
+class EncodedImage:
+    data:      bytes
+    fmt:       str                   # "PNG" / "JPEG" / "WEBP"
+    encode_ms: float
+
+    @property
+    def wire_bytes(self) -> int:
+        """Size after base64 encoding, as sent in the JSON payload."""
+        return (len(self.data) + 2) // 3 * 4
+
+
+def decode_for_ocr(file_bytes: bytes, max_dimension: int | None,
+                   mode: str | None = None) -> Image.Image:
+    """
+    Open an upload, decoding no more pixels than needed for a longest side
+    of ``max_dimension`` (None = full resolution). The result may still be
+    up to 2x larger than the target; the caller does the final resize.
+    ``mode="L"`` returns grayscale, decoding only the luma plane of JPEGs.
+    EXIF metadata is kept, so orientation can still be applied.
+    """
+    img = Image.open(io.BytesIO(file_bytes))
+    w, h = img.size
+    longest = max(w, h)
+    if not max_dimension or longest <= max_dimension:
+        if mode and img.format == "JPEG":
+            img.draft(mode, img.size)
+        return to_mode(img, mode)
+    if img.format == "JPEG":
+        scale = max_dimension / longest
+        # draft() picks the smallest DCT scale that is still >= the requested size.
+        img.draft(mode, (math.ceil(w * scale), math.ceil(h * scale)))
+        longest = max(img.size)
+    factor = longest // max_dimension
+    if factor >= 2:
+        img = img.reduce(factor)
+    return to_mode(img, mode)
+
+
+def to_mode(img: Image.Image, mode: str | None) -> Image.Image:
+    """``img`` in ``mode`` (None = unchanged), keeping metadata; alpha is flattened onto white."""
+    if not mode or img.mode == mode:
+        return img
+    if mode == "L" and img.mode in ("RGBA", "LA", "P"):
+        # Flatten onto white first: transparent areas would otherwise turn black.
+        rgba = img.convert("RGBA")
+        flat = Image.new("RGBA", rgba.size, (255, 255, 255, 255))
+        flat.alpha_composite(rgba)
+        flat.info = img.info
+        img = flat
+    converted = img.convert(mode)
+    converted.info = img.info
+    return converted
+
+
+def to_bilevel(img: Image.Image, threshold: int = 128) -> Image.Image:
+    """1-bit copy of a clean scan (PNG stores it at 1 bit per pixel)."""
+    return img.convert("L").point(lambda v: 255 if v >= threshold else 0, mode="1")
+
+
+def webp_available() -> bool:
+    return bool(features.check("webp"))
+
+
+def is_bilevel(img: Image.Image) -> bool:
+    """True for clean scans: nearly every pixel is close to black or white."""
+    # NEAREST sampling keeps real pixel values; averaging would turn text grey.
+    thumb = img.convert("L").resize((_BILEVEL_THUMB, _BILEVEL_THUMB), Image.NEAREST)
+    hist = thumb.histogram()
+    total = sum(hist) or 1
+    extremes = sum(hist[:_BILEVEL_TOLERANCE]) + sum(hist[256 - _BILEVEL_TOLERANCE:])
+    return extremes / total >= _BILEVEL_FRACTION
+
+
+def _timed_save(img: Image.Image, fmt: str, **params) -> EncodedImage:
+    start = time.perf_counter()
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, **params)
+    return EncodedImage(buf.getvalue(), fmt, (time.perf_counter() - start) * 1000)
+
+
+def encode_png(img: Image.Image, compress_level: int = PNG_COMPRESS_LEVEL) -> EncodedImage:
+    return _timed_save(img, "PNG", compress_level=compress_level)
+
+
+def encode_jpeg(img: Image.Image, quality: int = JPEG_QUALITY) -> EncodedImage:
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    return _timed_save(img, "JPEG", quality=quality, subsampling=0 if quality >= 90 else 2)
+
+
+def encode_webp(img: Image.Image, quality: int = WEBP_QUALITY) -> EncodedImage:
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGB")
+    return _timed_save(img, "WEBP", quality=quality, method=4)
+
+
+def encode_for_ocr(img: Image.Image, strategy: str = "auto",
+                   target_bytes: int = TARGET_PAYLOAD_BYTES,
+                   one_bit: bool = True) -> EncodedImage:
+    """
+    Encode ``img`` for upload.
+    auto: bilevel scans → PNG (1-bit unless ``one_bit`` is False); photos →
+    JPEG, stepping quality down and finally trying WebP (slow to encode)
+    only while the payload exceeds ``target_bytes``.
+    """
+    if strategy == "png":
+        return encode_png(img)
+    if strategy == "jpeg":
+        return encode_jpeg(img)
+    if strategy == "webp":
+        return encode_webp(img) if webp_available() else encode_jpeg(img)
+    if strategy != "auto":
+        raise ValueError(f"Unknown encoding strategy: {strategy!r}")
+
+    if is_bilevel(img):
+        encoded = encode_png(to_bilevel(img) if one_bit else img)
+        if len(encoded.data) <= target_bytes:
+            return encoded
+    encoded = encode_jpeg(img)
+    for quality in _FALLBACK_QUALITIES:
+        if len(encoded.data) <= target_bytes:
+            return encoded
+        encoded = encode_jpeg(img, quality)
+    if len(encoded.data) > target_bytes and webp_available():
+        webp = encode_webp(img)
+        if len(webp.data) < len(encoded.data):
+            encoded = webp
+    if len(encoded.data) > target_bytes:
+        logger.info("Payload %d KB still above %d KB target",
+                    len(encoded.data) // 1024, target_bytes // 1024)
+    return encoded
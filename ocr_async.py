@@ -0,0 +1,314 @@
+"""
+ocr_async.py — Native asyncio OCR API
+───────────────────────────────────────
+For services embedding Pic2Docs: one event loop drives many concurrent
+Vision requests instead of one thread per in-flight image.
+- run_ocr_async / run_batch_ocr_async mirror run_ocr / run_batch_ocr and
+  return the same OCRResult / BatchItem types
+- Preprocessing is the shared ocr_engine code, run in an executor
+- Vision calls use the shared httpx pool (vision_client.get_async_transport);
+  backends without annotate_async run in the executor
+- Identical in-flight jobs coalesce with run_ocr / run_batch_ocr through the
+  shared SingleFlight; followers await the flight on the loop, not a thread
+"""
+from __future__ import annotations
+import asyncio
+import logging
+from concurrent.futures import Executor
+from typing import Callable
+
+from ocr_engine import (
+    OCRResult, backend_unavailable_result, validate_upload, job_cache_key,
+    build_ocr_request, parse_annotate_response, transport_error_result,
+    annotate_tiled, request_payload_bytes,
+    quota_wait_budget, OCR_DEADLINE, OCR_FEATURE,
+)
+from ocr_backends import get_backend
+from ocr_cache import Flight, get_cache, get_flights
+from quota import get_governor
+from vision_client import deadline_after, time_left
+from batch_ocr import (
+    BatchItem, BATCH_WORKERS, MAX_IMAGES_PER_REQUEST, _Pending, _item, _group_full, _should_split, _tiled,
+    _blank_item, _reused_item, _with_reports,
+)
+from page_filter import PageFilter, Skip
+
+logger = logging.getLogger("pic2docs.async")
+
+
+async def _follow(flight: Flight, timeout: float | None = None) -> OCRResult | None:
+    """
+    Await another caller's flight without holding an executor thread.
+    None when the leader landed nothing (raised or was cancelled) or on timeout.
+    """
+    loop = asyncio.get_running_loop()
+    waiter = loop.create_future()
+
+    def settle(result: OCRResult | None) -> None:
+        if not waiter.done():
+            waiter.set_result(result)
+
+    def landed(result: OCRResult | None) -> None:
+        try:
+            loop.call_soon_threadsafe(settle, result)
+        except RuntimeError:                        # loop closed while waiting
+            pass
+
+    flight.add_done_callback(landed)
+    try:
+        return await asyncio.wait_for(waiter, timeout)
+    except asyncio.TimeoutError:
+        return None
+
+
+async def _annotate(entries: list[dict], user: str | None, plan: str | None,
+                    deadline: float | None = None) -> list[dict]:
+    """Async twin of ocr_engine.annotate_entries."""
+    backend = get_backend()
+    may_hedge = None
+    if backend.name == "vision":
+        governor = get_governor()
+        await governor.acquire_async(len(entries), user, plan,
+                                     timeout=quota_wait_budget(deadline))
+        may_hedge = lambda: governor.try_acquire(len(entries))
+    annotate_async = getattr(backend, "annotate_async", None)
+    if annotate_async is not None:
+        return await annotate_async(entries, deadline, may_hedge)
+    return await asyncio.get_running_loop().run_in_executor(
+        None, backend.annotate, entries, deadline, may_hedge)
+
+
+async def _annotate_group(group: list[_Pending], lang_code: str,
+                          user: str | None = None, plan: str | None = None,
+                          deadline: float | None = None) -> list[OCRResult]:
+    """Async twin of batch_ocr._annotate_group."""
+    return _with_reports(group, await _annotate_group_results(group, lang_code, user, plan, deadline))
+
+
+async def _annotate_group_results(group: list[_Pending], lang_code: str,
+                                  user: str | None, plan: str | None,
+                                  deadline: float | None) -> list[OCRResult]:
+    if _tiled(group[0]):
+        return [await asyncio.get_running_loop().run_in_executor(
+            None, annotate_tiled, group[0].entry, lang_code, user, plan, deadline)]
+    try:
+        responses = await _annotate([p.entry for p in group], user, plan, deadline)
+    except Exception as exc:
+        if _should_split(group, exc):
+            singles = await asyncio.gather(
+                *(_annotate_group([p], lang_code, user, plan, deadline) for p in group))
+            return [r for rs in singles for r in rs]
+        return [transport_error_result(exc, lang_code)] * len(group)
+
+    if len(responses) != len(group):
+        msg = f"Response error: expected {len(group)} responses, got {len(responses)}"
+        return [OCRResult("", 0.0, 0, lang_code, msg)] * len(group)
+    return [parse_annotate_response(r, lang_code) for r in responses]
+
+
+async def run_ocr_async(file_bytes: bytes, filename: str, lang_code: str,
+                        use_cache: bool = True,
+                        executor: Executor | None = None,
+                        user: str | None = None, plan: str | None = None,
+                        timeout: float | None = OCR_DEADLINE,
+                        feature: str = OCR_FEATURE) -> OCRResult:
+    """Async run_ocr: CPU work in ``executor`` (default loop executor), I/O on the loop."""
+    deadline = deadline_after(timeout)
+    unavailable = backend_unavailable_result(lang_code)
+    if unavailable:
+        return unavailable
+    invalid = validate_upload(file_bytes, lang_code)
+    if invalid:
+        return invalid
+
+    key = job_cache_key(file_bytes, lang_code, feature)
+    if use_cache:
+        cached = get_cache().get(key)
+        if cached is not None:
+            logger.info("OCR cache hit: %s", filename)
+            return cached
+
+    loop = asyncio.get_running_loop()
+    flights = get_flights()
+    flight, leader = flights.join(key)
+    if not leader:
+        # Shares run_ocr's flights, so sync and async callers coalesce too.
+        left = time_left(deadline)
+        shared = await _follow(flight, None if left is None else max(0.0, left))
+        if shared is not None:
+            return shared
+        if not flight.done:
+            return transport_error_result(TimeoutError(), lang_code)
+
+    result = None
+    try:
+        try:
+            entry, report = await loop.run_in_executor(
+                executor, build_ocr_request, file_bytes, lang_code, feature)
+        except Exception as exc:
+            result = OCRResult("", 0.0, 0, lang_code, f"Image error: {exc}")
+            return result
+
+        p = _Pending(0, filename, entry, request_payload_bytes(entry), key, report)
+        result = (await _annotate_group([p], lang_code, user, plan, deadline))[0]
+        if use_cache and result.error is None:
+            get_cache().put(key, result)
+        return result
+    finally:
+        if leader:
+            flights.land(key, flight, result)
+
+
+async def run_batch_ocr_async(
+    files: list[tuple[str, bytes]],
+    lang_code: str = "en",
+    on_progress: Callable[[int, int, str], None] | None = None,
+    concurrency: int = BATCH_WORKERS,
+    executor: Executor | None = None,
+    user: str | None = None,
+    plan: str | None = None,
+    timeout: float | None = OCR_DEADLINE,
+    skip_pages: bool = True,
+    feature: str = OCR_FEATURE,
+) -> list[BatchItem]:
+    """
+    Async run_batch_ocr: same grouping limits, results in input order.
+    At most ``concurrency`` annotate calls are in flight and at most
+    ``(concurrency + 1) * MAX_IMAGES_PER_REQUEST`` encoded payloads are held.
+    ``timeout`` is the budget of each grouped call, from when it is sent.
+    ``skip_pages`` short-circuits blank pages and near-duplicates (page_filter).
+    ``feature`` is as for run_batch_ocr.
+    """
+    total = len(files)
+    results: list[BatchItem | None] = [None] * total
+    done = 0
+
+    def place(index: int, item: BatchItem) -> None:
+        nonlocal done
+        results[index] = item
+        done += 1
+        if on_progress:
+            on_progress(done, total, files[index][0])
+
+    def finish(index: int, result: OCRResult) -> None:
+        place(index, _item(files[index][0], result))
+
+    def place_duplicates() -> None:
+        for index, skip in duplicates:
+            source = results[skip.same_as]
+            if source is not None:
+                place(index, _reused_item(source, files[index][0], skip))
+
+    loop = asyncio.get_running_loop()
+    unavailable = backend_unavailable_result(lang_code)
+    cache = get_cache()
+    flights = get_flights()
+    led: dict[int, tuple[str, Flight]] = {}         # index -> flight this batch must land
+    following: list[tuple[int, Flight]] = []        # identical job already in flight elsewhere
+    pages = PageFilter() if skip_pages else None
+    duplicates: list[tuple[int, Skip]] = []
+    jobs: list[tuple[int, str]] = []
+
+    def land(index: int, result: OCRResult | None) -> None:
+        key, flight = led.pop(index)
+        flights.land(key, flight, result)
+    for i, (filename, file_bytes) in enumerate(files):
+        if unavailable:
+            finish(i, unavailable)
+            continue
+        invalid = validate_upload(file_bytes, lang_code)
+        if invalid:
+            finish(i, invalid)
+            continue
+        skip = None
+        if pages:       # decodes a thumbnail: keep it off the loop
+            skip = await loop.run_in_executor(executor, pages.check, i, filename, file_bytes)
+        if skip is not None:
+            if skip.same_as is None:
+                place(i, _blank_item(filename, skip, lang_code))
+            else:
+                duplicates.append((i, skip))
+            continue
+        key = job_cache_key(file_bytes, lang_code, feature)
+        cached = cache.get(key)
+        if cached is not None:
+            finish(i, cached)
+            continue
+        flight, leader = flights.join(key)
+        if not leader:
+            following.append((i, flight))
+            continue
+        led[i] = (key, flight)
+        jobs.append((i, key))
+    if not (jobs or following):
+        place_duplicates()
+        return results  # type: ignore[return-value]
+
+    concurrency = max(1, concurrency)
+    get_backend().set_concurrency(concurrency)
+    calls = asyncio.Semaphore(concurrency)
+    slots = asyncio.Semaphore((concurrency + 1) * MAX_IMAGES_PER_REQUEST)
+
+    async def prepare(index: int, key: str) -> _Pending | None:
+        await slots.acquire()
+        try:
+            entry, report = await loop.run_in_executor(
+                executor, build_ocr_request, files[index][1], lang_code, feature)
+        except Exception as exc:
+            slots.release()
+            result = OCRResult("", 0.0, 0, lang_code, f"Image error: {exc}")
+            land(index, result)
+            finish(index, result)
+            return None
+        return _Pending(index, files[index][0], entry, request_payload_bytes(entry), key, report)
+
+    async def send(group: list[_Pending]) -> None:
+        async with calls:
+            group_results = await _annotate_group(group, lang_code, user, plan,
+                                                  deadline_after(timeout))
+        for p, result in zip(group, group_results):
+            slots.release()
+            if result.error is None:
+                cache.put(p.key, result)
+            land(p.index, result)
+            finish(p.index, result)
+
+    async def follow(index: int, flight: Flight) -> None:
+        result = await _follow(flight)
+        if result is None:                          # the leader was cancelled; go alone
+            filename, file_bytes = files[index]
+            result = await run_ocr_async(file_bytes, filename, lang_code, True, executor,
+                                         user, plan, timeout, feature)
+        finish(index, result)
+
+    prepared = [asyncio.create_task(prepare(i, key)) for i, key in jobs]
+    # Awaiting another batch's flight holds no thread, so followers run alongside our sends.
+    follows = [asyncio.create_task(follow(i, flight)) for i, flight in following]
+    sends: list[asyncio.Task] = []
+    group: list[_Pending] = []
+    group_bytes = 0
+    try:
+        for task in prepared:
+            pending = await task
+            if pending is None:
+                continue
+            if _group_full(group, group_bytes, pending):
+                sends.append(asyncio.create_task(send(group)))
+                group, group_bytes = [], 0
+            group.append(pending)
+            group_bytes += pending.size
+            if len(group) >= MAX_IMAGES_PER_REQUEST:
+                # Send now: the next payload may be waiting for this group's slots.
+                sends.append(asyncio.create_task(send(group)))
+                group, group_bytes = [], 0
+        if group:
+            sends.append(asyncio.create_task(send(group)))
+        await asyncio.gather(*sends, *follows)
+        place_duplicates()
+    finally:
+        for task in prepared + sends + follows:
+            task.cancel()
+        for i in list(led):
+            land(i, None)                           # release followers; they retry themselves
+
+    return results  # type: ignore[return-value]
@@ -0,0 +1,212 @@
+"""
+ocr_backends.py — Pluggable OCR Backends
+──────────────────────────────────────────
+run_ocr / run_batch_ocr dispatch images:annotate-shaped requests to the
+active backend and parse Vision-shaped responses, whatever the engine.
+- VisionBackend    — Google Cloud Vision via the pooled transport (default)
+- TesseractBackend — offline, for fast printed-text jobs (needs pytesseract
+                     and the tesseract binary)
+Select with OCR_BACKEND=vision|tesseract or set_backend().
+For load tests point VisionBackend at vision_standin.py via VISION_API_URL.
+"""
+from __future__ import annotations
+import io
+import os
+import base64
+import logging
+from functools import cached_property
+from typing import Callable, Protocol
+
+from PIL import Image
+
+from vision_client import get_transport, get_async_transport
+
+logger = logging.getLogger("pic2docs.backends")
+
+
+class OCRBackend(Protocol):
+    name: str
+
+    def unavailable_reason(self) -> str | None:
+        """User-facing reason the backend cannot run, or None if ready."""
+        ...
+
+    def set_concurrency(self, workers: int) -> None:
+        """Size internal resources for ``workers`` concurrent annotate calls."""
+        ...
+
+    def annotate(self, entries: list[dict], deadline: float | None = None,
+                 may_hedge: Callable[[], bool] | None = None) -> list[dict]:
+        """
+        Process images:annotate request entries; return one Vision-shaped
+        response dict per entry, in order. Raises on whole-call failures.
+        ``deadline`` is a time.monotonic() budget; ``may_hedge`` gates hedged
+        duplicates (remote backends only). Backends may also define
+        ``async annotate_async(entries, deadline, may_hedge)``; otherwise
+        ocr_async runs ``annotate`` in an executor.
+        """
+        ...
+
+
+# ── Google Vision ─────────────────────────────────────────────────────────────
+
+class VisionBackend:
+    name = "vision"
+
+    @staticmethod
+    def api_key() -> str:
+        return os.environ.get("GOOGLE_VISION_API_KEY", "")
+
+    def unavailable_reason(self) -> str | None:
+        if not self.api_key():
+            return "Google Vision API key not found. Please set GOOGLE_VISION_API_KEY in Render environment."
+        return None
+
+    def set_concurrency(self, workers: int) -> None:
+        get_transport().ensure_pool_size(workers)
+
+    def annotate(self, entries: list[dict], deadline: float | None = None,
+                 may_hedge: Callable[[], bool] | None = None) -> list[dict]:
+        data = get_transport().annotate({"requests": entries}, self.api_key(),
+                                        deadline, may_hedge)
+        return data.get("responses", [])
+
+    async def annotate_async(self, entries: list[dict], deadline: float | None = None,
+                             may_hedge: Callable[[], bool] | None = None) -> list[dict]:
+        data = await get_async_transport().annotate({"requests": entries}, self.api_key(),
+                                                    deadline, may_hedge)
+        return data.get("responses", [])
+
+
+# ── Tesseract (offline) ───────────────────────────────────────────────────────
+
+# ISO codes from ocr_engine.LANGUAGE_MAP → tesseract traineddata names
+TESSERACT_LANGS: dict[str, str] = {
+    "en": "eng", "hi": "hin", "ar": "ara", "bn": "ben", "pt": "por", "ru": "rus",
+    "ur": "urd", "de": "deu", "fr": "fra", "vi": "vie", "ko": "kor", "tr": "tur",
+    "id": "ind", "th": "tha", "mr": "mar", "ta": "tam", "te": "tel", "gu": "guj",
+    "it": "ita", "es": "spa", "zh-CN": "chi_sim", "zh-TW": "chi_tra", "ja": "jpn",
+    "fa": "fas",
+}
+
+
+def _box(left: int, top: int, width: int, height: int) -> dict:
+    return {"vertices": [
+        {"x": left, "y": top}, {"x": left + width, "y": top},
+        {"x": left + width, "y": top + height}, {"x": left, "y": top + height},
+    ]}
+
+
+class TesseractBackend:
+    name = "tesseract"
+
+    def unavailable_reason(self) -> str | None:
+        return self._unavailable
+
+    @cached_property
+    def _unavailable(self) -> str | None:
+        """Checked once per backend: the version probe spawns ``tesseract --version``."""
+        try:
+            import pytesseract
+            pytesseract.get_tesseract_version()
+        except ImportError:
+            return "Tesseract backend needs the pytesseract package."
+        except Exception:
+            return "Tesseract binary not found. Install tesseract-ocr or use OCR_BACKEND=vision."
+        return None
+
+    def set_concurrency(self, workers: int) -> None:
+        pass
+
+    def annotate(self, entries: list[dict], deadline: float | None = None,
+                 may_hedge: Callable[[], bool] | None = None) -> list[dict]:
+        # Local and CPU-bound: deadlines and hedging do not apply.
+        responses = []
+        for entry in entries:
+            try:
+                responses.append(self._annotate_one(entry))
+            except Exception as exc:
+                logger.exception("Tesseract failed: %s", exc)
+                responses.append({"error": {"message": str(exc)}})
+        return responses
+
+    def _annotate_one(self, entry: dict) -> dict:
+        import pytesseract
+
+        img = Image.open(io.BytesIO(base64.b64decode(entry["image"]["content"])))
+        hints = entry.get("imageContext", {}).get("languageHints") or ["en"]
+        lang = "+".join(dict.fromkeys(TESSERACT_LANGS.get(h, "eng") for h in hints))
+        data = pytesseract.image_to_data(img, lang=lang, output_type=pytesseract.Output.DICT)
+
+        # Rebuild Vision's page → block → paragraph → word hierarchy.
+        blocks: dict[int, dict] = {}
+        lines: dict[tuple[int, int, int], list[str]] = {}
+        for i, word in enumerate(data["text"]):
+            conf = float(data["conf"][i])
+            if data["level"][i] != 5 or conf < 0 or not word.strip():
+                continue
+            b, p, ln = data["block_num"][i], data["par_num"][i], data["line_num"][i]
+            box = _box(data["left"][i], data["top"][i], data["width"][i], data["height"][i])
+            block = blocks.setdefault(b, {"paragraphs": {}, "confs": []})
+            para = block["paragraphs"].setdefault(p, {"words": [], "confs": []})
+            symbols = [{"text": ch} for ch in word]
+            symbols[-1]["property"] = {"detectedBreak": {"type": "SPACE"}}
+            para["words"].append({"boundingBox": box, "confidence": conf / 100, "symbols": symbols})
+            para["confs"].append(conf / 100)
+            block["confs"].append(conf / 100)
+            lines.setdefault((b, p, ln), []).append(word)
+
+        if not blocks:
+            return {}
+        text_lines, last_block = [], None
+        for (b, _, _), words in sorted(lines.items()):
+            if last_block is not None and b != last_block:
+                text_lines.append("")
+            text_lines.append(" ".join(words))
+            last_block = b
+
+        page_blocks = []
+        for b in sorted(blocks):
+            block = blocks[b]
+            paragraphs = [
+                {"confidence": sum(p["confs"]) / len(p["confs"]), "words": p["words"]}
+                for _, p in sorted(block["paragraphs"].items())
+            ]
+            page_blocks.append({
+                "confidence": sum(block["confs"]) / len(block["confs"]),
+                "paragraphs": paragraphs,
+            })
+        return {"fullTextAnnotation": {
+            "text": "\n".join(text_lines) + "\n",
+            "pages": [{"width": img.width, "height": img.height, "blocks": page_blocks}],
+        }}
+
+
+# ── Registry ──────────────────────────────────────────────────────────────────
+
+BACKENDS: dict[str, type] = {
+    "vision":    VisionBackend,
+    "tesseract": TesseractBackend,
+}
+
+
+def _from_env() -> OCRBackend:
+    name = os.environ.get("OCR_BACKEND", "vision").lower()
+    if name not in BACKENDS:
+        logger.warning("Unknown OCR_BACKEND %r — using vision.", name)
+        name = "vision"
+    return BACKENDS[name]()
+
+
+_backend: OCRBackend = _from_env()
+
+
+def get_backend() -> OCRBackend:
+    return _backend
+
+
+def set_backend(backend: OCRBackend) -> OCRBackend:
+    """Swap the process-wide backend; returns the previous one."""
+    global _backend
+    previous, _backend = _backend, backend
+    return previous
@@ -0,0 +1,287 @@
+"""
+ocr_cache.py — Content-Addressed OCR Result Cache
+───────────────────────────────────────────────────
+Sits in front of ocr_engine.run_ocr so identical uploads skip the API.
+- Key: SHA-256 of file bytes + language hint + preprocessing settings
+- Tier 1: in-process LRU, evicted by total pickled size
+- Tier 2: optional on-disk store that survives restarts (OCR_CACHE_DIR)
+- Hit / miss counters for sizing
+Only successful results (error is None) are stored.
+SingleFlight coalesces concurrent identical jobs onto one in-flight call.
+"""
+from __future__ import annotations
+import os
+import json
+import pickle
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable
+
+logger = logging.getLogger("pic2docs.ocr_cache")
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def cache_key(file_bytes: bytes, lang_code: str, settings: dict[str, Any]) -> str:
+    """Stable hex digest identifying one OCR job."""
+    h = hashlib.sha256()
+    h.update(file_bytes)
+    h.update(b"\0")
+    h.update(lang_code.encode("utf-8"))
+    h.update(b"\0")
+    h.update(json.dumps(settings, sort_keys=True, default=str).encode("utf-8"))
+    return h.hexdigest()
+
+
+class OCRCache:
+    """Thread-safe two-tier (memory LRU + optional disk) result cache."""
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES,
+                 disk_dir: str | Path | None = None):
+        self.max_bytes = max_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self._entries: OrderedDict[str, tuple[bytes, int]] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.disk_dir:
+            try:
+                self.disk_dir.mkdir(parents=True, exist_ok=True)
+            except OSError as exc:
+                logger.warning("OCR cache dir %s unusable (%s) — memory tier only.",
+                               self.disk_dir, exc)
+                self.disk_dir = None
+
+    @classmethod
+    def from_env(cls) -> "OCRCache":
+        max_mb = os.environ.get("OCR_CACHE_MAX_MB", "")
+        max_bytes = int(float(max_mb) * 1_048_576) if max_mb else DEFAULT_MAX_BYTES
+        return cls(max_bytes=max_bytes, disk_dir=os.environ.get("OCR_CACHE_DIR") or None)
+
+    # ── Memory tier ──
+
+    def _remember(self, key: str, blob: bytes) -> None:
+        """Insert into the LRU and evict until under budget. Caller holds the lock."""
+        if len(blob) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= old[1]
+        self._entries[key] = (blob, len(blob))
+        self._size += len(blob)
+        while self._size > self.max_bytes and self._entries:
+            _, (_, size) = self._entries.popitem(last=False)
+            self._size -= size
+            self.evictions += 1
+
+    # ── Disk tier ──
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / key[:2] / f"{key}.pkl"
+
+    def _disk_read(self, key: str) -> bytes | None:
+        if not self.disk_dir:
+            return None
+        try:
+            return self._disk_path(key).read_bytes()
+        except FileNotFoundError:
+            return None
+        except OSError as exc:
+            logger.warning("OCR cache disk read failed: %s", exc)
+            return None
+
+    def _disk_write(self, key: str, blob: bytes) -> None:
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            path.parent.mkdir(exist_ok=True)
+            tmp.write_bytes(blob)
+            os.replace(tmp, path)
+        except OSError as exc:
+            logger.warning("OCR cache disk write failed: %s", exc)
+            tmp.unlink(missing_ok=True)
+
+    # ── Public API ──
+
+    def get(self, key: str) -> Any | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                blob = entry[0]
+            else:
+                blob = None
+        if blob is None:
+            blob = self._disk_read(key)
+            if blob is None:
+                with self._lock:
+                    self.misses += 1
+                return None
+            with self._lock:
+                self.disk_hits += 1
+                self._remember(key, blob)
+        try:
+            return pickle.loads(blob)
+        except Exception as exc:
+            logger.warning("Dropping unreadable OCR cache entry %s: %s", key[:12], exc)
+            self.discard(key)
+            return None
+
+    def put(self, key: str, value: Any) -> None:
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._remember(key, blob)
+        self._disk_write(key, blob)
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._size -= entry[1]
+        if self.disk_dir:
+            self._disk_path(key).unlink(missing_ok=True)
+
+    def clear(self) -> None:
+        """Empty the memory tier and reset counters (disk tier is kept)."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self.hits = self.disk_hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries":   len(self._entries),
+                "bytes":     self._size,
+                "max_bytes": self.max_bytes,
+                "hits":      self.hits,
+                "disk_hits": self.disk_hits,
+                "misses":    self.misses,
+                "evictions": self.evictions,
+                "hit_rate":  round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+                "disk_dir":  str(self.disk_dir) if self.disk_dir else None,
+            }
+
+
+class Flight:
+    """
+    One in-flight job; followers block on wait() until the leader lands it,
+    or register add_done_callback() (how asyncio callers await it).
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: list[Callable[[Any], None]] = []
+        self.result: Any = None
+        self.followers = 0
+
+    def wait(self, timeout: float | None = None) -> Any | None:
+        self._event.wait(timeout)
+        return self.result
+
+    @property
+    def done(self) -> bool:
+        return self._event.is_set()
+
+    def add_done_callback(self, fn: Callable[[Any], None]) -> None:
+        """Call ``fn(result)`` from the landing thread, or now if already landed."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self.result)
+
+    def _land(self, result: Any) -> None:
+        with self._lock:
+            self.result = result
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn(result)
+            except Exception:
+                logger.exception("Flight callback failed")
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls with the same key. The first caller (leader)
+    does the work; later callers get the leader's result, errors included.
+    Nothing is remembered once the flight lands — that is the cache's job.
+    """
+
+    def __init__(self):
+        self._flights: dict[str, Flight] = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def join(self, key: str) -> tuple[Flight, bool]:
+        """Return (flight, is_leader). A leader MUST call land() exactly once."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                self.coalesced += 1
+                return flight, False
+            flight = self._flights[key] = Flight()
+            return flight, True
+
+    def land(self, key: str, flight: Flight, result: Any) -> None:
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight._land(result)
+
+    def do(self, key: str, fn: Callable[[], Any], timeout: float | None = None) -> Any:
+        """
+        Run ``fn`` once per concurrent key. A follower whose leader landed
+        None (raised or was cancelled) runs ``fn`` itself rather than fail;
+        one that waits longer than ``timeout`` raises TimeoutError.
+        """
+        flight, leader = self.join(key)
+        if not leader:
+            result = flight.wait(None if timeout is None else max(0.0, timeout))
+            if result is not None:
+                return result
+            if not flight.done:
+                raise TimeoutError("Timed out waiting for an identical in-flight request.")
+            return fn()
+        result = None
+        try:
+            result = fn()
+            return result
+        finally:
+            self.land(key, flight, result)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"in_flight": len(self._flights), "coalesced": self.coalesced}
+
+
+_cache = OCRCache.from_env()
+_flights = SingleFlight()
+
+
+def get_cache() -> OCRCache:
+    return _cache
+
+
+def get_flights() -> SingleFlight:
+    return _flights
+
+
+def set_cache(cache: OCRCache) -> None:
+    """Swap the process-wide cache (tests, custom sizing)."""
+    global _cache
+    _cache = cache
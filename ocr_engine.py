@@ -2,24 +2,99 @@
 ocr_engine.py — Google Cloud Vision OCR Pipeline
 ──────────────────────────────────────────────────
 Uses Google Vision API for high accuracy OCR
+(requests go through the active backend — see ocr_backends)
 - Handwritten text: 95%+ accuracy
 - Printed text: 99%+ accuracy
 - Supports all major languages
 - Lightweight: no heavy ML models needed
+- Oversized scans whose text downscaling would shrink too far are tiled
+  at native resolution (see ocr_tiling)
+- Single-channel from decode to encode; clean scans go out as 1-bit PNG
+- Enhancement passes run only when cheap image stats call for them
+- Low-confidence blocks get one follow-up call on enhanced crops (see ocr_refine)
+- Sparse text (signs, labels) uses the lighter TEXT_DETECTION feature
 """
 from __future__ import annotations
 import io
 import os
+import math
+import time
 import base64
 import logging
 import requests
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from typing import NamedTuple
-from PIL import Image, ImageEnhance, ImageOps
+from PIL import Image, ImageEnhance, ImageFilter, ImageOps
+
+from image_codec import (
+    decode_for_ocr, encode_for_ocr, to_mode, ENCODE_STRATEGIES, JPEG_QUALITY, PNG_COMPRESS_LEVEL, TARGET_PAYLOAD_BYTES,
+)
+from ocr_backends import get_backend
+from ocr_cache import cache_key, get_cache, get_flights
+from ocr_layout import OCRLayout
+from ocr_refine import (
+    REFINE_ENABLED, REFINE_BLOCK_CONFIDENCE, REFINE_MIN_GAIN, REFINE_MAX_REGIONS, REFINE_PADDING,
+    REFINE_LINE_PX, REFINE_MAX_UPSCALE, REFINE_CONTRAST_CUTOFF, REFINE_MIN_SECONDS,
+    Region, weak_blocks, merge,
+)
+from ocr_tiling import (
+    TiledImage, TILING_ENABLED, TILE_MIN_PIXELS, TILE_MIN_TEXT_PX, TILE_MAX_PIXELS, TILE_SIZE,
+    TILE_OVERLAP, tiling_candidate, needs_tiling, plan_tiles, chunk_entries, stitch,
+)
+from quota import QuotaExceeded, QUOTA_MAX_WAIT, get_governor
+from vision_client import deadline_after, time_left
 
 logger = logging.getLogger("pic2docs.ocr")
 
 MAX_IMAGE_BYTES = 10 * 1024 * 1024
 MAX_DIMENSION   = 3000
+AUTOCONTRAST_CUTOFF = 1
+SHARPNESS_FACTOR    = 1.5
+ENCODING_STRATEGY   = os.environ.get("OCR_ENCODING", "auto")
+if ENCODING_STRATEGY not in ENCODE_STRATEGIES:
+    logger.warning("Unknown OCR_ENCODING %r — using auto.", ENCODING_STRATEGY)
+    ENCODING_STRATEGY = "auto"
+OCR_DEADLINE        = float(os.environ.get("OCR_DEADLINE", 45))   # seconds per run_ocr call
+# Vision reads text from luminance: decode, enhance and encode single-channel
+# (clean scans go out as 1-bit PNG). OCR_GRAYSCALE=0 restores RGB payloads.
+GRAYSCALE           = os.environ.get("OCR_GRAYSCALE", "1") != "0"
+DECODE_MODE         = "L" if GRAYSCALE else None
+
+# Auto-align: EXIF transpose, deskew and crop to the ink before upload.
+AUTO_ALIGN          = os.environ.get("OCR_AUTO_ALIGN", "1") != "0"
+ALIGN_ANALYSIS_SIZE = 1000       # px, longest side of the grayscale analysis copy
+ALIGN_INK_CONTRAST  = 20         # grey levels below the local background
+SKEW_MAX_DEGREES    = 15.0
+SKEW_MIN_DEGREES    = 0.3        # smaller skews are not worth a resample
+CROP_MARGIN         = 0.02       # of the page size, kept around the ink box
+CROP_MIN_GAIN       = 0.10       # only crop when it removes at least this much area
+
+# Adaptive enhancement: autocontrast / sharpen only images that need it.
+ADAPTIVE_ENHANCE    = os.environ.get("OCR_ADAPTIVE_ENHANCE", "1") != "0"
+CONTRAST_MIN_RANGE  = 192        # grey levels between the cutoff percentiles
+BLUR_LAPLACIAN_VAR  = 2000.0     # contrast-normalised; crisp text measures ~10k
+SHARPNESS_WINDOW    = 1024       # px, centre crop the Laplacian is measured on
+SCREENSHOT_FLAT     = 0.5        # share of pixels on the single commonest grey level
+SCREENSHOT_NOISE    = 0.05       # max pixels within ±3 levels of it, relative to it
+
+# Vision feature: "auto" picks TEXT_DETECTION for sparse text, else DOCUMENT_TEXT_DETECTION.
+FEATURE_AUTO        = "auto"
+DOCUMENT_FEATURE    = "DOCUMENT_TEXT_DETECTION"
+TEXT_FEATURE        = "TEXT_DETECTION"
+FEATURES            = (FEATURE_AUTO, DOCUMENT_FEATURE, TEXT_FEATURE)
+OCR_FEATURE         = os.environ.get("OCR_FEATURE", FEATURE_AUTO)
+if OCR_FEATURE not in FEATURES:
+    logger.warning("Unknown OCR_FEATURE %r — using auto.", OCR_FEATURE)
+    OCR_FEATURE = FEATURE_AUTO
+FEATURE_MAP: dict[str, str] = {      # UI label → feature
+    "Auto":                         FEATURE_AUTO,
+    "Document (dense text)":        DOCUMENT_FEATURE,
+    "Sparse text (signs, labels)":  TEXT_FEATURE,
+}
+SPARSE_TEXT_CHARS   = 200        # estimated characters; a dense page measures 1500+
+TEXT_ROW_INK        = 0.025      # share of a row that must be ink for it to hold text
+TEXT_HEIGHT_STRIPS  = 8          # vertical strips text line heights are measured in
 
 LANGUAGE_MAP: dict[str, str] = {
     "English":               "en",
@@ -49,110 +124,711 @@ LANGUAGE_MAP: dict[str, str] = {
 }
 
 
+class PreprocessReport(NamedTuple):
+    """What _enhance measured on one image and which passes it ran."""
+    contrast:   tuple[int, int]           # grey levels at the autocontrast cutoffs
+    sharpness:  float                     # Laplacian variance, contrast-normalised
+    screenshot: bool                      # flat noiseless background: digital capture
+    passes:     tuple[str, ...]           # "autocontrast", "sharpen"
+    ms:         float                     # stats + passes
+    text_chars: int | None = None         # density estimate (feature "auto" only)
+    feature:    str | None = None         # Vision feature the image was sent with
+
+    def summary(self) -> str:
+        kind = "screenshot" if self.screenshot else "photo/scan"
+        ran = ", ".join(self.passes) or "no enhancement"
+        text = (f"{kind}; contrast {self.contrast[0]}–{self.contrast[1]}, "
+                f"sharpness {self.sharpness:.0f}; {ran} ({self.ms:.0f} ms)")
+        if self.feature:
+            density = f"~{self.text_chars} chars, " if self.text_chars is not None else ""
+            text += f"; {density}{self.feature}"
+        return text
+
+
 class OCRResult(NamedTuple):
     text:        str
     confidence:  float
     block_count: int
     language:    str
     error:       str | None = None
+    preprocess:  PreprocessReport | None = None
+    layout:      OCRLayout | None = None      # words, boxes, confidences (see ocr_layout)
+
+
+def _ink_mask(gray: Image.Image) -> np.ndarray:
+    """Pixels clearly darker than their neighbourhood: text, rules, page edges."""
+    radius = max(2, max(gray.size) // 60)
+    background = np.asarray(gray.filter(ImageFilter.BoxBlur(radius)), dtype=np.int16)
+    return background - np.asarray(gray, dtype=np.int16) > ALIGN_INK_CONTRAST
+
+
+def _estimate_skew(mask: np.ndarray, max_points: int = 30_000) -> float:
+    """
+    Degrees to rotate (PIL convention, counter-clockwise) to level the text:
+    the angle whose horizontal projection profile of ink is sharpest.
+    """
+    ys, xs = np.nonzero(mask)
+    if len(xs) < 200:
+        return 0.0
+    if len(xs) > max_points:
+        pick = np.random.default_rng(0).choice(len(xs), max_points, replace=False)
+        xs, ys = xs[pick], ys[pick]
+    xs = xs - xs.mean()
+    ys = ys - ys.mean()
+
+    def sharpness(deg: float) -> float:
+        t = np.deg2rad(deg)
+        rows = ys * np.cos(t) - xs * np.sin(t)
+        hist = np.bincount((rows - rows.min()).astype(np.int64)).astype(np.float64)
+        return float((hist ** 2).sum())
+
+    coarse = max(np.arange(-SKEW_MAX_DEGREES, SKEW_MAX_DEGREES + 1e-9, 0.5), key=sharpness)
+    return float(max(np.arange(coarse - 0.5, coarse + 0.5 + 1e-9, 0.05), key=sharpness))
+
+
+def _ink_box(mask: np.ndarray) -> tuple[float, float, float, float] | None:
+    """Ink bounding box as fractions of the mask size (trimmed of stray specks), plus margin."""
+    ys, xs = np.nonzero(mask)
+    if len(xs) < 200:
+        return None
+    h, w = mask.shape
+    x0, x1 = np.percentile(xs, (0.5, 99.5))
+    y0, y1 = np.percentile(ys, (0.5, 99.5))
+    return (max(0.0, x0 / w - CROP_MARGIN), max(0.0, y0 / h - CROP_MARGIN),
+            min(1.0, (x1 + 1) / w + CROP_MARGIN), min(1.0, (y1 + 1) / h + CROP_MARGIN))
 
 
-def _preprocess(img: Image.Image) -> bytes:
-    """Resize and optimize image for API."""
+def _background_fill(img: Image.Image) -> int | tuple[int, ...]:
+    """Median colour, used for the corners a rotation exposes."""
+    small = np.asarray(img.reduce(8) if min(img.size) >= 64 else img)
+    if small.ndim == 2:
+        return int(np.median(small))
+    return tuple(int(v) for v in np.median(small.reshape(-1, small.shape[2]), axis=0))
+
+
+def _rotate_crop(img: Image.Image, angle: float,
+                 box: tuple[float, float, float, float]) -> Image.Image:
+    """
+    Equivalent to img.rotate(angle, expand=True).crop(box scaled to that
+    frame), as a single affine resample that only computes the output crop.
+    """
+    w, h = img.size
+    t = np.deg2rad(angle)
+    cos, sin = float(np.cos(t)), float(np.sin(t))
+    rw, rh = abs(w * cos) + abs(h * sin), abs(w * sin) + abs(h * cos)   # expanded frame
+    x0, y0 = box[0] * rw, box[1] * rh
+    size = (max(1, round((box[2] - box[0]) * rw)), max(1, round((box[3] - box[1]) * rh)))
+    # Output pixel (u, v) sits at (x0 + u, y0 + v) in the rotated frame; map it back.
+    dx, dy = x0 - rw / 2, y0 - rh / 2
+    coeffs = (cos, -sin, cos * dx - sin * dy + w / 2,
+              sin,  cos, sin * dx + cos * dy + h / 2)
+    return img.transform(size, Image.AFFINE, coeffs, resample=Image.BICUBIC,
+                         fillcolor=_background_fill(img))
+
+
+def _auto_align(img: Image.Image) -> Image.Image:
+    """
+    EXIF transpose, then deskew and crop to the ink. Both are measured on a
+    small grayscale copy; the full-resolution image is resampled once.
+    """
+    img = ImageOps.exif_transpose(img)
+    if not AUTO_ALIGN:
+        return img
+    gray = img.convert("L")
+    gray.thumbnail((ALIGN_ANALYSIS_SIZE, ALIGN_ANALYSIS_SIZE))
+    angle = _estimate_skew(_ink_mask(gray))
+    if abs(angle) < SKEW_MIN_DEGREES:
+        angle = 0.0
+    if angle:
+        gray = gray.rotate(angle, expand=True, resample=Image.BILINEAR,
+                           fillcolor=int(np.median(np.asarray(gray))))
+    box = _ink_box(_ink_mask(gray))
+    if box and (box[2] - box[0]) * (box[3] - box[1]) > 1 - CROP_MIN_GAIN:
+        box = None
+    if not angle and not box:
+        return img
+
     if img.mode not in ("RGB", "L"):
         img = img.convert("RGB")
-    w, h = img.size
-    if max(w, h) > MAX_DIMENSION:
-        scale = MAX_DIMENSION / max(w, h)
-        img = img.resize((int(w * scale), int(h * scale)), Image.LANCZOS)
-    # Enhance
-    img = ImageOps.autocontrast(img.convert("L"), cutoff=1).convert("RGB")
-    img = ImageEnhance.Sharpness(img).enhance(1.5)
-    buf = io.BytesIO()
-    img.save(buf, format="PNG", optimize=True)
-    return buf.getvalue()
-
-
-def run_ocr(file_bytes: bytes, filename: str, lang_code: str) -> OCRResult:
-    """Run Google Vision OCR."""
-
-    api_key = os.environ.get("GOOGLE_VISION_API_KEY", "")
-    if not api_key:
-        return OCRResult("", 0.0, 0, lang_code,
-            "Google Vision API key not found. Please set GOOGLE_VISION_API_KEY in Render environment.")
+    if not angle:
+        w, h = img.size
+        img = img.crop((round(box[0] * w), round(box[1] * h),
+                        round(box[2] * w), round(box[3] * h)))
+    else:
+        img = _rotate_crop(img, angle, box or (0.0, 0.0, 1.0, 1.0))
+    logger.debug("Auto-align: rotated %.2f°, crop %s", angle, box and tuple(round(b, 3) for b in box))
+    return img
+
+
+def _contrast_range(hist: list[int], cutoff: float) -> tuple[int, int]:
+    """Grey levels at the ``cutoff`` percent tails, as autocontrast sees them."""
+    limit = sum(hist) * cutoff / 100
+    lo, acc = 0, hist[0]
+    while acc <= limit and lo < 255:
+        lo += 1
+        acc += hist[lo]
+    hi, acc = 255, hist[255]
+    while acc <= limit and hi > lo:
+        hi -= 1
+        acc += hist[hi]
+    return lo, hi
+
+
+def _laplacian_variance(gray: Image.Image, contrast: tuple[int, int]) -> float:
+    """Blur measure on a centre window, scaled as if autocontrast had run."""
+    w, h = gray.size
+    cw, ch = min(w, SHARPNESS_WINDOW), min(h, SHARPNESS_WINDOW)
+    a = np.asarray(gray.crop(((w - cw) // 2, (h - ch) // 2, (w + cw) // 2, (h + ch) // 2)),
+                   dtype=np.int16)
+    if a.shape[0] < 3 or a.shape[1] < 3:
+        return 0.0
+    lap = 4 * a[1:-1, 1:-1] - a[:-2, 1:-1] - a[2:, 1:-1] - a[1:-1, :-2] - a[1:-1, 2:]
+    return float(lap.var()) * (255 / max(1, contrast[1] - contrast[0])) ** 2
+
+
+def _looks_like_screenshot(hist: list[int]) -> bool:
+    """A large background at one exact grey level with no sensor noise around it."""
+    peak = max(range(256), key=hist.__getitem__)
+    near = sum(hist[max(0, peak - 3):peak + 4]) - hist[peak]
+    return (hist[peak] >= SCREENSHOT_FLAT * sum(hist)
+            and near <= SCREENSHOT_NOISE * hist[peak])
+
 
+def _fit_size(size: tuple[int, int], max_dimension: int | None) -> tuple[int, int]:
+    """Size _enhance resizes to (the coordinate space of Vision's boxes)."""
+    w, h = size
+    if max_dimension and max(w, h) > max_dimension:
+        scale = max_dimension / max(w, h)
+        return int(w * scale), int(h * scale)
+    return size
+
+
+def _run_passes(img: Image.Image, passes: list[str] | tuple[str, ...]) -> Image.Image:
+    if "autocontrast" in passes:
+        img = ImageOps.autocontrast(img, cutoff=AUTOCONTRAST_CUTOFF)
+    if "sharpen" in passes:
+        img = ImageEnhance.Sharpness(img).enhance(SHARPNESS_FACTOR)
+    return img
+
+
+def _enhance(img: Image.Image, max_dimension: int | None = MAX_DIMENSION,
+             ) -> tuple[Image.Image, PreprocessReport]:
+    """
+    Resize and enhance image for OCR (everything before encoding).
+    Works on one channel throughout; the output is RGB only with OCR_GRAYSCALE=0.
+    Autocontrast runs on narrow-range images and sharpening on soft,
+    non-screenshot ones (every image with OCR_ADAPTIVE_ENHANCE=0).
+    """
+    start = time.perf_counter()
+    img = to_mode(img, "L")
+    size = _fit_size(img.size, max_dimension)
+    if size != img.size:
+        img = img.resize(size, Image.LANCZOS)
+
+    hist = img.histogram()
+    contrast = _contrast_range(hist, AUTOCONTRAST_CUTOFF)
+    sharpness = _laplacian_variance(img, contrast)
+    screenshot = _looks_like_screenshot(hist)
+    passes = []
+    if not ADAPTIVE_ENHANCE or contrast[1] - contrast[0] < CONTRAST_MIN_RANGE:
+        passes.append("autocontrast")
+    if not ADAPTIVE_ENHANCE or (not screenshot and sharpness < BLUR_LAPLACIAN_VAR):
+        passes.append("sharpen")
+    img = _run_passes(img, passes)
+
+    report = PreprocessReport(contrast, round(sharpness, 1), screenshot, tuple(passes),
+                              round((time.perf_counter() - start) * 1000, 1))
+    logger.debug("Preprocess: %s", report.summary())
+    return (img if GRAYSCALE else img.convert("RGB")), report
+
+
+def _text_chars(img: Image.Image) -> int:
+    """
+    Rough character count: ink transitions along each text line divided by
+    the line's height (≈ characters per row), summed over the lines.
+    ``img`` may be RGB (OCR_GRAYSCALE=0); it is measured in grayscale.
+    """
+    small = img.convert("L")        # always a copy, so thumbnail() leaves img alone
+    small.thumbnail((ALIGN_ANALYSIS_SIZE, ALIGN_ANALYSIS_SIZE))
+    mask = _ink_mask(small)
+    height, width = mask.shape
+    rows = np.flatnonzero(mask.sum(axis=1) > max(1, TEXT_ROW_INK * width))
+    if not rows.size:
+        return 0
+    chars = 0.0
+    # Runs of consecutive text rows are the lines.
+    for line in np.split(rows, np.flatnonzero(np.diff(rows) > 1) + 1):
+        h = len(line)
+        if 2 <= h <= height // 2:
+            band = mask[line[0]:line[-1] + 1]
+            chars += np.count_nonzero(band[:, 1:] & ~band[:, :-1]) / h
+    return round(chars)
+
+
+def _text_line_height(gray: Image.Image) -> float | None:
+    """
+    Median height in px of the text lines in ``gray`` (runs of text rows),
+    measured per vertical strip so columns and leftover skew do not merge
+    neighbouring lines. None if fewer than three lines are found.
+    """
+    mask = _ink_mask(gray)
+    height, width = mask.shape
+    strip = max(1, width // TEXT_HEIGHT_STRIPS)
+    heights = []
+    for x in range(0, width - strip + 1, strip):
+        band = mask[:, x:x + strip]
+        rows = np.flatnonzero(band.sum(axis=1) > max(1, TEXT_ROW_INK * strip))
+        if not rows.size:
+            continue
+        for line in np.split(rows, np.flatnonzero(np.diff(rows) > 1) + 1):
+            if 2 <= len(line) <= height // 8:
+                heights.append(len(line))
+    return float(np.median(heights)) if len(heights) >= 3 else None
+
+
+def _choose_feature(img: Image.Image, feature: str) -> tuple[str, int | None]:
+    """Resolve "auto" to a Vision feature; also returns the density estimate."""
+    if feature != FEATURE_AUTO:
+        return feature, None
+    chars = _text_chars(img)
+    # No ink found at all is not evidence of sparse text (e.g. light-on-dark).
+    return (TEXT_FEATURE if 0 < chars < SPARSE_TEXT_CHARS else DOCUMENT_FEATURE), chars
+
+
+def _preprocess(img: Image.Image, encoding: str | None = None,
+                feature: str = OCR_FEATURE) -> tuple[bytes, PreprocessReport]:
+    """Resize, enhance and encode image for API (see image_codec for formats)."""
+    img, report = _measure(img, feature)
+    data = encode_for_ocr(img, encoding or ENCODING_STRATEGY, one_bit=GRAYSCALE).data
+    return data, report
+
+
+def _measure(img: Image.Image, feature: str = OCR_FEATURE) -> tuple[Image.Image, PreprocessReport]:
+    """_enhance plus the feature choice: everything _preprocess decides before encoding."""
+    img, report = _enhance(img)
+    feature, chars = _choose_feature(img, feature)
+    return img, report._replace(text_chars=chars, feature=feature)
+
+
+def _preprocess_settings(feature: str = OCR_FEATURE, refine: bool = False) -> dict:
+    """
+    Everything that changes the result for given file bytes (cache key input).
+    ``refine``: the caller runs _refine_weak_blocks (run_ocr only).
+    """
+    return {
+        "max_dimension": MAX_DIMENSION,
+        "decode": "draft+reduce",
+        "color": "L/1-bit" if GRAYSCALE else "RGB",
+        "autocontrast_cutoff": AUTOCONTRAST_CUTOFF,
+        "sharpness": SHARPNESS_FACTOR,
+        "adaptive": ADAPTIVE_ENHANCE and (CONTRAST_MIN_RANGE, BLUR_LAPLACIAN_VAR, SHARPNESS_WINDOW,
+                                          SCREENSHOT_FLAT, SCREENSHOT_NOISE),
+        "encoding": (ENCODING_STRATEGY, PNG_COMPRESS_LEVEL, JPEG_QUALITY, TARGET_PAYLOAD_BYTES),
+        "auto_align": AUTO_ALIGN and (ALIGN_ANALYSIS_SIZE, ALIGN_INK_CONTRAST, SKEW_MAX_DEGREES,
+                                      SKEW_MIN_DEGREES, CROP_MARGIN, CROP_MIN_GAIN),
+        "refine": refine and REFINE_ENABLED and (REFINE_BLOCK_CONFIDENCE, REFINE_MIN_GAIN,
+                                                 REFINE_MAX_REGIONS, REFINE_PADDING, REFINE_LINE_PX,
+                                                 REFINE_MAX_UPSCALE, REFINE_CONTRAST_CUTOFF),
+        "feature": (feature, SPARSE_TEXT_CHARS, TEXT_ROW_INK) if feature == FEATURE_AUTO else feature,
+        "backend": get_backend().name,
+        "tiling": TILING_ENABLED and (TILE_MIN_PIXELS, TILE_MIN_TEXT_PX, TEXT_HEIGHT_STRIPS,
+                                      TILE_MAX_PIXELS, TILE_SIZE, TILE_OVERLAP),
+    }
+
+
+def cache_stats() -> dict:
+    """Hit/miss counters and size of the OCR result cache, plus coalescing counts."""
+    return {**get_cache().stats(), **get_flights().stats()}
+
+
+def backend_unavailable_result(lang_code: str) -> OCRResult | None:
+    """Error result if the active backend cannot run (e.g. missing API key)."""
+    reason = get_backend().unavailable_reason()
+    return OCRResult("", 0.0, 0, lang_code, reason) if reason else None
+
+
+def validate_upload(file_bytes: bytes, lang_code: str) -> OCRResult | None:
+    """Return an error result for unusable uploads, else None."""
     if len(file_bytes) > MAX_IMAGE_BYTES:
         return OCRResult("", 0.0, 0, lang_code,
             f"File too large. Max {MAX_IMAGE_BYTES//1_048_576}MB.")
     if len(file_bytes) == 0:
         return OCRResult("", 0.0, 0, lang_code, "Empty file.")
+    return None
 
-    # Preprocess
-    try:
-        img = Image.open(io.BytesIO(file_bytes))
-        processed_bytes = _preprocess(img)
-    except Exception as exc:
-        return OCRResult("", 0.0, 0, lang_code, f"Image error: {exc}")
 
-    # Encode to base64
-    img_b64 = base64.b64encode(processed_bytes).decode("utf-8")
-
-    # Call Google Vision API
-    url = f"https://vision.googleapis.com/v1/images:annotate?key={api_key}"
-    payload = {
-        "requests": [{
-            "image": {"content": img_b64},
-            "features": [{"type": "DOCUMENT_TEXT_DETECTION"}],
-            "imageContext": {
-                "languageHints": [lang_code]
-            }
-        }]
+def job_cache_key(file_bytes: bytes, lang_code: str, feature: str = OCR_FEATURE,
+                  refine: bool = False) -> str:
+    """
+    Result cache / single-flight key. Only run_ocr refines weak blocks, so
+    only it passes ``refine=True``; batch and async results, which are never
+    refined, are kept apart from its results while OCR_REFINE is on.
+    """
+    return cache_key(file_bytes, lang_code, _preprocess_settings(feature, refine))
+
+
+def _annotate_entry(processed_bytes: bytes, lang_code: str,
+                    feature: str = DOCUMENT_FEATURE) -> dict:
+    return {
+        "image": {"content": base64.b64encode(processed_bytes).decode("utf-8")},
+        "features": [{"type": feature}],
+        "imageContext": {
+            "languageHints": [lang_code]
+        }
     }
 
+
+def build_annotate_request(file_bytes: bytes, lang_code: str,
+                           feature: str = OCR_FEATURE) -> tuple[dict, PreprocessReport]:
+    """Decode + preprocess one upload into an images:annotate request entry."""
+    img = _auto_align(decode_for_ocr(file_bytes, MAX_DIMENSION, DECODE_MODE))
+    return _single_request(img, lang_code, feature)
+
+
+def _single_request(img: Image.Image, lang_code: str,
+                    feature: str = OCR_FEATURE) -> tuple[dict, PreprocessReport]:
+    data, report = _preprocess(img, feature=feature)
+    return _annotate_entry(data, lang_code, report.feature), report
+
+
+def build_tiled_request(img: Image.Image, lang_code: str, feature: str = OCR_FEATURE,
+                        measured: PreprocessReport | None = None,
+                        ) -> tuple[TiledImage, PreprocessReport]:
+    """
+    Enhance at native resolution and encode one entry per tile (see ocr_tiling).
+    ``measured``: the _measure report of the page at MAX_DIMENSION, taken
+    from a downscaled copy when not given. Its passes and feature are used
+    for every tile, so a tiled page is judged (screenshot, density, auto
+    feature) exactly as the single request would have been.
+    """
+    pixels = img.width * img.height
+    if pixels > TILE_MAX_PIXELS:
+        img = img.reduce(math.ceil(math.sqrt(pixels / TILE_MAX_PIXELS)))
+    img = _auto_align(img)
+    if measured is None:
+        _, measured = _measure(img, feature)
+    start = time.perf_counter()
+    img = _run_passes(to_mode(img, "L"), measured.passes)
+    if not GRAYSCALE:
+        img = img.convert("RGB")
+    feature = measured.feature
+    report = measured._replace(ms=round(measured.ms + (time.perf_counter() - start) * 1000, 1))
+    tiled = TiledImage(img.width, img.height, plan_tiles(img.width, img.height))
+    for tile in tiled.tiles:
+        data = encode_for_ocr(img.crop(tile.box), ENCODING_STRATEGY, one_bit=GRAYSCALE).data
+        tiled.entries.append(_annotate_entry(data, lang_code, feature))
+    logger.info("Tiling %dx%d image into %d tiles (%d KB)",
+                img.width, img.height, len(tiled.tiles), tiled.payload_bytes // 1024)
+    return tiled, report
+
+
+def build_ocr_request(file_bytes: bytes, lang_code: str, feature: str = OCR_FEATURE,
+                      ) -> tuple[dict | TiledImage, PreprocessReport]:
+    """
+    What run_ocr / the batch runners send for one upload: a single entry,
+    or a TiledImage when downscaling to MAX_DIMENSION would shrink the
+    text below TILE_MIN_TEXT_PX. Also returns the preprocess report,
+    which callers attach to the OCRResult.
+    ``feature`` is one of FEATURES ("auto" decides per image).
+    """
+    request, report, _ = _prepare_request(file_bytes, lang_code, feature)
+    return request, report
+
+
+def _prepare_request(file_bytes: bytes, lang_code: str, feature: str = OCR_FEATURE,
+                     ) -> tuple[dict | TiledImage, PreprocessReport, Image.Image | None]:
+    """
+    build_ocr_request, plus the aligned decode a single entry was made
+    from (None when tiled), so _refine_weak_blocks can crop from it
+    instead of decoding the upload again.
+    """
+    width, height = Image.open(io.BytesIO(file_bytes)).size      # header only
+    img = _auto_align(decode_for_ocr(file_bytes, MAX_DIMENSION, DECODE_MODE))
+    if not tiling_candidate(width, height, MAX_DIMENSION):
+        return (*_single_request(img, lang_code, feature), img)
+    # Measure the text at the size Vision would get; only small print pays
+    # for a full-resolution decode and one image per tile.
+    size = _fit_size(img.size, MAX_DIMENSION)
+    fitted = img.resize(size, Image.LANCZOS) if size != img.size else img   # _enhance skips it
+    text_height = _text_line_height(to_mode(fitted, "L"))
+    if not needs_tiling(text_height):
+        return (*_single_request(fitted, lang_code, feature), img)
+    logger.info("Text lines %.0f px tall at %dx%d — tiling at native resolution.",
+                text_height, size[0], size[1])
+    _, measured = _measure(fitted, feature)
+    del img, fitted
+    return (*build_tiled_request(decode_for_ocr(file_bytes, None, DECODE_MODE), lang_code,
+                                 feature, measured), None)
+
+
+def request_payload_bytes(request: dict | TiledImage) -> int:
+    if isinstance(request, TiledImage):
+        return request.payload_bytes
+    return len(request["image"]["content"])
+
+
+def _is_timeout(exc: Exception) -> bool:
+    if isinstance(exc, (requests.exceptions.Timeout, TimeoutError)):
+        return True
     try:
-        resp = requests.post(url, json=payload, timeout=30)
-        resp.raise_for_status()
-        data = resp.json()
-    except requests.exceptions.Timeout:
+        import httpx
+    except ImportError:
+        return False
+    return isinstance(exc, httpx.TimeoutException)
+
+
+def http_status(exc: Exception) -> int | None:
+    """HTTP status carried by a requests / httpx error, if any."""
+    return getattr(getattr(exc, "response", None), "status_code", None)
+
+
+def transport_error_result(exc: Exception, lang_code: str) -> OCRResult:
+    if isinstance(exc, QuotaExceeded):
+        return OCRResult("", 0.0, 0, lang_code, str(exc))
+    if _is_timeout(exc):
         return OCRResult("", 0.0, 0, lang_code, "API timeout. Please try again.")
-    except Exception as exc:
-        return OCRResult("", 0.0, 0, lang_code, f"API error: {exc}")
+    return OCRResult("", 0.0, 0, lang_code, f"API error: {exc}")
+
+
+def quota_status(plan: str | None = None) -> dict:
+    """Vision quota queue depth and expected wait (seconds) for a new request on ``plan``."""
+    return get_governor().status(plan)
+
+
+def quota_wait_budget(deadline: float | None) -> float:
+    """How long a call may queue for quota: QUOTA_MAX_WAIT, capped by its deadline."""
+    left = time_left(deadline)
+    return QUOTA_MAX_WAIT if left is None else max(0.0, min(QUOTA_MAX_WAIT, left))
+
+
+def annotate_entries(entries: list[dict], user: str | None = None,
+                     plan: str | None = None, deadline: float | None = None) -> list[dict]:
+    """
+    Send entries to the active backend, waiting for Vision quota first.
+    Quota wait, attempts and backoff all come out of the same ``deadline``;
+    a hedged duplicate is only sent if spare quota is available right now.
+    """
+    backend = get_backend()
+    may_hedge = None
+    if backend.name == "vision":
+        governor = get_governor()
+        governor.acquire(len(entries), user, plan, timeout=quota_wait_budget(deadline))
+        may_hedge = lambda: governor.try_acquire(len(entries))
+    return backend.annotate(entries, deadline, may_hedge)
 
-    # Parse response
+
+def annotate_tiled(tiled: TiledImage, lang_code: str, user: str | None = None,
+                   plan: str | None = None, deadline: float | None = None) -> OCRResult:
+    """OCR every tile (calls run concurrently when they exceed one request) and stitch."""
+    chunks = chunk_entries(tiled.entries)
     try:
-        response = data["responses"][0]
+        if len(chunks) == 1:
+            responses = annotate_entries(chunks[0], user, plan, deadline)
+        else:
+            with ThreadPoolExecutor(max_workers=len(chunks),
+                                    thread_name_prefix="ocr-tiles") as pool:
+                parts = pool.map(lambda c: annotate_entries(c, user, plan, deadline), chunks)
+                responses = [r for part in parts for r in part]
+    except Exception as exc:
+        return transport_error_result(exc, lang_code)
+    if len(responses) != len(tiled.entries):
+        return OCRResult("", 0.0, 0, lang_code,
+            f"Response error: expected {len(tiled.entries)} responses, got {len(responses)}")
+    return parse_annotate_response(stitch(tiled, responses), lang_code)
+
 
+def _annotation_from_text(items: list[dict]) -> dict:
+    """
+    fullTextAnnotation-shaped view of a TEXT_DETECTION ``textAnnotations``
+    list (whole text first, then one entry per word, no confidences): one
+    block holding every word, so both features parse the same way.
+    """
+    words = []
+    for item in items[1:]:
+        text = item.get("description", "")
+        if not text:
+            continue
+        symbols = [{"text": ch} for ch in text]
+        symbols[-1]["property"] = {"detectedBreak": {"type": "SPACE"}}
+        words.append({"boundingBox": item.get("boundingPoly", {}), "symbols": symbols})
+    block = {"boundingBox": items[0].get("boundingPoly", {}),
+             "paragraphs": [{"boundingBox": items[0].get("boundingPoly", {}), "words": words}]}
+    return {"text": items[0].get("description", ""), "pages": [{"blocks": [block] if words else []}]}
+
+
+def parse_annotate_response(response: dict, lang_code: str) -> OCRResult:
+    """
+    Turn one entry of the ``responses`` array into an OCRResult. Handles
+    DOCUMENT_TEXT_DETECTION and TEXT_DETECTION responses alike.
+    """
+    try:
         if "error" in response:
             return OCRResult("", 0.0, 0, lang_code,
                 f"Vision API error: {response['error']['message']}")
 
-        if "fullTextAnnotation" not in response:
+        annotation = response.get("fullTextAnnotation")
+        if annotation is None and response.get("textAnnotations"):
+            annotation = _annotation_from_text(response["textAnnotations"])
+        if annotation is None:
             return OCRResult(
                 "No text detected. Try a clearer image.",
                 0.0, 0, lang_code)
 
-        full_text = response["fullTextAnnotation"]["text"].strip()
-
-        # Calculate confidence from word confidences
-        pages = response["fullTextAnnotation"].get("pages", [])
-        confidences = []
-        block_count = 0
-        for page in pages:
-            for block in page.get("blocks", []):
-                block_count += 1
-                conf = block.get("confidence", 0.0)
-                if conf > 0:
-                    confidences.append(conf)
+        full_text = annotation["text"].strip()
+        layout = OCRLayout.from_annotation(annotation)
 
+        # Average of the block confidences Vision reported
+        confidences = [c for c in layout.block_conf if c > 0]
         avg_conf = sum(confidences) / len(confidences) if confidences else 0.85
 
         return OCRResult(
             text=full_text,
             confidence=avg_conf,
-            block_count=block_count,
+            block_count=layout.block_count,
             language=lang_code,
+            layout=layout,
         )
 
     except Exception as exc:
         logger.exception("Response parse error: %s", exc)
         return OCRResult("", 0.0, 0, lang_code, f"Response error: {exc}")
+
+
+def run_ocr(file_bytes: bytes, filename: str, lang_code: str,
+            use_cache: bool = True,
+            user: str | None = None, plan: str | None = None,
+            timeout: float | None = OCR_DEADLINE,
+            feature: str = OCR_FEATURE) -> OCRResult:
+    """
+    Run Google Vision OCR (served from the result cache when possible).
+    Concurrent calls for the same job share one in-flight request and its
+    result; errors reach those waiters but are never cached.
+    ``user`` / ``plan`` place the call in the quota governor's fair queue.
+    ``timeout`` is the whole call's budget (quota wait, retries and any
+    hedged request included); None waits as long as the transport allows.
+    ``feature``: "auto" (by text density), DOCUMENT_FEATURE or TEXT_FEATURE.
+    """
+    deadline = deadline_after(timeout)
+
+    unavailable = backend_unavailable_result(lang_code)
+    if unavailable:
+        return unavailable
+
+    invalid = validate_upload(file_bytes, lang_code)
+    if invalid:
+        return invalid
+
+    key = job_cache_key(file_bytes, lang_code, feature, refine=True)
+    if use_cache:
+        cached = get_cache().get(key)
+        if cached is not None:
+            logger.info("OCR cache hit: %s", filename)
+            return cached
+
+    def call() -> OCRResult:
+        result = _run_ocr_uncached(file_bytes, lang_code, user, plan, deadline, feature,
+                                   refine=True)
+        if use_cache and result.error is None:
+            get_cache().put(key, result)    # before landing, so late arrivals hit the cache
+        return result
+
+    # Concurrent identical uploads (shared handouts) wait on one Vision call.
+    try:
+        return get_flights().do(key, call, timeout=time_left(deadline))
+    except TimeoutError as exc:                 # gave up waiting on another caller's request
+        return transport_error_result(exc, lang_code)
+
+
+def _run_ocr_uncached(file_bytes: bytes, lang_code: str,
+                      user: str | None, plan: str | None,
+                      deadline: float | None = None,
+                      feature: str = OCR_FEATURE,
+                      refine: bool = False) -> OCRResult:
+    """One upload, no cache. ``refine`` must match the job_cache_key the result is stored under."""
+    try:
+        request, report, img = _prepare_request(file_bytes, lang_code, feature)
+    except Exception as exc:
+        return OCRResult("", 0.0, 0, lang_code, f"Image error: {exc}")
+    if isinstance(request, TiledImage):
+        # Tiles are already read at native resolution: nothing to refine.
+        result = annotate_tiled(request, lang_code, user, plan, deadline)
+    else:
+        result = _annotate_single(request, img if refine and REFINE_ENABLED else None,
+                                  lang_code, user, plan, deadline)
+    return result._replace(preprocess=report)
+
+
+def _annotate_single(entry: dict, img: Image.Image | None, lang_code: str,
+                     user: str | None, plan: str | None,
+                     deadline: float | None) -> OCRResult:
+    """One entry; weak blocks are re-read from ``img`` (the aligned decode) unless it is None."""
+    try:
+        responses = annotate_entries([entry], user, plan, deadline)
+    except Exception as exc:
+        return transport_error_result(exc, lang_code)
+
+    try:
+        response = responses[0]
+    except Exception as exc:
+        logger.exception("Response parse error: %s", exc)
+        return OCRResult("", 0.0, 0, lang_code, f"Response error: {exc}")
+    if img is not None:
+        response = _refine_weak_blocks(img, response, lang_code, user, plan, deadline)
+    return parse_annotate_response(response, lang_code)
+
+
+# ── Selective re-OCR ─────────────────────────────────────────────────────────
+
+def _region_crop(img: Image.Image, region: Region, ratio: float) -> tuple[Image.Image, float]:
+    """
+    Upscaled, contrast-boosted crop of ``region`` from the aligned image
+    (``ratio`` of its pixels per sent-image pixel). Also returns crop
+    pixels per sent-image pixel, for mapping boxes back.
+    """
+    x0, y0, x1, y1 = region.box
+    crop = to_mode(img.crop((round(x0 * ratio), round(y0 * ratio),
+                             round(x1 * ratio), round(y1 * ratio))), "L")
+    up = min(REFINE_MAX_UPSCALE, max(1.0, REFINE_LINE_PX / (region.word_height * ratio)),
+             MAX_DIMENSION / max(crop.size))
+    if up != 1.0:
+        crop = crop.resize((max(1, round(crop.width * up)), max(1, round(crop.height * up))),
+                           Image.LANCZOS)
+    crop = ImageOps.autocontrast(crop, cutoff=REFINE_CONTRAST_CUTOFF)
+    return ImageEnhance.Sharpness(crop).enhance(SHARPNESS_FACTOR), ratio * up
+
+
+def _refine_weak_blocks(img: Image.Image, response: dict, lang_code: str,
+                        user: str | None, plan: str | None,
+                        deadline: float | None) -> dict:
+    """
+    Re-read blocks under REFINE_BLOCK_CONFIDENCE in one follow-up call and
+    merge whatever improved (see ocr_refine). Crops come from ``img``, the
+    aligned decode the entry was built from. Any failure keeps the first
+    response: the follow-up is best-effort.
+    """
+    annotation = response.get("fullTextAnnotation")
+    if not annotation or not any(block.get("confidence", 1.0) < REFINE_BLOCK_CONFIDENCE
+                                 for page in annotation.get("pages", [])
+                                 for block in page.get("blocks", [])):
+        return response
+    left = time_left(deadline)
+    if left is not None and left < REFINE_MIN_SECONDS:
+        return response
+    try:
+        sent = _fit_size(img.size, MAX_DIMENSION)
+        regions = weak_blocks(annotation, sent)
+        if not regions:
+            return response
+        entries, scales = [], []
+        for region in regions:
+            crop, scale = _region_crop(img, region, img.width / sent[0])
+            data = encode_for_ocr(crop, ENCODING_STRATEGY, one_bit=GRAYSCALE).data
+            entries.append(_annotate_entry(data, lang_code))
+            scales.append(scale)
+        crop_responses = annotate_entries(entries, user, plan, deadline)
+    except Exception as exc:
+        logger.warning("Re-OCR of weak blocks skipped: %s", exc)
+        return response
+    merged, replaced = merge(response, regions, scales, crop_responses)
+    logger.info("Re-OCR: %d of %d weak blocks improved", replaced, len(regions))
+    return merged
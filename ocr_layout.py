@@ -0,0 +1,173 @@
+"""
+ocr_layout.py — Compact Layout Model
+──────────────────────────────────────
+Keeps the word-level layout of a Vision fullTextAnnotation on the OCRResult,
+so low-confidence highlighting and layout-aware exports never need a
+second call.
+- Column store: one array per field (boxes, confidences, breaks) instead
+  of nested dicts — about 30 bytes per word, cheap to pickle and cache
+- Hierarchy pages → blocks → paragraphs → words as first-child offsets
+  (children are contiguous, so no per-row parent pointers)
+- Word text in one string plus end offsets; the break after each word kept
+Built in one pass; vision_client.decode_response already dropped the
+per-symbol geometry while decoding the JSON.
+"""
+from __future__ import annotations
+import sys
+from array import array
+from bisect import bisect_right
+from typing import Iterator, NamedTuple
+
+BREAK_NONE  = 0
+BREAK_SPACE = 1
+BREAK_LINE  = 2
+
+_BREAKS = {
+    "SPACE": BREAK_SPACE, "SURE_SPACE": BREAK_SPACE,
+    "EOL_SURE_SPACE": BREAK_LINE, "LINE_BREAK": BREAK_LINE, "HYPHEN": BREAK_LINE,
+}
+
+Box = tuple[int, int, int, int]                 # x0, y0, x1, y1 in page pixels
+
+
+class Word(NamedTuple):
+    index:      int
+    text:       str
+    box:        Box
+    confidence: float
+    brk:        int                             # BREAK_* after this word
+    block:      int
+
+
+class Block(NamedTuple):
+    index:      int
+    page:       int
+    box:        Box
+    confidence: float
+    words:      range                           # word indexes
+
+
+def _box(poly: dict | None) -> Box:
+    vs = (poly or {}).get("vertices") or [{}]
+    xs = [v.get("x", 0) for v in vs]
+    ys = [v.get("y", 0) for v in vs]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+class OCRLayout:
+    """Pages, blocks, paragraphs and words of one OCR result, column-stored."""
+
+    __slots__ = ("page_size", "page_first_block",
+                 "block_box", "block_conf", "block_first_para",
+                 "para_box", "para_conf", "para_first_word",
+                 "word_box", "word_conf", "word_break", "word_end", "text")
+
+    def __init__(self):
+        self.page_size        = array("i")      # w, h per page
+        self.page_first_block = array("I", [0])
+        self.block_box        = array("i")      # 4 per block
+        self.block_conf       = array("d")
+        self.block_first_para = array("I", [0])
+        self.para_box         = array("i")
+        self.para_conf        = array("d")
+        self.para_first_word  = array("I", [0])
+        self.word_box         = array("i")
+        self.word_conf        = array("f")
+        self.word_break       = array("B")
+        self.word_end         = array("I")      # end offset of each word in ``text``
+        self.text             = ""
+
+    @classmethod
+    def from_annotation(cls, annotation: dict) -> "OCRLayout":
+        """Build from a fullTextAnnotation (Vision, tesseract or stitched tiles)."""
+        layout = cls()
+        parts: list[str] = []
+        end = 0
+        for page in annotation.get("pages", []):
+            layout.page_size.extend((page.get("width", 0), page.get("height", 0)))
+            for block in page.get("blocks", []):
+                block_conf = block.get("confidence", 0.0)
+                for para in block.get("paragraphs", []):
+                    para_conf = para.get("confidence", block_conf)
+                    for word in para.get("words", []):
+                        symbols = word.get("symbols", [])
+                        text = "".join(s.get("text", "") for s in symbols)
+                        if not text:
+                            continue
+                        brk = (symbols[-1].get("property", {})
+                               .get("detectedBreak", {}).get("type"))
+                        parts.append(text)
+                        end += len(text)
+                        layout.word_end.append(end)
+                        layout.word_box.extend(_box(word.get("boundingBox")))
+                        layout.word_conf.append(word.get("confidence", para_conf))
+                        layout.word_break.append(_BREAKS.get(brk, BREAK_NONE))
+                    layout.para_box.extend(_box(para.get("boundingBox")))
+                    layout.para_conf.append(para_conf)
+                    layout.para_first_word.append(len(layout.word_end))
+                layout.block_box.extend(_box(block.get("boundingBox")))
+                layout.block_conf.append(block_conf)
+                layout.block_first_para.append(len(layout.para_conf))
+            layout.page_first_block.append(len(layout.block_conf))
+        layout.text = "".join(parts)
+        return layout
+
+    # ── Sizes ──
+
+    def __len__(self) -> int:
+        return len(self.word_end)
+
+    @property
+    def page_count(self) -> int:
+        return len(self.page_size) // 2
+
+    @property
+    def block_count(self) -> int:
+        return len(self.block_conf)
+
+    @property
+    def paragraph_count(self) -> int:
+        return len(self.para_conf)
+
+    @property
+    def nbytes(self) -> int:
+        arrays = sum(getattr(self, name).itemsize * len(getattr(self, name))
+                     for name in self.__slots__ if name != "text")
+        return arrays + sys.getsizeof(self.text)
+
+    # ── Rows ──
+
+    def word(self, i: int) -> Word:
+        start = self.word_end[i - 1] if i else 0
+        para = bisect_right(self.para_first_word, i) - 1
+        return Word(i, self.text[start:self.word_end[i]],
+                    tuple(self.word_box[4 * i:4 * i + 4]), self.word_conf[i],
+                    self.word_break[i], bisect_right(self.block_first_para, para) - 1)
+
+    def words(self, rows: range | None = None) -> Iterator[Word]:
+        for i in rows if rows is not None else range(len(self)):
+            yield self.word(i)
+
+    def block(self, i: int) -> Block:
+        first = self.para_first_word[self.block_first_para[i]]
+        last = self.para_first_word[self.block_first_para[i + 1]]
+        return Block(i, bisect_right(self.page_first_block, i) - 1,
+                     tuple(self.block_box[4 * i:4 * i + 4]), self.block_conf[i],
+                     range(first, last))
+
+    def blocks(self) -> Iterator[Block]:
+        for i in range(self.block_count):
+            yield self.block(i)
+
+    def low_confidence_words(self, threshold: float) -> list[Word]:
+        """Words Vision was less sure of than ``threshold`` (0–1), in reading order."""
+        return [self.word(i) for i, conf in enumerate(self.word_conf) if conf < threshold]
+
+    # ── Pickling (slots, no __dict__) ──
+
+    def __getstate__(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state: tuple) -> None:
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
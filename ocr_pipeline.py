@@ -0,0 +1,241 @@
+"""
+ocr_pipeline.py — Two-Stage CPU / I/O OCR Pipeline
+────────────────────────────────────────────────────
+Overlaps preprocessing with Vision calls for large batches and API use.
+- Stage 1: a process pool decodes, enhances and encodes uploads
+- A bounded queue hands encoded payloads to stage 2 (backpressure keeps
+  at most ``queue_size`` payloads + one window of CPU jobs in memory)
+- Stage 2: I/O threads pack whatever payloads are ready into grouped
+  annotate calls
+- Results come back in input order; on_progress fires as items finish
+"""
+from __future__ import annotations
+import os
+import queue
+import logging
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable
+
+from ocr_engine import (
+    OCRResult, PreprocessReport, backend_unavailable_result, validate_upload, job_cache_key,
+    build_ocr_request, request_payload_bytes, OCR_DEADLINE, OCR_FEATURE,
+)
+from ocr_backends import get_backend
+from ocr_cache import get_cache
+from vision_client import deadline_after
+from batch_ocr import (
+    BatchItem, CancelToken, BATCH_WORKERS, _Pending, _item, _group_full, _annotate_group,
+    _blank_item, _reused_item,
+)
+from page_filter import PageFilter, Skip
+from ocr_tiling import TiledImage
+
+logger = logging.getLogger("pic2docs.pipeline")
+
+PIPELINE_QUEUE_SIZE = 16
+_DONE = object()                          # end-of-stream marker on the payload queue
+
+
+def _prepare(index: int, file_bytes: bytes, lang_code: str, feature: str = OCR_FEATURE,
+             ) -> tuple[int, tuple[dict | TiledImage, PreprocessReport] | None, str | None]:
+    """Stage 1 job (runs in a worker process)."""
+    try:
+        return index, build_ocr_request(file_bytes, lang_code, feature), None
+    except Exception as exc:
+        return index, None, f"Image error: {exc}"
+
+
+def run_pipeline(
+    files: list[tuple[str, bytes]],
+    lang_code: str = "en",
+    on_progress: Callable[[int, int, str], None] | None = None,
+    cpu_workers: int | None = None,
+    io_workers: int = BATCH_WORKERS,
+    queue_size: int = PIPELINE_QUEUE_SIZE,
+    cancel: CancelToken | None = None,
+    cpu_pool: Executor | None = None,
+    user: str | None = None,
+    plan: str | None = None,
+    timeout: float | None = OCR_DEADLINE,
+    skip_pages: bool = True,
+    feature: str = OCR_FEATURE,
+) -> list[BatchItem]:
+    """
+    Pipelined equivalent of batch_ocr.run_batch_ocr.
+
+    Args:
+        files:       List of (filename, file_bytes)
+        lang_code:   OCR language code
+        on_progress: Optional callback(done, total, filename), called from the
+                     calling thread as items finish
+        cpu_workers: Preprocessing processes (default: CPU count)
+        io_workers:  Concurrent annotate calls
+        queue_size:  Max encoded payloads waiting for the I/O stage
+        cancel:      Optional CancelToken; unsent items return "Cancelled."
+        cpu_pool:    Reuse a long-lived executor instead of starting one
+        user, plan:  Identity for the Vision quota governor's fair queue
+        timeout:     Budget per grouped call, from when it is sent
+        skip_pages:  Skip blank pages / reuse near-duplicates (page_filter)
+        feature:     "auto", DOCUMENT_TEXT_DETECTION or TEXT_DETECTION
+
+    Returns:
+        List of BatchItem results, in input order
+    """
+    total = len(files)
+    results: list[BatchItem | None] = [None] * total
+    done = 0
+
+    def place(index: int, item: BatchItem) -> None:
+        nonlocal done
+        results[index] = item
+        done += 1
+        if on_progress:
+            on_progress(done, total, files[index][0])
+
+    def finish(index: int, result: OCRResult) -> None:
+        place(index, _item(files[index][0], result))
+
+    def place_duplicates() -> None:
+        for index, skip in duplicates:
+            source = results[skip.same_as]
+            if source is not None:
+                place(index, _reused_item(source, files[index][0], skip))
+
+    unavailable = backend_unavailable_result(lang_code)
+    cache = get_cache()
+    pages = PageFilter() if skip_pages else None
+    duplicates: list[tuple[int, Skip]] = []
+    jobs: list[tuple[int, str]] = []                  # (index, cache key)
+    for i, (filename, file_bytes) in enumerate(files):
+        if unavailable:
+            finish(i, unavailable)
+            continue
+        invalid = validate_upload(file_bytes, lang_code)
+        if invalid:
+            finish(i, invalid)
+            continue
+        skip = pages.check(i, filename, file_bytes) if pages else None
+        if skip is not None:
+            if skip.same_as is None:
+                place(i, _blank_item(filename, skip, lang_code))
+            else:
+                duplicates.append((i, skip))
+            continue
+        key = job_cache_key(file_bytes, lang_code, feature)
+        cached = cache.get(key)
+        if cached is not None:
+            finish(i, cached)
+            continue
+        jobs.append((i, key))
+    if not jobs:
+        place_duplicates()
+        return results  # type: ignore[return-value]
+
+    cpu_workers = cpu_workers or os.cpu_count() or 2
+    io_workers = max(1, io_workers)
+    own_pool = cpu_pool is None
+    pool = cpu_pool or ProcessPoolExecutor(max_workers=cpu_workers)
+    get_backend().set_concurrency(io_workers)
+
+    stop = threading.Event()
+    payloads: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+    finished: queue.Queue[tuple[int, OCRResult]] = queue.Queue()
+    keys = dict(jobs)
+    cancelled = OCRResult("", 0.0, 0, lang_code, "Cancelled.")
+
+    def stopping() -> bool:
+        return stop.is_set() or bool(cancel and cancel.cancelled)
+
+    # ── Stage 1: submit CPU work, forward encoded payloads (blocking = backpressure) ──
+    def feed() -> None:
+        window: dict[Future, int] = {}
+
+        def forward(block: bool) -> None:
+            ready, _ = wait(list(window), timeout=None if block else 0,
+                            return_when=FIRST_COMPLETED)
+            for fut in ready:
+                index = window.pop(fut)
+                try:
+                    _, request, error = fut.result()
+                except Exception as exc:
+                    request, error = None, f"Image error: {exc}"
+                if error:
+                    finished.put((index, OCRResult("", 0.0, 0, lang_code, error)))
+                    continue
+                entry, report = request
+                payloads.put(_Pending(index, files[index][0], entry,
+                                      request_payload_bytes(entry), keys[index], report))
+
+        submitted = 0
+        try:
+            for index, _ in jobs:
+                if stopping():
+                    break
+                while len(window) >= cpu_workers * 2:
+                    forward(block=True)
+                window[pool.submit(_prepare, index, files[index][1], lang_code, feature)] = index
+                submitted += 1
+                forward(block=False)
+            while window:
+                forward(block=True)
+        except Exception as exc:
+            logger.exception("Pipeline feeder failed: %s", exc)
+            for fut, index in window.items():
+                finished.put((index, OCRResult("", 0.0, 0, lang_code, f"Image error: {exc}")))
+        finally:
+            for index, _ in jobs[submitted:]:
+                finished.put((index, cancelled))
+            payloads.put(_DONE)
+
+    # ── Stage 2: group whatever is queued into annotate calls ──
+    def io_loop() -> None:
+        carry: _Pending | None = None
+        while True:
+            first = carry if carry is not None else payloads.get()
+            carry = None
+            if first is _DONE:
+                payloads.put(_DONE)               # let sibling workers exit too
+                return
+            group, group_bytes = [first], first.size
+            while True:
+                try:
+                    nxt = payloads.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is _DONE or _group_full(group, group_bytes, nxt):
+                    carry = nxt
+                    break
+                group.append(nxt)
+                group_bytes += nxt.size
+            if stopping():
+                group_results = [cancelled] * len(group)
+            else:
+                try:
+                    group_results = _annotate_group(group, lang_code, user, plan,
+                                                    deadline_after(timeout))
+                except Exception as exc:
+                    logger.exception("Pipeline group failed: %s", exc)
+                    group_results = [OCRResult("", 0.0, 0, lang_code, f"API error: {exc}")] * len(group)
+            for p, result in zip(group, group_results):
+                finished.put((p.index, result))
+
+    threads = [threading.Thread(target=feed, name="ocr-pipeline-feed", daemon=True)]
+    threads += [threading.Thread(target=io_loop, name=f"ocr-pipeline-io-{n}", daemon=True)
+                for n in range(io_workers)]
+    for t in threads:
+        t.start()
+
+    try:
+        for _ in range(len(jobs)):
+            index, result = finished.get()
+            if result.error is None:
+                cache.put(keys[index], result)
+            finish(index, result)
+        place_duplicates()
+    finally:
+        stop.set()
+        if own_pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    return results  # type: ignore[return-value]
@@ -0,0 +1,142 @@
+"""
+ocr_refine.py — Selective Re-OCR of Weak Blocks
+─────────────────────────────────────────────────
+Instead of re-running a whole page with different settings, run_ocr sends
+one follow-up call with just the blocks Vision was unsure of.
+- weak_blocks: blocks under REFINE_BLOCK_CONFIDENCE, weakest first, with
+  their boxes in the coordinates of the image that was sent
+- Each region is cropped (padded), upscaled and contrast-boosted by
+  ocr_engine and sent as one multi-image request
+- merge: a region's new text replaces the block only if Vision is
+  REFINE_MIN_GAIN more confident; its words are moved back to page
+  coordinates, so layout and text stay consistent
+Geometry and merging only; cropping and encoding live in ocr_engine.
+"""
+from __future__ import annotations
+import os
+import logging
+from dataclasses import dataclass
+
+from ocr_tiling import _vertices_box
+
+logger = logging.getLogger("pic2docs.refine")
+
+REFINE_ENABLED          = os.environ.get("OCR_REFINE", "1") != "0"
+REFINE_BLOCK_CONFIDENCE = 0.70
+REFINE_MIN_GAIN         = 0.05       # new confidence must beat the old by this much
+REFINE_MAX_REGIONS      = 8          # crops per follow-up call
+REFINE_PADDING          = 0.25       # of the median word height, around each block
+REFINE_LINE_PX          = 48         # target word height in the crop
+REFINE_MAX_UPSCALE      = 4.0
+REFINE_CONTRAST_CUTOFF  = 2          # percent, autocontrast on each crop
+REFINE_MIN_SECONDS      = 3.0        # left on the deadline, or the follow-up is skipped
+
+_BREAK_TEXT = {"SPACE": " ", "SURE_SPACE": " ", "EOL_SURE_SPACE": "\n",
+               "LINE_BREAK": "\n", "HYPHEN": "-\n"}
+
+
+@dataclass
+class Region:
+    page:        int
+    block:       int
+    box:         tuple[int, int, int, int]    # padded, in sent-image pixels
+    word_height: float                        # median, in sent-image pixels
+    confidence:  float
+    text:        str                          # as it appears in fullTextAnnotation.text
+    start:       int                          # ... at this offset
+
+
+def block_text(block: dict) -> str:
+    """Rebuild a block's share of fullTextAnnotation.text from its symbols."""
+    parts = []
+    for para in block.get("paragraphs", []):
+        for word in para.get("words", []):
+            for symbol in word.get("symbols", []):
+                parts.append(symbol.get("text", ""))
+                brk = symbol.get("property", {}).get("detectedBreak", {}).get("type")
+                parts.append(_BREAK_TEXT.get(brk, ""))
+    return "".join(parts)
+
+
+def weak_blocks(annotation: dict, size: tuple[int, int],
+                threshold: float = REFINE_BLOCK_CONFIDENCE) -> list[Region]:
+    """Blocks under ``threshold`` that can be located in the text, weakest first."""
+    width, height = size
+    text = annotation.get("text", "")
+    regions, cursor = [], 0
+    for p, page in enumerate(annotation.get("pages", [])):
+        for b, block in enumerate(page.get("blocks", [])):
+            own = block_text(block)
+            at = text.find(own, cursor) if own.strip() else -1
+            if at >= 0:
+                cursor = at + len(own)
+            conf = block.get("confidence", 1.0)
+            if conf >= threshold or at < 0:
+                continue
+            boxes = [_vertices_box(w.get("boundingBox", {}))
+                     for para in block.get("paragraphs", []) for w in para.get("words", [])]
+            heights = sorted(y1 - y0 for _, y0, _, y1 in boxes)
+            word_height = max(1.0, float(heights[len(heights) // 2])) if heights else 1.0
+            pad = max(4, round(word_height * REFINE_PADDING))
+            x0, y0, x1, y1 = _vertices_box(block.get("boundingBox", {}))
+            box = (max(0, x0 - pad), max(0, y0 - pad), min(width, x1 + pad), min(height, y1 + pad))
+            if box[2] - box[0] < 4 or box[3] - box[1] < 4:
+                continue
+            regions.append(Region(p, b, box, word_height, conf, own, at))
+    regions.sort(key=lambda r: r.confidence)
+    return regions[:REFINE_MAX_REGIONS]
+
+
+def _moved(node: dict, scale: float, ox: int, oy: int) -> dict:
+    """Copy of a block/paragraph/word with its boxes mapped from crop to page pixels."""
+    node = dict(node)
+    poly = node.get("boundingBox")
+    if poly:
+        node["boundingBox"] = {"vertices": [
+            {"x": ox + round(v.get("x", 0) / scale), "y": oy + round(v.get("y", 0) / scale)}
+            for v in poly.get("vertices", [])]}
+    for child in ("paragraphs", "words"):
+        if child in node:
+            node[child] = [_moved(c, scale, ox, oy) for c in node[child]]
+    return node
+
+
+def _region_confidence(annotation: dict) -> float | None:
+    confs = [block["confidence"] for page in annotation.get("pages", [])
+             for block in page.get("blocks", []) if block.get("confidence", 0) > 0]
+    return sum(confs) / len(confs) if confs else None
+
+
+def merge(response: dict, regions: list[Region], scales: list[float],
+          crop_responses: list[dict]) -> tuple[dict, int]:
+    """
+    Replace each region's block with its re-OCR'd blocks where that helped.
+    ``scales`` are crop pixels per sent-image pixel. Returns the merged
+    response and the number of regions replaced.
+    """
+    annotation = response["fullTextAnnotation"]
+    text = annotation.get("text", "")
+    replacements = []                          # (region, new blocks, new text)
+    for region, scale, crop in zip(regions, scales, crop_responses):
+        new = crop.get("fullTextAnnotation")
+        if "error" in crop or not new or not new.get("text", "").strip():
+            continue
+        conf = _region_confidence(new)
+        if conf is None or conf < region.confidence + REFINE_MIN_GAIN:
+            continue
+        blocks = [_moved(block, scale, region.box[0], region.box[1])
+                  for page in new.get("pages", []) for block in page.get("blocks", [])]
+        tail = region.text[len(region.text.rstrip()):]
+        replacements.append((region, blocks, new["text"].strip() + tail))
+    if not replacements:
+        return response, 0
+
+    pages = [dict(page, blocks=list(page.get("blocks", [])))
+             for page in annotation.get("pages", [])]
+    for region, blocks, _ in sorted(replacements, key=lambda r: (r[0].page, r[0].block), reverse=True):
+        pages[region.page]["blocks"][region.block:region.block + 1] = blocks
+    # Splice the text back to front so earlier offsets stay valid.
+    for region, _, new_text in sorted(replacements, key=lambda r: r[0].start, reverse=True):
+        text = text[:region.start] + new_text + text[region.start + len(region.text):]
+    merged = dict(response, fullTextAnnotation=dict(annotation, text=text, pages=pages))
+    return merged, len(replacements)
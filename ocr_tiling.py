@@ -0,0 +1,249 @@
+"""
+ocr_tiling.py — Native-Resolution Tiling for Oversized Images
+───────────────────────────────────────────────────────────────
+A3 scans and whiteboard panoramas lose their small print when shrunk to
+MAX_DIMENSION, so those are cut into overlapping tiles instead and OCR'd
+at native resolution.
+- Trigger: past TILE_MIN_PIXELS, the upload is decoded reduced as usual
+  and its text lines measured; only if they would reach Vision under
+  TILE_MIN_TEXT_PX tall is it re-decoded at full size and tiled. Pixel
+  count alone is not enough — a 48 MP phone photo of an A4 page has
+  large text and would otherwise cost 12 Vision images
+- OCR_TILING=0 turns tiling off
+- plan_tiles: evenly spaced tiles with TILE_OVERLAP px of overlap; each
+  tile owns a "core" that ends halfway through every overlap
+- Tiles are encoded separately, so TARGET_PAYLOAD_BYTES holds per tile,
+  and sent together (up to TILES_PER_CALL) so Vision reads them in parallel
+- stitch: words are moved to page coordinates and kept only by the tile
+  whose core holds their centre (overlap dedup), then re-flowed into lines
+  and paragraphs in reading order as one Vision-shaped response
+Geometry and stitching only; encoding lives in ocr_engine.
+"""
+from __future__ import annotations
+import os
+import math
+import logging
+from dataclasses import dataclass, field
+from statistics import median
+
+logger = logging.getLogger("pic2docs.tiling")
+
+TILING_ENABLED    = os.environ.get("OCR_TILING", "1") != "0"
+TILE_MIN_PIXELS   = int(os.environ.get("OCR_TILE_MIN_PIXELS", 16_000_000))  # A3 @ 300 dpi ≈ 17 MP
+TILE_MIN_TEXT_PX  = float(os.environ.get("OCR_TILE_MIN_TEXT_PX", 8))       # line ink height once downscaled
+TILE_MAX_PIXELS   = 80_000_000       # larger uploads are reduced to this before tiling
+TILE_SIZE         = 2400             # px; must stay <= ocr_engine.MAX_DIMENSION
+TILE_OVERLAP      = 320              # px; wider than a long word at native resolution
+TILES_PER_CALL    = 16
+TILE_CALL_PAYLOAD = 8 * 1024 * 1024  # base64 bytes per annotate call
+
+_SPACE_BREAKS = {"SPACE", "SURE_SPACE", "EOL_SURE_SPACE", "LINE_BREAK"}
+
+
+@dataclass
+class Tile:
+    box:  tuple[int, int, int, int]     # crop box in page pixels (x0, y0, x1, y1)
+    core: tuple[int, int, int, int]     # region whose words this tile owns
+
+
+@dataclass
+class TiledImage:
+    """A prepared oversized upload: one annotate entry per tile."""
+    width:   int
+    height:  int
+    tiles:   list[Tile]
+    entries: list[dict] = field(default_factory=list)
+
+    @property
+    def payload_bytes(self) -> int:
+        return sum(len(e["image"]["content"]) for e in self.entries)
+
+
+def tiling_candidate(width: int, height: int, max_dimension: int) -> bool:
+    """Header-only check: large enough that downscaling might lose small print."""
+    return (TILING_ENABLED and max(width, height) > max_dimension
+            and width * height >= TILE_MIN_PIXELS)
+
+
+def needs_tiling(text_height: float | None) -> bool:
+    """
+    Tile a candidate whose text lines measure ``text_height`` px after
+    downscaling (None: no text lines found — nothing to gain from tiling).
+    """
+    return text_height is not None and text_height < TILE_MIN_TEXT_PX
+
+
+def _axis(length: int, size: int, overlap: int) -> list[tuple[int, int, int, int]]:
+    """(start, end, core_start, core_end) spans covering ``length``."""
+    if length <= size:
+        return [(0, length, 0, length)]
+    n = math.ceil((length - overlap) / (size - overlap))
+    step = (length - size) / (n - 1)
+    starts = [round(i * step) for i in range(n)]
+    spans = []
+    for i, start in enumerate(starts):
+        end = start + size
+        core_start = 0 if i == 0 else (starts[i] + starts[i - 1] + size) // 2
+        core_end = length if i == n - 1 else (starts[i + 1] + end) // 2
+        spans.append((start, end, core_start, core_end))
+    return spans
+
+
+def plan_tiles(width: int, height: int,
+               size: int = TILE_SIZE, overlap: int = TILE_OVERLAP) -> list[Tile]:
+    """Row-major tiles covering the page."""
+    return [
+        Tile((x0, y0, x1, y1), (cx0, cy0, cx1, cy1))
+        for y0, y1, cy0, cy1 in _axis(height, size, overlap)
+        for x0, x1, cx0, cx1 in _axis(width, size, overlap)
+    ]
+
+
+def chunk_entries(entries: list[dict]) -> list[list[dict]]:
+    """Split tile entries into annotate calls within Vision's per-call limits."""
+    chunks: list[list[dict]] = [[]]
+    size = 0
+    for entry in entries:
+        n = len(entry["image"]["content"])
+        if chunks[-1] and (len(chunks[-1]) >= TILES_PER_CALL or size + n > TILE_CALL_PAYLOAD):
+            chunks.append([])
+            size = 0
+        chunks[-1].append(entry)
+        size += n
+    return chunks
+
+
+# ── Stitching ────────────────────────────────────────────────────────────────
+
+@dataclass
+class _Word:
+    text:  str
+    box:   tuple[int, int, int, int]
+    conf:  float
+    space: bool                         # a space follows this word
+    raw:   dict
+
+    @property
+    def cx(self) -> float:
+        return (self.box[0] + self.box[2]) / 2
+
+    @property
+    def cy(self) -> float:
+        return (self.box[1] + self.box[3]) / 2
+
+    @property
+    def height(self) -> int:
+        return self.box[3] - self.box[1]
+
+
+def _vertices_box(poly: dict) -> tuple[int, int, int, int]:
+    vs = poly.get("vertices") or [{}]
+    xs = [v.get("x", 0) for v in vs]
+    ys = [v.get("y", 0) for v in vs]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _rect(box: tuple[int, int, int, int]) -> dict:
+    x0, y0, x1, y1 = box
+    return {"vertices": [{"x": x0, "y": y0}, {"x": x1, "y": y0},
+                         {"x": x1, "y": y1}, {"x": x0, "y": y1}]}
+
+
+def _union(boxes: list[tuple[int, int, int, int]]) -> tuple[int, int, int, int]:
+    return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+            max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+
+def _owned_words(tile: Tile, annotation: dict) -> list[_Word]:
+    ox, oy = tile.box[0], tile.box[1]
+    cx0, cy0, cx1, cy1 = tile.core
+    words = []
+    for page in annotation.get("pages", []):
+        for block in page.get("blocks", []):
+            for para in block.get("paragraphs", []):
+                for word in para.get("words", []):
+                    x0, y0, x1, y1 = _vertices_box(word.get("boundingBox", {}))
+                    box = (x0 + ox, y0 + oy, x1 + ox, y1 + oy)
+                    cx, cy = (box[0] + box[2]) / 2, (box[1] + box[3]) / 2
+                    if not (cx0 <= cx < cx1 and cy0 <= cy < cy1):
+                        continue                         # the neighbouring tile owns it
+                    symbols = word.get("symbols", [])
+                    text = "".join(s.get("text", "") for s in symbols)
+                    if not text:
+                        continue
+                    brk = (symbols[-1].get("property", {})
+                           .get("detectedBreak", {}).get("type"))
+                    conf = word.get("confidence", para.get("confidence", block.get("confidence", 0.0)))
+                    raw = {**word, "boundingBox": _rect(box)}
+                    words.append(_Word(text, box, conf, brk in _SPACE_BREAKS, raw))
+    return words
+
+
+def _lines(words: list[_Word]) -> list[list[_Word]]:
+    """Group words into lines (top to bottom), each sorted left to right."""
+    if not words:
+        return []
+    tol = max(4.0, 0.5 * median(w.height for w in words))
+    lines: list[list[_Word]] = []
+    line_cy = None
+    for w in sorted(words, key=lambda w: w.cy):
+        if lines and abs(w.cy - line_cy) <= tol:
+            lines[-1].append(w)
+            line_cy += (w.cy - line_cy) / len(lines[-1])
+        else:
+            lines.append([w])
+            line_cy = w.cy
+    return [sorted(line, key=lambda w: w.box[0]) for line in lines]
+
+
+def stitch(tiled: TiledImage, responses: list[dict]) -> dict:
+    """
+    Merge per-tile responses into one Vision-shaped response for the page.
+    Any tile error fails the page (a silently missing strip is worse).
+    """
+    for n, response in enumerate(responses, 1):
+        if "error" in response:
+            message = response["error"].get("message", "unknown error")
+            return {"error": {"message": f"tile {n}/{len(responses)}: {message}"}}
+
+    words: list[_Word] = []
+    for tile, response in zip(tiled.tiles, responses):
+        words.extend(_owned_words(tile, response.get("fullTextAnnotation", {})))
+    if not words:
+        return {}
+
+    lines = _lines(words)
+    line_height = median(w.height for w in words)
+
+    # Paragraph = run of lines without an unusually large vertical gap.
+    paragraphs: list[list[list[_Word]]] = [[lines[0]]]
+    for prev, line in zip(lines, lines[1:]):
+        gap = min(w.box[1] for w in line) - max(w.box[3] for w in prev)
+        if gap > 1.2 * line_height:
+            paragraphs.append([])
+        paragraphs[-1].append(line)
+
+    text_lines, blocks = [], []
+    for para in paragraphs:
+        para_words = [w for line in para for w in line]
+        for line in para:
+            parts = []
+            for i, w in enumerate(line):
+                parts.append(w.text)
+                if i < len(line) - 1 and w.space:
+                    parts.append(" ")
+            text_lines.append("".join(parts))
+        conf = sum(w.conf for w in para_words) / len(para_words)
+        box = _rect(_union([w.box for w in para_words]))
+        blocks.append({
+            "boundingBox": box,
+            "confidence":  conf,
+            "paragraphs":  [{"boundingBox": box, "confidence": conf,
+                             "words": [w.raw for w in para_words]}],
+        })
+    logger.info("Stitched %d tiles → %d words, %d paragraphs",
+                len(tiled.tiles), len(words), len(blocks))
+    return {"fullTextAnnotation": {
+        "text": "\n".join(text_lines) + "\n",
+        "pages": [{"width": tiled.width, "height": tiled.height, "blocks": blocks}],
+    }}
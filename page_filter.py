@@ -0,0 +1,180 @@
+"""
+page_filter.py — Blank / Near-Duplicate Page Pre-Filter
+─────────────────────────────────────────────────────────
+Cheap checks run on a reduced decode before a batch pays for Vision calls.
+- Blank: share of "ink" pixels — darker than their local background by
+  INK_CONTRAST — below BLANK_INK_FRACTION (paper grain, gradients and
+  lone specks do not count; tiny text does)
+- Near-duplicate: 256-bit difference hash of the autocontrasted page,
+  Hamming distance <= DUP_MAX_DISTANCE against earlier pages in the batch,
+  then confirmed pixel by pixel at ANALYSIS_SIZE. The hash only sees the
+  layout — two copies of one form with different names and amounts are
+  1-6 bits apart — so it picks candidates and never decides on its own.
+  Candidates are ranked by a coarse pixel difference at half that size
+  and only the DUP_MAX_CANDIDATES nearest get the exact check
+- Each kept page holds its smoothed analysis thumbnail (~0.9 MB for an
+  A4 page with the half-size copy), so nothing is decoded twice
+Both are conservative: byte-identical, re-saved or re-exposed copies match;
+a re-shot (shifted) capture or a page differing by a single full stop does
+not, and is OCR'd.
+"""
+from __future__ import annotations
+import io
+import hashlib
+import logging
+from dataclasses import dataclass, field
+
+import numpy as np
+from PIL import Image, ImageFilter, ImageOps
+
+logger = logging.getLogger("pic2docs.page_filter")
+
+ANALYSIS_SIZE      = 1024          # px, longest side of the decoded thumbnail
+INK_CONTRAST       = 28            # grey levels below the local background
+BLANK_INK_FRACTION = 0.0001        # a single short word is ~0.0002
+HASH_SIZE          = 16            # 16x16 = 256-bit dhash
+DUP_MAX_DISTANCE   = 12            # bits; random text pages measure 32-37, same-layout forms 0-6
+DUP_MAX_CANDIDATES = 3             # hash matches (nearest by pixel_distance) given the exact check
+DUP_PIXEL_DELTA    = 28            # grey levels outside a pixel's 3x3 neighbourhood in the other page
+DUP_MAX_CHANGED    = 0             # changed pixels allowed; one added full stop changes 1-6
+
+
+@dataclass
+class PageSignature:
+    ink:    float                  # fraction of ink pixels
+    dhash:  np.ndarray             # bool[HASH_SIZE * HASH_SIZE]
+    digest: bytes = b""            # SHA-256 of the file bytes
+    pixels: np.ndarray | None = field(default=None, repr=False)   # uint8, see _comparable
+    coarse: np.ndarray | None = field(default=None, repr=False)   # uint8, pixels at half size
+
+    @property
+    def blank(self) -> bool:
+        return self.ink < BLANK_INK_FRACTION
+
+    def distance(self, other: "PageSignature") -> int:
+        return int(np.count_nonzero(self.dhash != other.dhash))
+
+    def pixel_distance(self, other: "PageSignature") -> int:
+        """Half-size pixels differing by more than DUP_PIXEL_DELTA (ranking only)."""
+        if self.coarse is None or other.coarse is None or self.coarse.shape != other.coarse.shape:
+            return -1
+        diff = np.abs(self.coarse.astype(np.int16) - other.coarse)
+        return int(np.count_nonzero(diff > DUP_PIXEL_DELTA))
+
+
+@dataclass
+class Skip:
+    reason:  str                   # user-facing, shown on the BatchItem
+    same_as: int | None = None     # index of the page whose result is reused
+
+
+def _thumbnail(file_bytes: bytes) -> Image.Image:
+    img = Image.open(io.BytesIO(file_bytes))
+    img.draft("L", (ANALYSIS_SIZE, ANALYSIS_SIZE))     # JPEG: decode at 1/2..1/8 scale
+    img = ImageOps.exif_transpose(img).convert("L")
+    img.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE))
+    return img
+
+
+def _comparable(contrasted: Image.Image) -> Image.Image:
+    """
+    What same_page compares: the autocontrasted thumbnail after a 3x3 box
+    blur. A JPEG's draft decode and a PNG's full decode resample strokes a
+    little differently; blurring both the same way evens that out.
+    """
+    return contrasted.filter(ImageFilter.BoxBlur(1))
+
+
+def page_signature(file_bytes: bytes) -> PageSignature:
+    img = _thumbnail(file_bytes)
+    pixels = np.asarray(img, dtype=np.int16)
+    background = np.asarray(img.filter(ImageFilter.BoxBlur(8)), dtype=np.int16)
+    ink = float(np.count_nonzero(background - pixels > INK_CONTRAST)) / pixels.size
+
+    contrasted = ImageOps.autocontrast(img, cutoff=1)
+    small = contrasted.resize((HASH_SIZE + 1, HASH_SIZE), Image.BOX)
+    grid = np.asarray(small, dtype=np.int16)
+    dhash = (grid[:, 1:] - grid[:, :-1] > 3).ravel()   # small tolerance keeps flat paper stable
+    comparable = _comparable(contrasted)
+    return PageSignature(ink, dhash, hashlib.sha256(file_bytes).digest(),
+                         np.asarray(comparable), np.asarray(comparable.reduce(2)))
+
+
+def _neighbourhood(pixels: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """3x3 minimum and maximum of every pixel (separable, edges repeated)."""
+    p = np.pad(pixels, 1, mode="edge")
+    rows_lo = np.minimum(np.minimum(p[:, :-2], p[:, 1:-1]), p[:, 2:])
+    rows_hi = np.maximum(np.maximum(p[:, :-2], p[:, 1:-1]), p[:, 2:])
+    low = np.minimum(np.minimum(rows_lo[:-2], rows_lo[1:-1]), rows_lo[2:])
+    high = np.maximum(np.maximum(rows_hi[:-2], rows_hi[1:-1]), rows_hi[2:])
+    return low, high
+
+
+def _changed_pixels(a: np.ndarray, b: np.ndarray) -> int:
+    """Pixels of ``a`` darker or lighter than all of their 3x3 neighbourhood in ``b``."""
+    low, high = _neighbourhood(b)
+    return int(np.count_nonzero((a < low - DUP_PIXEL_DELTA) | (a > high + DUP_PIXEL_DELTA)))
+
+
+def same_page(a: PageSignature, b: PageSignature) -> bool:
+    """
+    Exact check behind a hash match: identical bytes, or the same pixels at
+    ANALYSIS_SIZE after autocontrast and smoothing. The 3x3 neighbourhood
+    absorbs JPEG re-encoding at stroke edges; a new or changed glyph does
+    not fit in it.
+    """
+    if a.digest and a.digest == b.digest:
+        return True
+    if a.pixels is None or b.pixels is None or a.pixels.shape != b.pixels.shape:
+        return False
+    pa, pb = a.pixels.astype(np.int16), b.pixels.astype(np.int16)
+    return (_changed_pixels(pa, pb) <= DUP_MAX_CHANGED
+            and _changed_pixels(pb, pa) <= DUP_MAX_CHANGED)
+
+
+class PageFilter:
+    """
+    Per-batch filter: call check() for each page in input order.
+    Remembers kept pages so later near-duplicates can point back at them.
+    """
+
+    def __init__(self, skip_blank: bool = True, skip_duplicates: bool = True):
+        self.skip_blank = skip_blank
+        self.skip_duplicates = skip_duplicates
+        self._kept: list[tuple[int, str, PageSignature]] = []
+        self._by_digest: dict[bytes, int] = {}          # byte-identical copies skip the ranking
+        self.blank = 0
+        self.duplicates = 0
+
+    def check(self, index: int, filename: str, file_bytes: bytes) -> Skip | None:
+        """Skip for page ``index``, or None if it should be OCR'd."""
+        if not (self.skip_blank or self.skip_duplicates):
+            return None
+        try:
+            sig = page_signature(file_bytes)
+        except Exception as exc:
+            logger.warning("Page filter could not read %s: %s", filename, exc)
+            return None                                 # let the OCR path report it
+        if self.skip_blank and sig.blank:
+            self.blank += 1
+            return Skip("Blank page — not sent for OCR.")
+        if not self.skip_duplicates:
+            return None
+        exact = self._by_digest.get(sig.digest)
+        if exact is not None:
+            near = [exact]
+        else:
+            # Same-layout forms all pass the hash; rank them by pixels so the
+            # exact check runs a bounded number of times per page.
+            ranked = sorted((sig.pixel_distance(kept), n) for n, (_, _, kept) in enumerate(self._kept)
+                            if sig.distance(kept) <= DUP_MAX_DISTANCE)
+            near = [n for d, n in ranked if d >= 0][:DUP_MAX_CANDIDATES]
+        for n in near:
+            kept_index, kept_name, kept = self._kept[n]
+            if same_page(sig, kept):
+                self.duplicates += 1
+                return Skip(f"Duplicate of {kept_name} — reused its result.", kept_index)
+            logger.debug("%s matches the layout of %s but not its content.", filename, kept_name)
+        self._by_digest.setdefault(sig.digest, len(self._kept))
+        self._kept.append((index, filename, sig))
+        return None
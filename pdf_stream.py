@@ -0,0 +1,353 @@
+"""
+pdf_stream.py — Streaming PDF Writer for Large Exports
+────────────────────────────────────────────────────────
+fpdf2 keeps every page in memory until output() and then serialises the
+whole document at once; for combined batch output (hundreds of pages)
+that is a large peak and seconds of work before the first byte.
+StreamingPDF writes each page to ``out`` as soon as it is full.
+- Same look as exporter.export_pdf: A4, DejaVuSans, header rule and
+  "Page N" footer, title block on page 1
+- Text is laid out with the shared font metrics (font_registry) and
+  written as Identity-H glyph ids, so nothing is renumbered later
+- At close: the glyph subset (original ids kept), widths, ToUnicode map,
+  page tree, outline (bookmarks) and xref — all sized by glyphs used
+  and page count, not by text
+- write_sections: one bookmarked section per (title, text), from any
+  iterable (a generator keeps only one section's text alive)
+Memory held: one page of content plus the set of glyphs used.
+"""
+from __future__ import annotations
+import io
+import zlib
+import logging
+from datetime import datetime
+from typing import BinaryIO, Callable, Iterable
+
+from fontTools import ttLib
+from fontTools import subset as ftsubset
+
+from font_registry import get_font_registry
+
+logger = logging.getLogger("pic2docs.pdf_stream")
+
+MM          = 72 / 25.4                  # points per millimetre
+PAGE_W      = 210 * MM                   # A4
+PAGE_H      = 297 * MM
+MARGIN      = 20 * MM
+BOTTOM      = 20 * MM                    # auto page break margin
+BODY_SIZE   = 12
+BODY_LINE   = 7 * MM
+BLANK_LINE  = 4 * MM
+
+TEXT_COLOR  = (30, 30, 40)
+TITLE_COLOR = (80, 70, 200)
+META_COLOR  = (120, 120, 140)
+FOOT_COLOR  = (150, 150, 160)
+RULE_COLOR  = (200, 200, 220)
+TITLE_RULE  = (180, 170, 240)
+
+# Reserved object numbers; pages and bookmarks are numbered from _FIRST_FREE.
+_CATALOG, _PAGES, _FONT, _CIDFONT, _DESCRIPTOR, _FONTFILE, _TOUNICODE, _OUTLINES, _INFO = range(1, 10)
+_FIRST_FREE = 10
+
+# Tables fpdf2 drops from its subsets too.
+_DROP_TABLES = ["FFTM", "GDEF", "GPOS", "GSUB", "MATH", "hdmx", "meta"]
+
+
+def _pdf_string(text: str) -> bytes:
+    """UTF-16BE text string with BOM, as a hex literal (titles, metadata)."""
+    return b"<FEFF" + text.encode("utf-16-be").hex().upper().encode("ascii") + b">"
+
+
+def _rgb(color: tuple[int, int, int]) -> str:
+    return " ".join(f"{c / 255:.3f}" for c in color)
+
+
+class StreamingPDF:
+    """Incremental A4 text PDF. Call text/blank/bookmark, then close()."""
+
+    def __init__(self, out: BinaryIO, title: str = "Pic2Docs — Extracted Text",
+                 generated: str | None = None):
+        self.out = out
+        self.title = title
+        self.generated = generated or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        fonts = get_font_registry()
+        self._font_data = fonts.data()
+        self._metrics = fonts.pdf_metrics()
+        self._offsets: dict[int, int] = {}
+        self._pos = 0
+        self._next_obj = _FIRST_FREE
+        self._page_objs: list[int] = []
+        self._bookmarks: list[tuple[str, int, float]] = []       # title, page number (0-based), top y
+        self._used: dict[int, str] = {}                          # glyph id → character
+        self._missing: set[str] = set()
+        self._codes: dict[str, str] = {}                         # character → glyph id hex
+        self._ops: list[str] = []
+        self._y = 0.0
+        self._write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        self._start_page()
+
+    # ── Low-level output ──
+
+    def _write(self, data: bytes) -> None:
+        self.out.write(data)
+        self._pos += len(data)
+
+    def _alloc(self) -> int:
+        n = self._next_obj
+        self._next_obj += 1
+        return n
+
+    def _obj(self, num: int, body: bytes) -> None:
+        self._offsets[num] = self._pos
+        self._write(b"%d 0 obj\n" % num + body + b"\nendobj\n")
+
+    def _stream(self, num: int, data: bytes, extra: bytes = b"") -> None:
+        packed = zlib.compress(data, 6)
+        self._obj(num, b"<< /Length %d /Filter /FlateDecode%s >>\nstream\n" % (len(packed), extra)
+                  + packed + b"\nendstream")
+
+    # ── Text primitives ──
+
+    def _encode(self, text: str) -> str:
+        codes = self._codes
+        try:
+            return "".join([codes[ch] for ch in text])
+        except KeyError:
+            pass
+        glyph_ids = self._metrics.glyph_ids
+        for ch in set(text) - codes.keys():
+            gid = glyph_ids.get(ord(ch))
+            if gid is None:
+                self._missing.add(ch)
+                gid = 0
+            else:
+                self._used.setdefault(gid, ch)
+            codes[ch] = f"{gid:04X}"
+        return "".join([codes[ch] for ch in text])
+
+    def width(self, text: str, size: float) -> float:
+        cw = self._metrics.cw
+        return sum(cw[ord(ch)] for ch in text) * size / 1000
+
+    def _draw_text(self, x: float, top: float, height: float, text: str,
+                   size: float, color: tuple[int, int, int]) -> None:
+        """Text vertically centred in a cell of ``height`` at ``top`` (like fpdf2 cells)."""
+        baseline = top + (height + size * 0.7) / 2
+        self._ops.append(f"BT /F1 {size:g} Tf {_rgb(color)} rg {x:.2f} {PAGE_H - baseline:.2f} Td "
+                         f"<{self._encode(text)}> Tj ET")
+
+    def _rule(self, y: float, color: tuple[int, int, int], width_mm: float) -> None:
+        self._ops.append(f"{_rgb(color)} RG {width_mm * MM:.2f} w "
+                         f"{MARGIN:.2f} {PAGE_H - y:.2f} m {PAGE_W - MARGIN:.2f} {PAGE_H - y:.2f} l S")
+
+    # ── Pages ──
+
+    def _start_page(self) -> None:
+        self._ops = []
+        y = MARGIN
+        self._draw_text(MARGIN, y, 8 * MM, self.title, 9, META_COLOR)
+        y += 4 * MM
+        self._rule(y, RULE_COLOR, 0.3)
+        self._y = y + 4 * MM
+
+    def _finish_page(self) -> None:
+        footer = f"Page {len(self._page_objs) + 1} | Generated {self.generated}"
+        x = (PAGE_W - self.width(footer, 8)) / 2
+        self._draw_text(x, PAGE_H - 15 * MM, 10 * MM, footer, 8, FOOT_COLOR)
+        content, page = self._alloc(), self._alloc()
+        self._stream(content, "\n".join(self._ops).encode("ascii"))
+        self._obj(page, (
+            f"<< /Type /Page /Parent {_PAGES} 0 R /MediaBox [0 0 {PAGE_W:.2f} {PAGE_H:.2f}] "
+            f"/Resources << /Font << /F1 {_FONT} 0 R >> >> /Contents {content} 0 R >>"
+        ).encode("ascii"))
+        self._page_objs.append(page)
+        self._ops = []
+
+    def _room(self, height: float) -> None:
+        if self._y + height > PAGE_H - BOTTOM:
+            self._finish_page()
+            self._start_page()
+
+    @property
+    def bytes_written(self) -> int:
+        return self._pos
+
+    # ── Content ──
+
+    def _wrap(self, line: str, size: float, max_width: float) -> list[str]:
+        """Greedy word wrap; words wider than a line are split by character."""
+        cw = self._metrics.cw
+        scale = size / 1000
+        space = cw[32] * scale
+        lines, current, current_w = [], [], 0.0
+        for word in line.split(" "):
+            w = sum(cw[ord(ch)] for ch in word) * scale
+            while w > max_width:
+                if current:
+                    lines.append(" ".join(current))
+                    current, current_w = [], 0.0
+                cut, cut_w = 0, 0.0
+                for ch in word:
+                    ch_w = cw[ord(ch)] * scale
+                    if cut and cut_w + ch_w > max_width:
+                        break
+                    cut, cut_w = cut + 1, cut_w + ch_w
+                lines.append(word[:cut])
+                word, w = word[cut:], w - cut_w
+            extra = w + (space if current else 0.0)
+            if current and current_w + extra > max_width:
+                lines.append(" ".join(current))
+                current, current_w = [word], w
+            else:
+                current.append(word)
+                current_w += extra
+        lines.append(" ".join(current))
+        return lines
+
+    def text(self, text: str, size: float = BODY_SIZE, line_height: float = BODY_LINE,
+             color: tuple[int, int, int] = TEXT_COLOR) -> None:
+        """Wrapped text; blank source lines add a small gap (as export_pdf does)."""
+        max_width = PAGE_W - 2 * MARGIN
+        for raw in text.split("\n"):
+            raw = raw.replace("\t", "    ").rstrip("\r")
+            if not raw.strip():
+                self.blank()
+                continue
+            for line in self._wrap(raw, size, max_width):
+                self._room(line_height)
+                self._draw_text(MARGIN, self._y, line_height, line, size, color)
+                self._y += line_height
+
+    def blank(self, height: float = BLANK_LINE) -> None:
+        self._y += height
+
+    def rule(self, color: tuple[int, int, int] = TITLE_RULE, width_mm: float = 0.5) -> None:
+        self._room(2 * MM)
+        self._rule(self._y, color, width_mm)
+
+    def bookmark(self, title: str) -> None:
+        """Outline entry pointing at the current position."""
+        self._bookmarks.append((title, len(self._page_objs), self._y))
+
+    def section(self, title: str, body: str) -> None:
+        """Bookmarked heading followed by body text; headings never end a page."""
+        self._room(12 * MM + BODY_LINE)
+        self.bookmark(title)
+        self.text(title, size=14, line_height=9 * MM, color=TITLE_COLOR)
+        self.text(body)
+        self.blank(6 * MM)
+
+    # ── Trailer ──
+
+    def _write_font(self) -> None:
+        m = self._metrics
+        font = ttLib.TTFont(io.BytesIO(self._font_data), recalcTimestamp=False, fontNumber=0, lazy=True)
+        options = ftsubset.Options(notdef_outline=True, recommended_glyphs=True, retain_gids=True)
+        options.drop_tables += _DROP_TABLES
+        subsetter = ftsubset.Subsetter(options)
+        subsetter.populate(gids=sorted(self._used) or [0])
+        subsetter.subset(font)
+        buf = io.BytesIO()
+        font.save(buf)
+        base_font = f"AAAAAA+{m.name}".encode("ascii")
+        self._stream(_FONTFILE, buf.getvalue(), b" /Length1 %d" % len(buf.getvalue()))
+
+        widths = " ".join(f"{gid} [{m.cw[ord(ch)]}]" for gid, ch in sorted(self._used.items()))
+        d = m.desc
+        self._obj(_DESCRIPTOR, (
+            f"<< /Type /FontDescriptor /FontName /{base_font.decode()} /Flags {d['flags'].value} "
+            f"/FontBBox {d['font_b_box']} /ItalicAngle {d['italic_angle']} /Ascent {d['ascent']} "
+            f"/Descent {d['descent']} /CapHeight {d['cap_height']} /StemV {d['stem_v']} "
+            f"/MissingWidth {d['missing_width']} /FontFile2 {_FONTFILE} 0 R >>").encode("ascii"))
+        self._obj(_CIDFONT, (
+            f"<< /Type /Font /Subtype /CIDFontType2 /BaseFont /{base_font.decode()} "
+            f"/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >> "
+            f"/FontDescriptor {_DESCRIPTOR} 0 R /DW {d['missing_width']} /W [{widths}] "
+            f"/CIDToGIDMap /Identity >>").encode("ascii"))
+
+        pairs = sorted(self._used.items())
+        chunks = []
+        for i in range(0, len(pairs), 100):
+            part = pairs[i:i + 100]
+            rows = "\n".join(f"<{gid:04X}> <{ch.encode('utf-16-be').hex().upper()}>" for gid, ch in part)
+            chunks.append(f"{len(part)} beginbfchar\n{rows}\nendbfchar")
+        cmap = ("/CIDInit /ProcSet findresource begin\n12 dict begin\nbegincmap\n"
+                "/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def\n"
+                "/CMapName /Adobe-Identity-UCS def\n/CMapType 2 def\n"
+                "1 begincodespacerange\n<0000> <FFFF>\nendcodespacerange\n"
+                + "\n".join(chunks) +
+                "\nendcmap\nCMapName currentdict /CMap defineresource pop\nend\nend")
+        self._stream(_TOUNICODE, cmap.encode("ascii"))
+        self._obj(_FONT, (
+            f"<< /Type /Font /Subtype /Type0 /BaseFont /{base_font.decode()} /Encoding /Identity-H "
+            f"/DescendantFonts [{_CIDFONT} 0 R] /ToUnicode {_TOUNICODE} 0 R >>").encode("ascii"))
+
+    def _write_outline(self) -> None:
+        nums = [self._alloc() for _ in self._bookmarks]
+        for i, (title, page, top) in enumerate(self._bookmarks):
+            links = f"/Parent {_OUTLINES} 0 R"
+            if i:
+                links += f" /Prev {nums[i - 1]} 0 R"
+            if i + 1 < len(nums):
+                links += f" /Next {nums[i + 1]} 0 R"
+            self._obj(nums[i], b"<< /Title " + _pdf_string(title) + (
+                f" {links} /Dest [{self._page_objs[page]} 0 R /XYZ 0 {PAGE_H - top:.2f} null] >>"
+            ).encode("ascii"))
+        if nums:
+            self._obj(_OUTLINES, f"<< /Type /Outlines /First {nums[0]} 0 R /Last {nums[-1]} 0 R "
+                                 f"/Count {len(nums)} >>".encode("ascii"))
+        else:
+            self._obj(_OUTLINES, b"<< /Type /Outlines /Count 0 >>")
+
+    def close(self) -> int:
+        """Finish the document; returns the page count. ``out`` is left open."""
+        self._finish_page()
+        if self._missing:
+            logger.warning("DejaVuSans has no glyph for: %s", " ".join(sorted(self._missing)[:40]))
+        self._write_font()
+        self._write_outline()
+        kids = " ".join(f"{n} 0 R" for n in self._page_objs)
+        self._obj(_PAGES, f"<< /Type /Pages /Kids [{kids}] /Count {len(self._page_objs)} >>".encode("ascii"))
+        mode = b" /PageMode /UseOutlines" if self._bookmarks else b""
+        self._obj(_CATALOG, b"<< /Type /Catalog /Pages %d 0 R /Outlines %d 0 R%s >>"
+                  % (_PAGES, _OUTLINES, mode))
+        self._obj(_INFO, b"<< /Title " + _pdf_string(self.title) + b" /Producer (Pic2Docs)"
+                  + b" /CreationDate (D:" + self.generated.replace("-", "").replace(":", "")
+                  .replace(" ", "").encode("ascii") + b") >>")
+
+        size = self._next_obj
+        xref = self._pos
+        rows = [b"0000000000 65535 f \n"]
+        for n in range(1, size):
+            offset = self._offsets.get(n)
+            rows.append(b"%010d 00000 n \n" % offset if offset is not None else b"0000000000 65535 f \n")
+        self._write(b"xref\n0 %d\n" % size + b"".join(rows))
+        self._write(b"trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+                    % (size, _CATALOG, _INFO, xref))
+        return len(self._page_objs)
+
+
+def write_sections(out: BinaryIO, sections: Iterable[tuple[str, str]], source: str,
+                   total: int | None = None,
+                   on_progress: Callable[[int, int, str], None] | None = None) -> int:
+    """
+    Stream a titled PDF of ``sections`` ((title, text) pairs) into ``out``.
+    ``on_progress(done, total, title)`` is called after each section
+    (``total`` is 0 when not given). Returns the page count.
+    """
+    pdf = StreamingPDF(out)
+    pdf.text("Extracted Text", size=18, line_height=12 * MM, color=TITLE_COLOR)
+    pdf.text(f"Source: {source}  |  {pdf.generated}", size=9, line_height=6 * MM, color=META_COLOR)
+    pdf.blank()
+    pdf.rule()
+    pdf.blank(8 * MM)
+    done = 0
+    for title, text in sections:
+        pdf.section(title, text)
+        done += 1
+        if on_progress:
+            on_progress(done, total or 0, title)
+    pages = pdf.close()
+    logger.info("Streamed %d sections → %d pages, %d bytes", done, pages, pdf.bytes_written)
+    return pages
@@ -0,0 +1,232 @@
+"""
+quota.py — Process-Wide Vision Quota Governor
+───────────────────────────────────────────────
+Keeps all sessions together under the Vision per-minute quota instead of
+letting one large batch trigger 429s for everyone.
+- Token bucket refilled at VISION_QUOTA_PER_MINUTE (1 token = 1 image)
+- Priority lanes per plan (pro > basic > free), smooth weighted
+  round-robin between lanes so free users are slowed, never starved
+- Per-user FIFO inside a lane, round-robin across users
+- Queue depth and expected wait for UI ETAs
+"""
+from __future__ import annotations
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from itertools import count
+
+logger = logging.getLogger("pic2docs.quota")
+
+PLAN_WEIGHTS: dict[str, int] = {"pro": 4, "basic": 2, "free": 1}
+DEFAULT_PLAN          = "free"
+QUOTA_PER_MINUTE      = int(os.environ.get("VISION_QUOTA_PER_MINUTE", 1800))
+QUOTA_MAX_WAIT        = float(os.environ.get("VISION_QUOTA_MAX_WAIT", 120))
+_ASYNC_POLL           = 0.1
+
+
+@dataclass
+class _Ticket:
+    units:   int
+    user:    str
+    plan:    str
+    seq:     int
+    granted: bool = False
+
+
+@dataclass
+class _Lane:
+    weight:  int
+    current: int = 0                                    # smooth WRR state
+    users:   OrderedDict[str, deque[_Ticket]] = field(default_factory=OrderedDict)
+
+
+class QuotaExceeded(Exception):
+    """Raised when a caller would wait longer than its timeout."""
+
+
+class QuotaGovernor:
+    """Thread-safe token bucket with a fair, plan-weighted wait queue."""
+
+    def __init__(self, per_minute: int = QUOTA_PER_MINUTE, burst: int | None = None):
+        self.rate = per_minute / 60.0
+        self.capacity = float(burst or max(16, per_minute // 10))
+        self._tokens = self.capacity
+        self._stamp = time.monotonic()
+        self._cond = threading.Condition()
+        self._lanes = {plan: _Lane(weight) for plan, weight in PLAN_WEIGHTS.items()}
+        self._seq = count()
+        self._head: _Ticket | None = None                # next ticket to serve
+        self.granted_units = 0
+
+    # ── Internals (call with the lock held) ──
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def _pick_head(self) -> _Ticket | None:
+        """Smooth weighted round-robin over non-empty lanes; oldest ticket of the next user."""
+        if self._head is not None:
+            return self._head
+        active = [lane for lane in self._lanes.values() if lane.users]
+        if not active:
+            return None
+        total = sum(lane.weight for lane in active)
+        for lane in active:
+            lane.current += lane.weight
+        lane = max(active, key=lambda l: l.current)
+        lane.current -= total
+        self._head = next(iter(lane.users.values()))[0]
+        return self._head
+
+    def _remove(self, ticket: _Ticket) -> None:
+        lane = self._lanes[ticket.plan]
+        queue = lane.users.get(ticket.user)
+        if queue is None:
+            return
+        try:
+            queue.remove(ticket)
+        except ValueError:
+            return
+        if queue:
+            lane.users.move_to_end(ticket.user)           # round-robin across users
+        else:
+            del lane.users[ticket.user]
+        if self._head is ticket:
+            self._head = None
+
+    def _try_grant(self, ticket: _Ticket) -> float:
+        """0.0 if granted now, else seconds until it could be."""
+        self._refill()
+        head = self._pick_head()
+        need = min(ticket.units, self.capacity)           # oversized asks run on a full bucket
+        if head is ticket and self._tokens >= need:
+            self._tokens -= ticket.units
+            ticket.granted = True
+            self.granted_units += ticket.units
+            self._remove(ticket)
+            self._cond.notify_all()
+            return 0.0
+        if head is ticket:
+            return max(0.01, (need - self._tokens) / self.rate)
+        # Not our turn: woken by notify_all when the head is served; this is only a fallback.
+        return max(0.01, (self._queued_units_before(ticket) + need - self._tokens) / self.rate)
+
+    def _queued_units_before(self, ticket: _Ticket | None, plan: str | None = None) -> int:
+        """Units that will be served before ``ticket`` (or a new ask on ``plan``), roughly."""
+        weight = PLAN_WEIGHTS.get(ticket.plan if ticket else plan or DEFAULT_PLAN, 1)
+        ahead = 0.0
+        for lane in self._lanes.values():
+            share = min(1.0, lane.weight / weight)
+            for queue in lane.users.values():
+                for t in queue:
+                    if t is ticket:
+                        break
+                    ahead += t.units * share
+        return int(ahead)
+
+    def _enqueue(self, units: int, user: str | None, plan: str | None) -> _Ticket:
+        plan = plan if plan in self._lanes else DEFAULT_PLAN
+        ticket = _Ticket(max(1, units), user or "anonymous", plan, next(self._seq))
+        self._lanes[plan].users.setdefault(ticket.user, deque()).append(ticket)
+        return ticket
+
+    # ── Public API ──
+
+    def acquire(self, units: int = 1, user: str | None = None, plan: str | None = None,
+                timeout: float | None = QUOTA_MAX_WAIT) -> None:
+        """Block until ``units`` tokens are granted; raises QuotaExceeded after ``timeout``."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            ticket = self._enqueue(units, user, plan)
+            try:
+                while True:
+                    wait = self._try_grant(ticket)
+                    if wait == 0.0:
+                        return
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise QuotaExceeded(f"Vision quota busy — about {wait:.0f}s wait.")
+                        wait = min(wait, remaining)
+                    self._cond.wait(wait)
+            finally:
+                if not ticket.granted:
+                    self._remove(ticket)
+                    self._cond.notify_all()
+
+    async def acquire_async(self, units: int = 1, user: str | None = None,
+                            plan: str | None = None,
+                            timeout: float | None = QUOTA_MAX_WAIT) -> None:
+        """acquire() for event loops: polls instead of blocking a thread."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            ticket = self._enqueue(units, user, plan)
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_grant(ticket)
+                if wait == 0.0:
+                    return
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise QuotaExceeded(f"Vision quota busy — about {wait:.0f}s wait.")
+                await asyncio.sleep(min(wait, _ASYNC_POLL))
+        finally:
+            if not ticket.granted:
+                with self._cond:
+                    self._remove(ticket)
+                    self._cond.notify_all()
+
+    def try_acquire(self, units: int = 1) -> bool:
+        """Take tokens only if nobody is queued and they are available now (hedges, probes)."""
+        with self._cond:
+            self._refill()
+            if self._pick_head() is None and self._tokens >= units:
+                self._tokens -= units
+                self.granted_units += units
+                return True
+            return False
+
+    def queue_depth(self) -> int:
+        """Images waiting for quota across all lanes."""
+        with self._cond:
+            return sum(t.units for lane in self._lanes.values()
+                       for queue in lane.users.values() for t in queue)
+
+    def expected_wait(self, units: int = 1, plan: str | None = None) -> float:
+        """Seconds a new request of ``units`` on ``plan`` would wait right now."""
+        with self._cond:
+            self._refill()
+            ahead = self._queued_units_before(None, plan)
+            return max(0.0, (ahead + min(units, self.capacity) - self._tokens) / self.rate)
+
+    def status(self, plan: str | None = None) -> dict:
+        with self._cond:
+            self._refill()
+            tokens = self._tokens
+        return {
+            "per_minute":    round(self.rate * 60),
+            "tokens":        round(tokens, 1),
+            "queue_depth":   self.queue_depth(),
+            "expected_wait": round(self.expected_wait(1, plan), 1),
+            "granted":       self.granted_units,
+        }
+
+
+_governor = QuotaGovernor()
+
+
+def get_governor() -> QuotaGovernor:
+    return _governor
+
+
+def set_governor(governor: QuotaGovernor) -> QuotaGovernor:
+    """Swap the process-wide governor; returns the previous one."""
+    global _governor
+    previous, _governor = _governor, governor
+    return previous
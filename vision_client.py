@@ -0,0 +1,460 @@
+"""
+vision_client.py — Pooled HTTP Transport for Google Vision
+────────────────────────────────────────────────────────────
+One keep-alive requests.Session shared by run_ocr and run_batch_ocr.
+- Connection pool sized to the batch worker count
+- Separate connect / read timeouts
+- Retries 429 / 5xx / connection errors with full-jitter backoff
+  (honours Retry-After)
+- Per-call deadlines: the remaining budget caps each attempt's timeouts
+  and the backoff sleeps between them
+- LatencyHistogram of successful calls; optional hedging (VISION_HEDGE=1)
+  sends a second request once a call outlives the observed p95
+- Swappable: set_transport() can point it at a local stand-in server
+- decode_response: JSON decode that drops per-symbol geometry as it goes
+- AsyncVisionTransport: httpx.AsyncClient twin for ocr_async, one per
+  event loop, configured from the sync transport
+"""
+from __future__ import annotations
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import weakref
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from typing import Callable
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger("pic2docs.vision")
+
+VISION_BASE_URL  = "https://vision.googleapis.com"
+ANNOTATE_PATH    = "/v1/images:annotate"
+DEFAULT_POOL     = 8
+HEDGE_QUANTILE   = 0.95
+HEDGE_MIN_DELAY  = 0.25          # never hedge sooner than this, whatever p95 says
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """The caller's time budget ran out before Vision answered."""
+
+
+def deadline_after(timeout: float | None) -> float | None:
+    """Absolute time.monotonic() deadline for a budget of ``timeout`` seconds."""
+    return None if timeout is None else time.monotonic() + timeout
+
+
+def time_left(deadline: float | None) -> float | None:
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def _trim_symbol(obj: dict) -> dict:
+    """object_hook: symbols keep only text and detectedBreak (boxes and languages dropped)."""
+    if "text" in obj and "pages" not in obj:
+        obj.pop("boundingBox", None)
+        obj.pop("confidence", None)
+        prop = obj.get("property")
+        if prop:
+            prop.pop("detectedLanguages", None)
+    return obj
+
+
+def decode_response(content: bytes) -> dict:
+    """
+    Decode an images:annotate response. Symbols are trimmed as soon as each
+    one is parsed, so their boxes (most of a dense page's JSON) never build
+    up in memory alongside the rest of the tree.
+    """
+    return json.loads(content, object_hook=_trim_symbol)
+
+
+class LatencyHistogram:
+    """
+    Thread-safe log-bucketed latency histogram (50 ms … ~60 s).
+    Counts are halved every ``window`` samples so quantiles follow drift.
+    """
+
+    BOUNDS = tuple(0.05 * 1.25 ** i for i in range(33))
+
+    def __init__(self, min_samples: int = 20, window: int = 2000):
+        self.min_samples = min_samples
+        self.window = window
+        self._counts = [0] * (len(self.BOUNDS) + 1)
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        i = next((i for i, b in enumerate(self.BOUNDS) if seconds <= b), len(self.BOUNDS))
+        with self._lock:
+            self._counts[i] += 1
+            self._total += 1
+            if self._total >= self.window:
+                self._counts = [c // 2 for c in self._counts]
+                self._total = sum(self._counts)
+
+    def quantile(self, q: float) -> float | None:
+        """Upper bound of the bucket holding the q-quantile; None until warmed up."""
+        with self._lock:
+            if self._total < self.min_samples:
+                return None
+            rank = q * self._total
+            seen = 0
+            for i, c in enumerate(self._counts):
+                seen += c
+                if seen >= rank:
+                    return self.BOUNDS[min(i, len(self.BOUNDS) - 1)]
+        return self.BOUNDS[-1]
+
+    def snapshot(self) -> dict:
+        return {"samples": self._total,
+                "p50": self.quantile(0.5), "p95": self.quantile(0.95)}
+
+
+@dataclass
+class RetryPolicy:
+    attempts:     int   = 3          # total tries, including the first
+    backoff_base: float = 0.5        # seconds; doubled per retry
+    backoff_max:  float = 8.0
+    statuses:     frozenset[int] = field(
+        default_factory=lambda: frozenset({429, 500, 502, 503, 504}))
+
+    def delay(self, retry_no: int, retry_after: str | None = None) -> float:
+        """Full-jitter exponential backoff; a numeric Retry-After wins if larger."""
+        cap = min(self.backoff_max, self.backoff_base * (2 ** retry_no))
+        wait = random.uniform(0, cap)
+        if retry_after:
+            try:
+                wait = max(wait, min(float(retry_after), self.backoff_max))
+            except ValueError:
+                pass
+        return wait
+
+
+class VisionTransport:
+    """Keep-alive HTTP client for the images:annotate endpoint."""
+
+    def __init__(self,
+                 base_url: str = VISION_BASE_URL,
+                 pool_size: int = DEFAULT_POOL,
+                 connect_timeout: float = 5.0,
+                 read_timeout: float = 30.0,
+                 retry: RetryPolicy | None = None,
+                 hedge: bool = False,
+                 latency: LatencyHistogram | None = None):
+        self.base_url = base_url.rstrip("/")
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retry = retry or RetryPolicy()
+        self.hedge = hedge
+        self.latency = latency or LatencyHistogram()
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.session = requests.Session()
+        self._lock = threading.Lock()      # guards pool_size and the hedge executor
+        self._hedge_pool: ThreadPoolExecutor | None = None
+        self._mount(pool_size)
+
+    def _mount(self, pool_size: int) -> None:
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.pool_size = pool_size
+
+    def ensure_pool_size(self, workers: int) -> None:
+        """
+        Grow the connection pool so ``workers`` threads never queue for a
+        socket, and the hedge executor with it (see _hedge_executor).
+        """
+        with self._lock:
+            if workers <= self.pool_size:
+                return
+            logger.info("Growing Vision connection pool %d → %d", self.pool_size, workers)
+            self._mount(workers)
+            if self._hedge_pool is not None:
+                # No resize in ThreadPoolExecutor: replace it. Calls already
+                # submitted still run to completion on the old one.
+                self._hedge_pool.shutdown(wait=False)
+                self._hedge_pool = None
+
+    def _hedge_executor(self) -> ThreadPoolExecutor:
+        """
+        Threads for hedged calls: a primary and a backup per pooled
+        connection, so primaries never queue behind the executor (which
+        would inflate the latency they record and trigger more hedges).
+        """
+        with self._lock:
+            if self._hedge_pool is None:
+                self._hedge_pool = ThreadPoolExecutor(max_workers=2 * self.pool_size,
+                                                      thread_name_prefix="vision-hedge")
+            return self._hedge_pool
+
+    @classmethod
+    def from_env(cls) -> "VisionTransport":
+        env = os.environ.get
+        return cls(
+            base_url=env("VISION_API_URL", VISION_BASE_URL),
+            pool_size=int(env("VISION_POOL_SIZE", DEFAULT_POOL)),
+            connect_timeout=float(env("VISION_CONNECT_TIMEOUT", 5)),
+            read_timeout=float(env("VISION_READ_TIMEOUT", 30)),
+            hedge=env("VISION_HEDGE", "0").lower() in ("1", "true", "yes"),
+        )
+
+    @property
+    def annotate_url(self) -> str:
+        return self.base_url + ANNOTATE_PATH
+
+    def hedge_delay(self, read_timeout: float) -> float | None:
+        """Seconds to wait before hedging, or None if hedging is off / not useful."""
+        if not self.hedge:
+            return None
+        p95 = self.latency.quantile(HEDGE_QUANTILE)
+        if p95 is None:
+            return None
+        delay = max(HEDGE_MIN_DELAY, p95)
+        return delay if delay < read_timeout else None
+
+    def _timeouts(self, deadline: float | None) -> tuple[float, float]:
+        left = time_left(deadline)
+        if left is None:
+            return self.connect_timeout, self.read_timeout
+        if left <= 0:
+            raise DeadlineExceeded("Vision call deadline exceeded.")
+        return min(self.connect_timeout, left), min(self.read_timeout, left)
+
+    def _send(self, payload: dict, api_key: str,
+              timeout: tuple[float, float]) -> requests.Response:
+        start = time.monotonic()
+        resp = self.session.post(self.annotate_url, params={"key": api_key},
+                                 json=payload, timeout=timeout)
+        if resp.ok:
+            self.latency.record(time.monotonic() - start)
+        return resp
+
+    def _send_hedged(self, payload: dict, api_key: str, timeout: tuple[float, float],
+                     delay: float, may_hedge: Callable[[], bool]) -> requests.Response:
+        pool = self._hedge_executor()
+        primary = pool.submit(self._send, payload, api_key, timeout)
+        done, _ = wait([primary], timeout=delay)
+        if done or not may_hedge():
+            return primary.result()
+        self.hedges += 1
+        logger.info("Vision call past p95 (%.2fs) — sending hedge", delay)
+        backup = pool.submit(
+            self._send, payload, api_key, (timeout[0], max(0.01, timeout[1] - delay)))
+        winner = _first_ok([primary, backup])
+        if winner is backup:
+            self.hedge_wins += 1
+        return winner.result()
+
+    def annotate(self, payload: dict, api_key: str,
+                 deadline: float | None = None,
+                 may_hedge: Callable[[], bool] | None = None) -> dict:
+        """
+        POST an images:annotate payload and return the decoded JSON.
+        ``deadline`` (time.monotonic()) bounds all attempts and backoff;
+        ``may_hedge`` is asked before sending a hedged duplicate (e.g. to
+        check quota). Raises requests exceptions once retries or the
+        budget run out.
+        """
+        attempts = max(1, self.retry.attempts)
+        for attempt in range(attempts):
+            last = attempt == attempts - 1
+            timeout = self._timeouts(deadline)
+            delay = self.hedge_delay(timeout[1]) if may_hedge else None
+            try:
+                if delay is None:
+                    resp = self._send(payload, api_key, timeout)
+                else:
+                    resp = self._send_hedged(payload, api_key, timeout, delay, may_hedge)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as exc:
+                wait_s = self.retry.delay(attempt)
+                if last or not _fits(deadline, wait_s):
+                    raise
+                logger.warning("Vision transport error (%s) — retry %d in %.2fs",
+                               type(exc).__name__, attempt + 1, wait_s)
+                time.sleep(wait_s)
+                continue
+
+            if resp.status_code in self.retry.statuses and not last:
+                wait_s = self.retry.delay(attempt, resp.headers.get("Retry-After"))
+                if _fits(deadline, wait_s):
+                    logger.warning("Vision HTTP %d — retry %d in %.2fs",
+                                   resp.status_code, attempt + 1, wait_s)
+                    resp.close()
+                    time.sleep(wait_s)
+                    continue
+
+            resp.raise_for_status()
+            return decode_response(resp.content)
+        raise RuntimeError("unreachable")
+
+    def stats(self) -> dict:
+        return {**self.latency.snapshot(), "hedge": self.hedge,
+                "hedges": self.hedges, "hedge_wins": self.hedge_wins}
+
+    def close(self) -> None:
+        with self._lock:
+            if self._hedge_pool is not None:
+                self._hedge_pool.shutdown(wait=False)
+                self._hedge_pool = None
+        self.session.close()
+
+
+def _fits(deadline: float | None, wait_s: float) -> bool:
+    """True if sleeping ``wait_s`` still leaves part of the budget for another try."""
+    left = time_left(deadline)
+    return left is None or wait_s < left - 0.05
+
+
+def _first_ok(futures: list[Future]) -> Future:
+    """First future to finish without raising (else the first one); losers are closed."""
+    pending = list(futures)
+    winner = None
+    while pending and winner is None:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in futures:
+            if fut in done:
+                pending.remove(fut)
+                if winner is None and fut.exception() is None:
+                    winner = fut
+    for fut in pending:
+        fut.add_done_callback(lambda f: f.exception() is None and f.result().close())
+    return winner or futures[0]
+
+
+class AsyncVisionTransport:
+    """httpx-based async counterpart of VisionTransport (same retry and hedge policy)."""
+
+    def __init__(self,
+                 base_url: str = VISION_BASE_URL,
+                 pool_size: int = DEFAULT_POOL,
+                 connect_timeout: float = 5.0,
+                 read_timeout: float = 30.0,
+                 retry: RetryPolicy | None = None,
+                 hedge: bool = False,
+                 latency: LatencyHistogram | None = None):
+        import httpx
+
+        self.base_url = base_url.rstrip("/")
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retry = retry or RetryPolicy()
+        self.hedge = hedge
+        self.latency = latency or LatencyHistogram()
+        self.hedges = 0
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=pool_size,
+                                max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        )
+
+    @classmethod
+    def like(cls, transport: VisionTransport, pool_size: int | None = None) -> "AsyncVisionTransport":
+        """Same endpoint and policies; shares the latency histogram with ``transport``."""
+        return cls(transport.base_url, pool_size or transport.pool_size,
+                   transport.connect_timeout, transport.read_timeout, transport.retry,
+                   transport.hedge, transport.latency)
+
+    hedge_delay = VisionTransport.hedge_delay
+    _timeouts = VisionTransport._timeouts
+
+    async def _send(self, payload: dict, api_key: str, timeout: tuple[float, float]):
+        import httpx
+
+        start = time.monotonic()
+        resp = await self.client.post(
+            self.base_url + ANNOTATE_PATH, params={"key": api_key}, json=payload,
+            timeout=httpx.Timeout(timeout[1], connect=timeout[0]))
+        if resp.is_success:
+            self.latency.record(time.monotonic() - start)
+        return resp
+
+    async def _send_hedged(self, payload: dict, api_key: str, timeout: tuple[float, float],
+                           delay: float, may_hedge: Callable[[], bool]):
+        primary = asyncio.ensure_future(self._send(payload, api_key, timeout))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or not may_hedge():
+            return await primary
+        self.hedges += 1
+        logger.info("Vision async call past p95 (%.2fs) — sending hedge", delay)
+        backup = asyncio.ensure_future(
+            self._send(payload, api_key, (timeout[0], max(0.01, timeout[1] - delay))))
+        pending = {primary, backup}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    for loser in pending:
+                        loser.cancel()
+                    return task.result()
+        return primary.result()                                 # both failed: primary's error
+
+    async def annotate(self, payload: dict, api_key: str,
+                       deadline: float | None = None,
+                       may_hedge: Callable[[], bool] | None = None) -> dict:
+        """Async VisionTransport.annotate; raises httpx exceptions when retries or budget run out."""
+        import httpx
+
+        attempts = max(1, self.retry.attempts)
+        for attempt in range(attempts):
+            last = attempt == attempts - 1
+            timeout = self._timeouts(deadline)
+            delay = self.hedge_delay(timeout[1]) if may_hedge else None
+            try:
+                if delay is None:
+                    resp = await self._send(payload, api_key, timeout)
+                else:
+                    resp = await self._send_hedged(payload, api_key, timeout, delay, may_hedge)
+            except httpx.TransportError as exc:
+                wait_s = self.retry.delay(attempt)
+                if last or not _fits(deadline, wait_s):
+                    raise
+                logger.warning("Vision async transport error (%s) — retry %d in %.2fs",
+                               type(exc).__name__, attempt + 1, wait_s)
+                await asyncio.sleep(wait_s)
+                continue
+
+            if resp.status_code in self.retry.statuses and not last:
+                wait_s = self.retry.delay(attempt, resp.headers.get("Retry-After"))
+                if _fits(deadline, wait_s):
+                    logger.warning("Vision HTTP %d — retry %d in %.2fs",
+                                   resp.status_code, attempt + 1, wait_s)
+                    await asyncio.sleep(wait_s)
+                    continue
+
+            resp.raise_for_status()
+            return decode_response(resp.content)
+        raise RuntimeError("unreachable")
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+_transport = VisionTransport.from_env()
+_async_transports: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def get_transport() -> VisionTransport:
+    return _transport
+
+
+def set_transport(transport: VisionTransport) -> VisionTransport:
+    """Swap the process-wide transport; returns the previous one."""
+    global _transport
+    previous, _transport = _transport, transport
+    _async_transports.clear()
+    return previous
+
+
+def get_async_transport() -> AsyncVisionTransport:
+    """Shared async transport for the running event loop (httpx clients are loop-bound)."""
+    loop = asyncio.get_running_loop()
+    transport = _async_transports.get(loop)
+    if transport is None:
+        transport = _async_transports[loop] = AsyncVisionTransport.like(_transport)
+    return transport
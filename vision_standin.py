@@ -0,0 +1,193 @@
+"""
+vision_standin.py — Local Google Vision Stand-In Server
+─────────────────────────────────────────────────────────
+Speaks the images:annotate JSON shape so load tests and benchmarks run
+without spending quota.
+- Configurable latency (fixed or uniform range) per call
+- Whole-call HTTP error rate (429 / 503) and per-image error rate
+- Canned fullTextAnnotation payloads, cycled per image
+
+  python vision_standin.py --port 8765 --latency 0.4 0.9 --error-rate 0.05
+  VISION_API_URL=http://127.0.0.1:8765 GOOGLE_VISION_API_KEY=dummy streamlit run app.py
+"""
+from __future__ import annotations
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from dataclasses import dataclass, field
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from itertools import count
+
+from vision_client import ANNOTATE_PATH
+
+logger = logging.getLogger("pic2docs.standin")
+
+
+def canned_annotation(text: str, confidence: float = 0.95) -> dict:
+    """A minimal but structurally complete fullTextAnnotation for ``text``."""
+    blocks = []
+    y = 10
+    for line in text.splitlines() or [""]:
+        words, x = [], 10
+        for word in line.split():
+            w = 12 * len(word)
+            symbols = [{"text": ch} for ch in word]
+            symbols[-1]["property"] = {"detectedBreak": {"type": "SPACE"}}
+            words.append({
+                "boundingBox": {"vertices": [
+                    {"x": x, "y": y}, {"x": x + w, "y": y},
+                    {"x": x + w, "y": y + 20}, {"x": x, "y": y + 20}]},
+                "confidence": confidence,
+                "symbols": symbols,
+            })
+            x += w + 12
+        if words:
+            words[-1]["symbols"][-1]["property"] = {"detectedBreak": {"type": "EOL_SURE_SPACE"}}
+            blocks.append({
+                "boundingBox": {"vertices": [
+                    {"x": 10, "y": y}, {"x": x, "y": y}, {"x": x, "y": y + 20}, {"x": 10, "y": y + 20}]},
+                "confidence": confidence,
+                "paragraphs": [{"confidence": confidence, "words": words}],
+            })
+        y += 30
+    return {"text": text + "\n", "pages": [{"width": 1000, "height": y + 10, "blocks": blocks}]}
+
+
+@dataclass
+class StandinConfig:
+    latency:          tuple[float, float] = (0.0, 0.0)   # seconds, uniform range per call
+    error_rate:       float = 0.0                          # whole call fails with error_status
+    error_status:     int   = 503
+    image_error_rate: float = 0.0                          # per-entry {"error": ...}
+    annotations:      list[dict] = field(default_factory=list)  # cycled; default echoes sizes
+
+
+class VisionStandin:
+    """Threaded HTTP server; use as a context manager or start()/stop()."""
+
+    def __init__(self, config: StandinConfig | None = None,
+                 host: str = "127.0.0.1", port: int = 0):
+        self.config = config or StandinConfig()
+        self.calls = 0
+        self.images = 0
+        self._counter = count()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "VisionStandin":
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name="vision-standin", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "VisionStandin":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _respond(self, entries: list[dict]) -> dict:
+        cfg = self.config
+        responses = []
+        for entry in entries:
+            n = next(self._counter)
+            if random.random() < cfg.image_error_rate:
+                responses.append({"error": {"code": 3, "message": "Bad image data (stand-in)."}})
+                continue
+            if cfg.annotations:
+                annotation = cfg.annotations[n % len(cfg.annotations)]
+            else:
+                size = len(entry.get("image", {}).get("content", ""))
+                annotation = canned_annotation(f"Stand-in result {n}\n{size} base64 bytes received")
+            responses.append({"fullTextAnnotation": annotation})
+        return {"responses": responses}
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send(self, status: int, body: dict) -> None:
+                raw = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length)
+                if self.path.split("?")[0] != ANNOTATE_PATH:
+                    self._send(404, {"error": {"code": 404, "message": "Not found"}})
+                    return
+                try:
+                    entries = json.loads(body)["requests"]
+                except Exception:
+                    self._send(400, {"error": {"code": 400, "message": "Invalid JSON payload"}})
+                    return
+                cfg = standin.config
+                with standin._lock:
+                    standin.calls += 1
+                    standin.images += len(entries)
+                time.sleep(random.uniform(*cfg.latency))
+                if random.random() < cfg.error_rate:
+                    self._send(cfg.error_status, {"error": {
+                        "code": cfg.error_status, "message": "Injected failure (stand-in)."}})
+                    return
+                self._send(200, standin._respond(entries))
+
+            def log_message(self, fmt, *args):
+                logger.debug(fmt, *args)
+
+        return Handler
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Local Google Vision stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, nargs="+", default=[0.0],
+                        help="seconds; one value or a MIN MAX range")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--image-error-rate", type=float, default=0.0)
+    parser.add_argument("--annotations", help="JSON file with a list of fullTextAnnotation objects")
+    args = parser.parse_args(argv)
+
+    annotations = []
+    if args.annotations:
+        with open(args.annotations, encoding="utf-8") as fh:
+            annotations = json.load(fh)
+    latency = (args.latency[0], args.latency[-1])
+    config = StandinConfig(latency=latency, error_rate=args.error_rate,
+                           error_status=args.error_status,
+                           image_error_rate=args.image_error_rate, annotations=annotations)
+    server = VisionStandin(config, args.host, args.port)
+    print(f"Vision stand-in listening on {server.url}{ANNOTATE_PATH}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())